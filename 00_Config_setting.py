@@ -1,16 +1,21 @@
 import os
 import glob
 import csv
-import sqlite3
-import obspy
-import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
 from obspy import UTCDateTime
-from obspy.clients.fdsn import Client
-from config_loader import load_config
+from fdsn_downloader import WaveformDownloader
+from download_manifest import DEFAULT_SETTLE_DAYS, DownloadManifest
+from sds_converter import ConversionState, build_day, list_outputs
+from mseed_scan import list_sds, scan_jobs, to_datetime
+import msnoise_db
+from instrumentation import stage, timed
+from msnoise_db import executemany_chunked
 from datetime import datetime
 
 METADATA_CSV = "downloaded_stations_metadata.csv"
 
+@timed("download")
 def step1_search_and_download(config):
     print("\n" + "="*60)
     print("STEP 1: Search & Download based on Config")
@@ -18,6 +23,7 @@ def step1_search_and_download(config):
 
     search_cfg = config.get("search_criteria", {})
     proc_cfg = config.get("seismic_processing", {})
+    download_cfg = config.get("download", {})
     
     start_time = UTCDateTime(search_cfg.get("start_date"))
     end_time   = UTCDateTime(search_cfg.get("end_date"))
@@ -25,6 +31,14 @@ def step1_search_and_download(config):
     clients    = search_cfg.get("clients", ["GFZ", "IRIS"])
     
     output_base_dir = proc_cfg.get("source_folder", "../Seismic_Data")
+    manifest_path = download_cfg.get("manifest_path") or os.path.join(
+        os.path.dirname(os.path.abspath(METADATA_CSV)), "download_manifest.sqlite")
+    manifest = DownloadManifest(manifest_path)
+    if manifest.is_empty():
+        seeded = manifest.seed_from_files(output_base_dir)
+        if seeded:
+            print(f"--> Manifest seeded with {seeded} existing day files")
+    downloader = WaveformDownloader(download_cfg, manifest=manifest)
     
     min_lat, max_lat = region.get("min_lat"), region.get("max_lat")
     min_lon, max_lon = region.get("min_lon"), region.get("max_lon")
@@ -39,14 +53,14 @@ def step1_search_and_download(config):
     print("\n--> Querying FDSN for available stations...")
     for client_name in clients:
         try:
-            client = Client(client_name, timeout=30)
-            inventory = client.get_stations(
-                network="*", station="*", location="*", channel=target_channels,
-                starttime=start_time, endtime=end_time,
-                minlatitude=min_lat, maxlatitude=max_lat,
-                minlongitude=min_lon, maxlongitude=max_lon,
-                level="channel" 
-            )
+            with downloader.pool(client_name).acquire() as client:
+                inventory = client.get_stations(
+                    network="*", station="*", location="*", channel=target_channels,
+                    starttime=start_time, endtime=end_time,
+                    minlatitude=min_lat, maxlatitude=max_lat,
+                    minlongitude=min_lon, maxlongitude=max_lon,
+                    level="channel" 
+                )
             
             valid_count = 0
             for net in inventory:
@@ -79,9 +93,11 @@ def step1_search_and_download(config):
 
         except Exception as e:
             print(f"    [{client_name}] Query info: {e}")
+            stage("download").error(f"{client_name} station query: {e}")
 
     if not station_metadata:
         print("No stations found in this region!")
+        manifest.close()
         return
 
     with open(METADATA_CSV, "w", newline="", encoding="utf-8") as csvfile:
@@ -92,7 +108,12 @@ def step1_search_and_download(config):
     print(f"--> Metadata saved to {METADATA_CSV}")
 
     total_days = int((end_time - start_time) / 86400) + 1
+    done = manifest.completed(start_time.strftime("%Y-%m-%d"),
+                              (start_time + (total_days - 1) * 86400).strftime("%Y-%m-%d"),
+                              int(download_cfg.get("settle_days", DEFAULT_SETTLE_DAYS)))
     
+    tasks = []
+    total_skipped = 0
     for sta_info in found_stations:
         net, sta = sta_info['net'], sta_info['sta']
         preferred_client = sta_info['client']
@@ -100,29 +121,33 @@ def step1_search_and_download(config):
         station_dir = os.path.join(output_base_dir, sta)
         if not os.path.exists(station_dir): os.makedirs(station_dir)
             
-        print(f"\nProcessing {net}.{sta} (Source: {preferred_client})")
+        skipped = 0
         for i in range(total_days):
             t1 = start_time + (i * 86400)
             t2 = t1 + 86400
             date_str = t1.strftime("%Y-%m-%d")
             filename = os.path.join(station_dir, f"{net}.{sta}.{date_str}.mseed")
             
-            if os.path.exists(filename):
-                print(f"  - {date_str}: Exists (Skipping).") 
+            if (net, sta, date_str) in done:
+                skipped += 1
                 continue
-            try:
-                client = Client(preferred_client, timeout=60)
-                st = client.get_waveforms(net, sta, "*", target_channels, t1, t2)
-                
-                if len(st) > 0:
-                    st.write(filename, format="MSEED")
-                    comps = list(set([tr.stats.channel for tr in st]))
-                    print(f"  - {date_str}: Downloaded {len(st)} traces. Chans: {comps}")
-                else:
-                    print(f"  - {date_str}: No data found on server.")
-            except Exception as e:
-                print(f"  - {date_str}: Failed ({str(e).splitlines()[0]})")
+            tasks.append({"net": net, "sta": sta, "client": preferred_client,
+                          "t1": t1, "t2": t2, "filename": filename})
+        total_skipped += skipped
+        print(f"  - {net}.{sta} (Source: {preferred_client}): {skipped} days already done (Skipping).")
+
+    print(f"\n--> Downloading {len(tasks)} station-days "
+          f"({downloader.max_workers} workers, {downloader.per_client} per data centre)...")
+    try:
+        stats = downloader.download(tasks, target_channels)
+    finally:
+        manifest.close()
+    print(f"--> Download finished: {stats.report()}")
+    stage("download").add(bytes_downloaded=stats.bytes, files_written=stats.downloaded,
+                          files_skipped=total_skipped, files_failed=stats.failed,
+                          requests=stats.requests, retries=stats.retries)
 
+@timed("sds")
 def step2_process_to_sds(config):
     print("\n" + "="*60)
     print("STEP 2: Processing Data to SDS Structure")
@@ -131,89 +156,181 @@ def step2_process_to_sds(config):
     proc_cfg = config.get("seismic_processing", {})
     source_folder = proc_cfg.get("source_folder")
     output_folder = proc_cfg.get("output_folder", "SDS")
+    workers = int(proc_cfg.get("workers") or os.cpu_count() or 1)
+    verbose = bool(proc_cfg.get("verbose", False))
     
     if not os.path.exists(output_folder): os.makedirs(output_folder)
     
+    raw_files = []
     search_path = os.path.join(source_folder, "*")
-    for station_dir in glob.glob(search_path):
+    for station_dir in sorted(glob.glob(search_path)):
         if not os.path.isdir(station_dir): continue
         
-        print(f"--> Scanning raw folder: {os.path.basename(station_dir)}")
-        for filepath in glob.glob(os.path.join(station_dir, "*.mseed")):
-            try:
-                st = obspy.read(filepath)
-                try:
-                    st.merge(method=1, fill_value='interpolate')
-                except: pass
-                ''' 
-                for tr in st:
-                    original_chan = tr.stats.channel
-                    if len(original_chan) >= 1:
-                        last_char = original_chan[-1].upper()
-                        if last_char in ['Z', 'N', 'E']:
-                            pass 
-                        else:
-                            tr.stats.channel = "HHZ"
-                    else:
-                        tr.stats.channel = "HHZ"
-                '''
-                for tr in st:
-                    original_chan = tr.stats.channel
-                    
-                    print(f"   [DEBUG] {tr.stats.network}.{tr.stats.station} original chanel: {original_chan}", end=" => ")
+        station_files = sorted(glob.glob(os.path.join(station_dir, "*.mseed")))
+        print(f"--> Scanning raw folder: {os.path.basename(station_dir)} ({len(station_files)} files)")
+        raw_files.extend(station_files)
 
-                    if len(original_chan) >= 1:
-                        last_char = original_chan[-1].upper()
-                        
-                        if last_char in ['Z', 'N', 'E']:
-                            print(f"Keep the chanels ({original_chan})") 
-                            pass 
-                        
-                        elif last_char == '1':
-                            new_chan = original_chan[:-1] + 'N'
-                            tr.stats.channel = new_chan
-                            print(f"Modify the chanel ({original_chan} -> {new_chan})") 
-
-                        elif last_char == '2':
-                            new_chan = original_chan[:-1] + 'E'
-                            tr.stats.channel = new_chan
-                            print(f"Modify the chanel ({original_chan} -> {new_chan})") 
-
-                        else:
-                            tr.stats.channel = "HHZ"
-                            print(f"Force the component of DAS to Z (bc it's {last_char})") 
-                            
-                    else:
-                        tr.stats.channel = "HHZ"
-                        print("Force the component of DAS to Z (because no channel name)")
-                    start_time = tr.stats.starttime
-                    end_time = tr.stats.endtime
-                    current_time = UTCDateTime(start_time.date)
-                    
-                    while current_time < end_time:
-                        next_day = current_time + 86400
-                        slice_start = current_time
-                        slice_end = next_day - 0.000001
-                        
-                        day_slice = tr.slice(starttime=slice_start, endtime=slice_end)
-                        if day_slice.stats.npts > 0:
-                            year = str(current_time.year)
-                            net, sta, chan = day_slice.stats.network, day_slice.stats.station, day_slice.stats.channel
-                            
-                            save_dir = os.path.join(output_folder, year, net, sta)
-                            if not os.path.exists(save_dir): os.makedirs(save_dir)
-                            
-                            doy = current_time.julday
-                            fname = f"{net}.{sta}..{chan}.D.{year}.{doy:03d}"
-                            
-                            final_path = os.path.join(save_dir, fname)
-                            if not os.path.exists(final_path):
-                                day_slice.write(final_path, format="MSEED")
-                        current_time = next_day
-            except Exception as e:
-                pass
+    state = None
+    unchanged = 0
+    if proc_cfg.get("incremental", True):
+        state = ConversionState(proc_cfg.get("state_path", "sds_conversion_state.sqlite"),
+                                use_hash=bool(proc_cfg.get("state_hash", False)))
+        new_files, changed_files, unchanged = state.plan(raw_files)
+        print(f"--> {len(new_files)} new, {len(changed_files)} changed, "
+              f"{unchanged} unchanged raw files (unchanged are skipped)")
+        raw_files = new_files + changed_files
+
+    started = time.monotonic()
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 and len(raw_files) > 1 else None
+    try:
+        def run_all(func, *iterables):
+            if executor is None:
+                return [func(*args) for args in zip(*iterables)]
+            n = len(iterables[0])
+            return list(executor.map(func, *iterables, chunksize=max(1, n // (workers * 8))))
+
+        # Phase 1: the SDS day files each raw file reaches, from its headers only.
+        listings = run_all(list_outputs, raw_files, [verbose] * len(raw_files))
+        listed = [r for r in listings if not r["error"]]
+        sources = {}
+        for r in listed:
+            for rel in r["outputs"]:
+                sources.setdefault(rel, set()).add(os.path.abspath(r["path"]))
+        if state is not None:
+            # Days a changed raw file used to reach are rebuilt too, so data it
+            # no longer holds disappears instead of lingering in the SDS tree.
+            for rel in state.outputs(r["path"] for r in listed):
+                sources.setdefault(rel, set())
+            # Unchanged raw files that spill into the same days are read again;
+            # the converted files' old outputs are superseded by their new listing.
+            for rel, paths in state.contributors(sources, exclude=[r["path"] for r in listed]).items():
+                sources[rel] |= {p for p in paths if os.path.exists(p)}
+
+        # Phase 2: each affected day rebuilt from all of its raw files at once.
+        days = sorted(sources)
+        if executor is not None:
+            print(f"--> Converting {len(raw_files)} files into {len(days)} SDS day files "
+                  f"with {workers} worker processes...")
+        results = run_all(build_day, days, [sorted(sources[d]) for d in days],
+                          [output_folder] * len(days))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    elapsed = max(time.monotonic() - started, 1e-9)
+
+    failed_days = {r["path"] for r in results if r["error"]}
+    if state is not None:
+        # A raw file whose days did not all get written is retried next run.
+        state.record([r for r in listed if not failed_days.intersection(r["outputs"])])
+        state.close()
+
+    sds_stage = stage("sds")
+    failed = [r for r in listings if r["error"]] + [r for r in results if r["error"]]
+    for r in failed:
+        print(f"   ! Failed {r['path']}: {r['error']}")
+        sds_stage.error(f"{r['path']}: {r['error']}")
+    for r in results:
+        for warning in r["warnings"]:
+            print(f"   ! {r['path']}: {warning}")
+            sds_stage.error(f"{r['path']}: {warning}")
+    samples = sum(r["samples"] for r in results)
+    written = sum(r["written"] for r in results)
+    removed = sum(r["removed"] for r in results)
+    if removed:
+        print(f"--> Removed {removed} SDS day files no raw file reaches any more")
+    sds_stage.add(files_read=len(listed), files_written=written, files_removed=removed,
+                  files_skipped=unchanged, files_failed=len(failed), samples=samples)
+    print(f"--> {len(raw_files)} raw files ({len(listings) - len(listed)} failed) -> {written} SDS day files "
+          f"({len(failed_days)} failed) in {elapsed:.1f}s ({len(raw_files) / elapsed:.2f} files/s, "
+          f"{samples / elapsed:,.0f} samples/s)")
     print("SDS Structure Update Completed.")
 
+SCAN_STATE_TABLE = "sds_scan_state"
+
+def _availability_row(r):
+    return (r["net"], r["sta"], r["chan"], r["path"], r["file"],
+            to_datetime(r["starttime"]), to_datetime(r["endtime"]),
+            r["data_duration"], r["gaps_duration"], r["samplerate"])
+
+def _stat_sds(jobs, sds_root):
+    disk = {}
+    for root, files in jobs:
+        rel_dir = os.path.relpath(root, sds_root)
+        for file in files:
+            st = os.stat(os.path.join(root, file))
+            disk[(rel_dir, file)] = (st.st_size, st.st_mtime_ns)
+    return disk
+
+AVAILABILITY_INSERT = """
+        INSERT INTO data_availability (net, sta, comp, path, file, starttime, endtime, data_duration, gaps_duration, samplerate, flag)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'N')
+"""
+
+def _save_scan_state(conn, disk, keys, commit=True):
+    executemany_chunked(conn, f"INSERT OR REPLACE INTO {SCAN_STATE_TABLE} (path, file, size, mtime_ns) VALUES (?, ?, ?, ?)",
+                        ((k[0], k[1]) + disk[k] for k in keys), commit=commit)
+
+def _scan_availability_full(conn, jobs, sds_root, workers):
+    scanned = scan_jobs(jobs, sds_root, workers)
+    n_files = sum(len(files) for _, files in jobs)
+    stage("scan").add(files_read=len(scanned), files_failed=n_files - len(scanned))
+    disk = _stat_sds(jobs, sds_root)
+    # One transaction: WAL readers (e.g. msnoise new_jobs) see either the old
+    # table or the complete new one, never an empty or half-filled one.
+    with conn:
+        conn.execute("DELETE FROM data_availability")
+        conn.execute(f"DELETE FROM {SCAN_STATE_TABLE}")
+        executemany_chunked(conn, AVAILABILITY_INSERT, (_availability_row(r) for r in scanned), commit=False)
+        _save_scan_state(conn, disk, disk.keys(), commit=False)
+    return len(scanned), 0, 0
+
+def _scan_availability_incremental(conn, jobs, sds_root, sds_full_path, workers):
+    disk = _stat_sds(jobs, sds_root)
+    known_state = {(p, f): (size, mtime) for p, f, size, mtime in conn.execute(
+        f"SELECT path, file, size, mtime_ns FROM {SCAN_STATE_TABLE}")}
+    known_rows = {(row[0], row[1]): row[2:] for row in conn.execute(
+        "SELECT path, file, starttime, endtime, data_duration, gaps_duration FROM data_availability")}
+
+    todo = {}
+    for key, stat in disk.items():
+        if known_state.get(key) != stat or key not in known_rows:
+            todo.setdefault(key[0], []).append(key[1])
+    roots = {os.path.relpath(root, sds_root): root for root, _ in jobs}
+    scanned = scan_jobs([(roots[rel], files) for rel, files in todo.items()], sds_root, workers)
+    n_todo = sum(len(files) for files in todo.values())
+    stage("scan").add(files_read=len(scanned), files_failed=n_todo - len(scanned),
+                      files_skipped=len(disk) - n_todo)
+
+    inserts, updates = [], []
+    for r in scanned:
+        row = _availability_row(r)
+        old = known_rows.get((r["path"], r["file"]))
+        if old is None:
+            inserts.append(row)
+        elif (str(old[0]) != str(row[5]) or str(old[1]) != str(row[6])
+              or abs(float(old[2]) - row[7]) > 1e-6 or abs(float(old[3] or 0) - row[8]) > 1e-6):
+            # Same flag MSNoise's own scan_archive sets, so new_jobs picks the day up again.
+            updates.append(row[:3] + row[5:] + row[3:5])
+
+    prefix = os.path.relpath(sds_full_path, sds_root)
+    removed = [k for k in known_rows if k not in disk
+               and (k[0] == prefix or k[0].startswith(prefix + os.sep))]
+
+    # Availability rows go first and the scan state last: if the run dies in
+    # between, the next scan re-reads those files and finds nothing to change.
+    executemany_chunked(conn, AVAILABILITY_INSERT, inserts)
+    executemany_chunked(conn, """
+        UPDATE data_availability
+        SET net = ?, sta = ?, comp = ?, starttime = ?, endtime = ?, data_duration = ?, gaps_duration = ?, samplerate = ?, flag = 'M'
+        WHERE path = ? AND file = ?
+    """, updates)
+    executemany_chunked(conn, "DELETE FROM data_availability WHERE path = ? AND file = ?", removed)
+    executemany_chunked(conn, f"DELETE FROM {SCAN_STATE_TABLE} WHERE path = ? AND file = ?",
+                        [k for k in known_state if k not in disk])
+    _save_scan_state(conn, disk, [(rel, f) for rel, files in todo.items() for f in files])
+    return len(inserts), len(updates), len(removed)
+
+@timed("scan")
 def step3_scan_to_db(config):
     print("\n" + "="*60)
     print("STEP 3: Update DB & Scan SDS")
@@ -228,35 +345,38 @@ def step3_scan_to_db(config):
     if not os.path.exists(db_path):
         print(f"Hey, there is no {db_path}！")
         print("Please run this before this script: msnoise db init")
-        return 
+        # Nothing downstream can run without the database: fail the stage.
+        raise FileNotFoundError(f"{db_path} does not exist")
 
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    conn = msnoise_db.connect(db_path)
 
     try:
         start_date = search_cfg.get("start_date", "1970-01-01")
         end_date = search_cfg.get("end_date", "2099-01-01")
         today_str = datetime.now().strftime("%Y-%m-%d")
 
-        cursor.execute("INSERT OR REPLACE INTO config (name, value) VALUES ('components_to_compute', 'ZZ,NN,EE')")
-        cursor.execute("INSERT OR REPLACE INTO config (name, value) VALUES ('data_folder', ?)", (sds_root,))
-        cursor.execute("INSERT OR REPLACE INTO config (name, value) VALUES ('data_structure', 'SDS')")
-        cursor.execute("INSERT OR REPLACE INTO config (name, value) VALUES ('data_type', 'D')")
-        cursor.execute("INSERT OR REPLACE INTO config (name, value) VALUES ('startdate', ?)", (start_date,))
-        cursor.execute("INSERT OR REPLACE INTO config (name, value) VALUES ('enddate', ?)", (end_date,))
-        cursor.execute("INSERT OR REPLACE INTO config (name, value) VALUES ('ref_end', ?)", (today_str,))
-        cursor.execute("INSERT OR REPLACE INTO config (name, value) VALUES ('components_to_compute_single_station', 'ZZ,NN,EE,ZN,ZE,NE')")
+        msnoise_db.set_config(conn, {
+            "components_to_compute": "ZZ,NN,EE",
+            "data_folder": sds_root,
+            "data_structure": "SDS",
+            "data_type": "D",
+            "startdate": start_date,
+            "enddate": end_date,
+            "ref_end": today_str,
+            "components_to_compute_single_station": "ZZ,NN,EE,ZN,ZE,NE",
+        })
 
         if os.path.exists(METADATA_CSV):
             print("--> Loading station coordinates from CSV...")
-            cursor.execute("DELETE FROM stations")
             with open(METADATA_CSV, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    cursor.execute("""
-                        INSERT INTO stations (net, sta, X, Y, altitude, coordinates, instrument, used)
-                        VALUES (?, ?, ?, ?, ?, 'DEG', 'INST', 1)
-                    """, (row['Network'], row['Station'], float(row['Longitude']), float(row['Latitude']), float(row['Elevation'])))
+                stations = [(row['Network'], row['Station'], float(row['Longitude']),
+                             float(row['Latitude']), float(row['Elevation']))
+                            for row in csv.DictReader(f)]
+            conn.execute("DELETE FROM stations")
+            conn.executemany("""
+                INSERT INTO stations (net, sta, X, Y, altitude, coordinates, instrument, used)
+                VALUES (?, ?, ?, ?, ?, 'DEG', 'INST', 1)
+            """, stations)
         else:
             print("Warning: No metadata CSV found.")
 
@@ -267,14 +387,10 @@ def step3_scan_to_db(config):
             
         print(f"--> Updating Filters (Found {len(raw_filters)} filters)...")
         
-        cursor.execute("DELETE FROM filters")
-        
+        filter_rows = []
         for fcfg in raw_filters:
             try:
-                cursor.execute("""
-                    INSERT INTO filters (ref, low, mwcs_low, high, mwcs_high, rms_threshold, mwcs_wlen, mwcs_step, used)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1)
-                """, (
+                filter_rows.append((
                     fcfg['ref'], 
                     fcfg['low'], 
                     fcfg['mwcs_low'], 
@@ -285,11 +401,24 @@ def step3_scan_to_db(config):
                     fcfg['mwcs_step']
                 ))
                 print(f"    - Added Filter ID {fcfg['ref']}: {fcfg['low']}-{fcfg['high']} Hz")
-            except Exception as e_filt:
-                print(f"    ! Error adding filter {fcfg.get('ref', '?')}: {e_filt}")
+            except KeyError as e_filt:
+                print(f"    ! Error adding filter {fcfg.get('ref', '?')}: missing {e_filt}")
+
+        conn.execute("DELETE FROM filters")
+        conn.executemany("""
+            INSERT INTO filters (ref, low, mwcs_low, high, mwcs_high, rms_threshold, mwcs_wlen, mwcs_step, used)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1)
+        """, filter_rows)
+        conn.commit()
 
         print("--> Scanning SDS files to update database...")
-        cursor.execute("DELETE FROM data_availability")
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {SCAN_STATE_TABLE} (
+                path TEXT NOT NULL, file TEXT NOT NULL,
+                size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,
+                PRIMARY KEY (path, file)
+            )
+        """)
         
         sds_folder_name = config.get("seismic_processing", {}).get("output_folder", "SDS")
         sds_full_path = os.path.abspath(sds_folder_name)
@@ -297,37 +426,35 @@ def step3_scan_to_db(config):
         if not os.path.exists(sds_full_path):
              sds_full_path = os.path.join(sds_root, "SDS")
 
-        count = 0
-        for root, dirs, files in os.walk(sds_full_path):
-            for file in files:
-                try:
-                    st = obspy.read(os.path.join(root, file), headonly=True)
-                    tr = st[0]
-                    rel_dir = os.path.relpath(root, sds_root)
-                    
-                    cursor.execute("""
-                        INSERT INTO data_availability (net, sta, comp, path, file, starttime, endtime, data_duration, gaps_duration, samplerate, flag)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, ?, 'N')
-                    """, (tr.stats.network, tr.stats.station, tr.stats.channel, rel_dir, file, 
-                          tr.stats.starttime.datetime, tr.stats.endtime.datetime, 
-                          tr.stats.endtime - tr.stats.starttime, tr.stats.sampling_rate))
-                    count += 1
-                except: pass
+        workers = int(scan_cfg.get("workers") or os.cpu_count() or 1)
+        started = time.monotonic()
+        jobs = list_sds(sds_full_path)
+        if scan_cfg.get("incremental", True):
+            added, modified, removed = _scan_availability_incremental(
+                conn, jobs, sds_root, sds_full_path, workers)
+        else:
+            added, modified, removed = _scan_availability_full(conn, jobs, sds_root, workers)
+        stage("scan").add(rows_inserted=added, rows_updated=modified, rows_deleted=removed)
+        count = conn.execute("SELECT COUNT(*) FROM data_availability").fetchone()[0]
+        elapsed = max(time.monotonic() - started, 1e-9)
+        print(f"--> {added} new (N), {modified} modified (M), {removed} removed "
+              f"in {elapsed:.1f}s ({workers} workers)")
         
         print(f"Scan complete. {count} files registered in database.")
         conn.commit()
 
     except Exception as e:
+        conn.rollback()
         print(f"DB Error: {e}")
+        raise
     finally:
-        conn.close()
+        msnoise_db.close(db_path)
 
 if __name__ == "__main__":
-    try:
-        conf = load_config()
-        step1_search_and_download(conf)
-        step2_process_to_sds(conf)
-        step3_scan_to_db(conf)
+    # Stage selection, date ranges and change tracking live in pipeline.py;
+    # by default this script runs its own three stages, e.g.
+    #   python 00_Config_setting.py --stages sds,scan --start 2025-01-01
+    import pipeline
+    results = pipeline.main(default_stages=("download", "sds", "scan"), report_name="00_Config_setting")
+    if all(status in ("done", "skipped") for status in results.values()):
         print("\nAll Done! Now you can run 'msnoise new_jobs --init' and 'msnoise compute_cc'.")
-    except Exception as e:
-        print(f"Execution Error: {e}")
\ No newline at end of file
@@ -1,173 +1,190 @@
 # %%
-import obspy
-import matplotlib.pyplot as plt
-import numpy as np
 import os
 import sys
 from config_loader import load_config
+import instrumentation
+from instrumentation import stage, timed
+from catalog import station_pair
+from loader_cache import read_stream, shared
+from plot_setup import pixel_budget, pyplot, render_settings
 
-plt.rcParams['font.family'] = 'Nimbus Sans'
-plt.rcParams['font.size'] = 13
 
-config = load_config()
-viz_config = config.get("visualization", {})
+# %%
+@timed("ccf_plot")
+def plot_single_ccf(config):
+    from ccf_processing import crop, lag_axis, lag_mask, normalize
+
+    viz_config = config.get("visualization", {})
 
-cc_files_template = viz_config.get("cc_files_template") 
-dtt_folder_template = viz_config.get("dtt_folder_template")
+    cc_files_template = viz_config.get("cc_files_template")
 
-f_set = viz_config.get("filter_set")
-comp = viz_config.get("component")  
-ccf_date = viz_config.get("ccf_date")
-figs_folder = viz_config.get("figs_folder")
-raw_sta1 = viz_config.get("station1")
-raw_sta2 = viz_config.get("station2")
+    f_set = viz_config.get("filter_set")
+    comp = viz_config.get("component")
+    ccf_date = viz_config.get("ccf_date")
+    figs_folder = viz_config.get("figs_folder")
+    raw_sta1 = viz_config.get("station1")
+    raw_sta2 = viz_config.get("station2")
 
-base_path = cc_files_template.format(filter_set=f_set, component=comp)
+    base_path = cc_files_template.format(filter_set=f_set, component=comp)
+    station_pair_folder = station_pair(raw_sta1, raw_sta2)
 
-sta1_str = raw_sta1.replace("-", "_")
-sta2_str = raw_sta2.replace("-", "_")
-pair_list = sorted([sta1_str, sta2_str])
-station_pair_folder = f"{pair_list[0]}_{pair_list[1]}"
+    file_path = os.path.join(base_path, station_pair_folder, f"{ccf_date}.MSEED")
 
-file_path = os.path.join(base_path, station_pair_folder, f"{ccf_date}.MSEED")
+    print(f"Plot for {comp}")
+    print(f"Reading the path: {file_path}")
 
-print(f"Plot for {comp}")
-print(f"Reading the path: {file_path}")
+    if not os.path.exists(figs_folder):
+        os.makedirs(figs_folder)
 
+    st = read_stream(file_path, cache=shared(viz_config))
+    print(f"{len(st)} Traces in this stream")
 
-if not os.path.exists(figs_folder):
-    os.makedirs(figs_folder)
+    net1, name1 = raw_sta1.split("-")
+    net2, name2 = raw_sta2.split("-")
 
-st = obspy.read(file_path)
-print(f"{len(st)} Traces in this stream")
+    tr = st[0]
 
-net1, name1 = raw_sta1.split("-")
-net2, name2 = raw_sta2.split("-")
+    npts = tr.stats.npts
+    sampling_rate = tr.stats.sampling_rate
+    # The heatmap's ccf_max_lag does not apply here: the full lag range unless a crop is asked for.
+    ccf_max_lag = viz_config.get("ccf_single_max_lag")
+    time_axis = crop(lag_axis(npts, sampling_rate), sampling_rate, ccf_max_lag)
+    maxlag = time_axis[-1]
 
-tr = st[0] 
+    # The single-CCF plot keeps raw amplitudes unless a normalization is asked for.
+    single_norm = viz_config.get("ccf_single_normalization", "none")
+    norm_window = viz_config.get("ccf_norm_window")
+    data = normalize(crop(tr.data, sampling_rate, ccf_max_lag), single_norm,
+                     lag_mask(len(time_axis), sampling_rate, *norm_window) if norm_window else None)
 
-npts = tr.stats.npts
-sampling_rate = tr.stats.sampling_rate
-maxlag = (npts - 1) / 2 / sampling_rate
-time_axis = np.linspace(-maxlag, maxlag, npts)
-data = tr.data
+    render_mode, dpi = render_settings(viz_config)
+    figsize = (10, 5)
+    if render_mode != "full":
+        # At most two points per pixel column: the min/max envelope draws the same line.
+        from render import envelope
+        time_axis, data = envelope(time_axis, data, pixel_budget(figsize, dpi)[0])
 
-plt.figure(figsize=(10, 5))
-plt.plot(time_axis, data, color='black', linewidth=0.8)
+    plt = pyplot()
+    plt.figure(figsize=figsize)
+    plt.plot(time_axis, data, color='black', linewidth=0.8)
 
-title_str = f"CCF: {raw_sta1} - {raw_sta2} ({comp})\nDate: {ccf_date} | Filter: {f_set}"
-plt.title(title_str)
-plt.xlabel("Lag Time (s)")
-plt.ylabel("Amplitude")
-plt.xlim(-maxlag, maxlag) 
-plt.grid(True, which='both', linestyle='--', alpha=0.5)
-plt.tight_layout()
+    title_str = f"CCF: {raw_sta1} - {raw_sta2} ({comp})\nDate: {ccf_date} | Filter: {f_set}"
+    plt.title(title_str)
+    plt.xlabel("Lag Time (s)")
+    plt.ylabel("Amplitude" if single_norm == "none" else "Normalized Amplitude")
+    plt.xlim(-maxlag, maxlag)
+    plt.grid(True, which='both', linestyle='--', alpha=0.5)
+    plt.tight_layout()
 
-out_name = f"CCF_{name1}_{name2}_{comp}_{f_set}_{ccf_date}.png"
-save_path = os.path.join(figs_folder, out_name)
+    out_name = f"CCF_{name1}_{name2}_{comp}_{f_set}_{ccf_date}.png"
+    save_path = os.path.join(figs_folder, out_name)
 
-plt.savefig(save_path, dpi=300)
+    plt.savefig(save_path, dpi=dpi)
+    plt.close()
+    stage("ccf_plot").add(files_read=1, samples=npts, files_written=1)
+    return save_path
 
 #
 # DVV
 #
-import matplotlib.pyplot as plt
-import pandas as pd
-import numpy as np
-import os
-import glob
-import sys
-from config_loader import load_config
-
-plt.rcParams['font.family'] = 'Nimbus Sans'
-plt.rcParams['font.size'] = 13
-
-config = load_config()
-viz_config = config.get("visualization", {})
-
-dtt_template = viz_config.get("dtt_folder_template")
-f_set = viz_config.get("filter_set")
-comp = viz_config.get("component")
-figs_folder = viz_config.get("figs_folder")
-dvv_mode = viz_config.get("dvv_target", "ALL")
-
-dtt_folder = dtt_template.format(filter_set=f_set, component=comp)
-
-if dvv_mode == "ALL":
-    target_name = "ALL"
-    print("Mode: (ALL)")
-else:
-    raw_s1 = viz_config.get("station1")
-    raw_s2 = viz_config.get("station2")
-    
-    s1 = raw_s1.replace("-", "_")
-    s2 = raw_s2.replace("-", "_")
-    
-    pair_list = sorted([s1, s2])
-    target_name = f"{pair_list[0]}_{pair_list[1]}"
-    print(f"Mode: Stations Pair ({target_name})")
-
-txt_files = sorted(glob.glob(os.path.join(dtt_folder, "*.txt")))
-
-if not txt_files:
-    print(f"Error: There is no .txt file: {dtt_folder}")
-    sys.exit(1)
-
-print(f"{len(txt_files)} dtt files are found, processing...")
-
-data_list = []
-
-for f in txt_files:
-    try:
-        df_temp = pd.read_csv(f)
-        
-        row = df_temp[df_temp['Pairs'] == target_name]
-        
-        if not row.empty:
-            val_m0 = row.iloc[0]['M0']
-            val_em0 = row.iloc[0]['EM0']
-            val_date = row.iloc[0]['Date']
-            
-            data_list.append({
-                'day': val_date,
-                'm0': val_m0,
-                'error': val_em0
-            })
-            
-    except Exception as e:
-        print(f"Error {f}: {e}")
-        continue
-
-if not data_list:
-    print(f"warning: there is no data for {target_name} in the DTT files.")
-    sys.exit(1)
-
-df = pd.DataFrame(data_list)
-df['day'] = pd.to_datetime(df['day'])
-df = df.sort_values('day')
-
-dvv_percent = -df['m0'] * 100
-err_percent = df['error'] * 100
-
-if not os.path.exists(figs_folder):
-    os.makedirs(figs_folder)
-
-plt.figure(figsize=(10, 5))
-
-plt.errorbar(df['day'], dvv_percent, yerr=err_percent, 
-             fmt='o-', color='black', ecolor='gray', 
-             capsize=3, markersize=4, linewidth=1, label=target_name)
-
-title_str = f"Relative Velocity Change (dv/v)\nTarget: {target_name} | Filter: {f_set} ({comp})"
-plt.title(title_str)
-plt.xlabel("Date")
-plt.ylabel("dv/v (%)")
-
-plt.xlim(df['day'].min(), df['day'].max())
-plt.xticks(rotation=30)
-plt.grid(True, linestyle='--', alpha=0.5)
-plt.tight_layout()
-
-out_filename = f"dv_v_{target_name}_{f_set}_{comp}.png"
-save_path = os.path.join(figs_folder, out_filename)
-plt.savefig(save_path, dpi=300)
+# %%
+@timed("dvv_plot")
+def plot_dvv(config):
+    from catalog import open_catalog, split_folder
+    from dtt_store import DTTStore
+    from dvv_aggregation import aggregate
+
+    viz_config = config.get("visualization", {})
+
+    dtt_template = viz_config.get("dtt_folder_template")
+    f_set = viz_config.get("filter_set")
+    comp = viz_config.get("component")
+    figs_folder = viz_config.get("figs_folder")
+    dvv_mode = viz_config.get("dvv_target", "ALL")
+    dvv_aggregate = viz_config.get("dvv_aggregate", "msnoise")
+
+    dtt_folder = dtt_template.format(filter_set=f_set, component=comp)
+
+    if dvv_mode == "ALL":
+        target_name = "ALL"
+        print(f"Mode: (ALL, {dvv_aggregate})")
+    else:
+        target_name = station_pair(viz_config.get("station1"), viz_config.get("station2"))
+        print(f"Mode: Stations Pair ({target_name})")
+
+    dtt_root, dtt_filter, dtt_stack, dtt_comp = split_folder(dtt_folder)
+    if not os.path.isdir(dtt_folder):
+        print(f"Error: There is no .txt file: {dtt_folder}")
+        stage("dvv_plot").error(f"missing DTT folder {dtt_folder}")
+        return None
+
+    store = DTTStore(viz_config.get("dtt_store", "./dtt_store.sqlite"),
+                     int(viz_config.get("dtt_workers") or os.cpu_count() or 1), cache=shared(viz_config))
+    catalog = open_catalog(viz_config)
+    n_ingested = store.ingest(dtt_root, catalog)
+    catalog.close()
+    stage("dvv_plot").add(files_read=n_ingested)
+    if n_ingested:
+        print(f"{n_ingested} new or changed dtt files ingested into {store.path}")
+
+    if dvv_mode == "ALL" and dvv_aggregate != "msnoise":
+        df = aggregate(store, dtt_stack, dtt_comp, dtt_filter, dvv_aggregate,
+                       db_path=config.get("data_scan", {}).get("db_path"),
+                       distance_bins=viz_config.get("dvv_distance_bins", [0, 25, 50, 100, 200]),
+                       groups=viz_config.get("dvv_groups"))
+    else:
+        df = store.query(target_name, dtt_stack, dtt_comp, dtt_filter)
+        df = df.rename(columns={'date': 'day', 'M0': 'm0', 'EM0': 'error'})
+        df['label'] = target_name
+    store.close()
+
+    if df.empty:
+        print(f"warning: there is no data for {target_name} in the DTT files.")
+        stage("dvv_plot").error(f"no DTT rows for {target_name}")
+        return None
+
+    df = df.sort_values('day')
+
+    if not os.path.exists(figs_folder):
+        os.makedirs(figs_folder)
+
+    _, dpi = render_settings(viz_config)
+    plt = pyplot()
+    plt.figure(figsize=(10, 5))
+
+    labels = df['label'].unique()
+    for i, label in enumerate(labels):
+        sub = df[df['label'] == label]
+        dvv_percent = -sub['m0'] * 100
+        err_percent = sub['error'] * 100
+        plt.errorbar(sub['day'], dvv_percent, yerr=err_percent,
+                     fmt='o-', color='black' if len(labels) == 1 else f"C{i}", ecolor='gray',
+                     capsize=3, markersize=4, linewidth=1, label=label)
+    if len(labels) > 1:
+        plt.legend()
+
+    title_str = f"Relative Velocity Change (dv/v)\nTarget: {target_name} | Filter: {f_set} ({comp})"
+    plt.title(title_str)
+    plt.xlabel("Date")
+    plt.ylabel("dv/v (%)")
+
+    plt.xlim(df['day'].min(), df['day'].max())
+    plt.xticks(rotation=30)
+    plt.grid(True, linestyle='--', alpha=0.5)
+    plt.tight_layout()
+
+    agg_suffix = f"_{dvv_aggregate}" if dvv_mode == "ALL" and dvv_aggregate != "msnoise" else ""
+    out_filename = f"dv_v_{target_name}{agg_suffix}_{f_set}_{comp}.png"
+    save_path = os.path.join(figs_folder, out_filename)
+    plt.savefig(save_path, dpi=dpi)
+    plt.close()
+    stage("dvv_plot").add(files_written=1)
+    return save_path
+
+
+if __name__ == "__main__":
+    config = load_config()
+    instrumentation.setup(config, "01_Visualization_CC")
+    plot_single_ccf(config)
+    if plot_dvv(config) is None:
+        sys.exit(1)
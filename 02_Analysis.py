@@ -1,27 +1,46 @@
 import os
 import json
-import glob
-import sqlite3
-import numpy as np
-import pandas as pd
-import obspy
-from obspy import UTCDateTime
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-import seaborn as sns
-
-plt.rcParams['font.family'] = 'Nimbus Sans'  
-plt.rcParams['font.size'] = 13
+import argparse
+import hashlib
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from catalog import open_catalog, split_folder, station_pair
+from dtt_store import DTTStore
+import loader_cache
+import msnoise_db
+import instrumentation
+from instrumentation import stage, timed
+from plot_setup import RENDER_MODES, pixel_budget, pyplot, render_settings
+
+# numpy, pandas, matplotlib and seaborn are imported inside the methods that
+# need them, so figures that are already up to date never pay for them.
 
 class MSNoiseVisualizer:
-    def __init__(self, config_path="config.json"):
+    def __init__(self, config_path="config.json", render_mode=None):
+        self.config_path = config_path
         self.config = self._load_config(config_path)
-        self.pair_name = self._get_pair_name()
+        self.figure_state = {}
+        self.ingested_dtt_roots = set()
+        viz_cfg = self.config['visualization']
+        self.pair_name = station_pair(viz_cfg['station1'], viz_cfg['station2'])
+        self.catalog = open_catalog(viz_cfg)
         
-        self.cc_base_dir = self.config['visualization']['cc_files']
-        self.dtt_target_dir = self.config['visualization']['dtt_folder']
+        self.cc_base_dir = viz_cfg.get('cc_files') or viz_cfg['cc_files_template'].format(
+            filter_set=viz_cfg['filter_set'], component=viz_cfg['component'])
+        self.dtt_target_dir = viz_cfg.get('dtt_folder') or viz_cfg['dtt_folder_template'].format(
+            filter_set=viz_cfg['filter_set'], component=viz_cfg['component'])
         self.db_path = self.config['data_scan']['db_path']
-        self.figs_output = self.config['visualization']['figs_folder']
+        self.figs_output = viz_cfg['figs_folder']
+        self.ccf_cache_root = viz_cfg.get('ccf_cache_folder', './ccf_cache')
+        self.dtt_store_path = viz_cfg.get('dtt_store', './dtt_store.sqlite')
+        self.ccf_max_lag = float(viz_cfg.get('ccf_max_lag') or 60.0)
+        self.ccf_normalization = viz_cfg.get('ccf_normalization', 'max')
+        self.ccf_norm_window = viz_cfg.get('ccf_norm_window')
+        self.heatmap_decimation = bool(viz_cfg.get('heatmap_decimation', False))
+        self.dtt_workers = int(viz_cfg.get('dtt_workers') or os.cpu_count() or 1)
+        self.render_mode, self.dpi = render_settings(viz_cfg, render_mode)
+        # Decoded CCFs, heatmap matrices and DTT queries, shared with 01_Visualization_CC.py in the same process.
+        self.cache = loader_cache.shared(viz_cfg)
         
         os.makedirs(self.figs_output, exist_ok=True)
 
@@ -29,64 +48,57 @@ class MSNoiseVisualizer:
         with open(path, 'r') as f:
             return json.load(f)
 
-    def _get_pair_name(self):
-        s1 = self.config['visualization']['station1'].replace("-", "_")
-        s2 = self.config['visualization']['station2'].replace("-", "_")
-        stations = sorted([s1, s2])
-        return f"{stations[0]}_{stations[1]}"
+    @timed("ccf_heatmap")
+    def plot_ccf_heatmap(self, pair_name=None, cc_base_dir=None, out_name=None):
+        from ccf_cache import CCFCube, cube_dir, heatmap_matrix
 
-    def plot_ccf_heatmap(self):
-        pair_folder = os.path.join(self.cc_base_dir, self.pair_name)
+        pair_name = pair_name or self.pair_name
+        cc_base_dir = cc_base_dir or self.cc_base_dir
+        pair_folder = os.path.join(cc_base_dir, pair_name)
+        days = self._ccf_days(cc_base_dir, pair_name)
         
-        if not os.path.exists(pair_folder):
+        if not days:
             print(f"No Folder: {pair_folder}")
             return
 
         print(f"Reading CCF from: {pair_folder} ...")
-        file_list = sorted([f for f in os.listdir(pair_folder) if f.endswith(".MSEED")])
+        cube = CCFCube(cube_dir(self.ccf_cache_root, cc_base_dir, pair_name))
+        added, replaced = cube.update(pair_folder, files=days)
+        stage("ccf_heatmap").add(files_read=added + replaced)
+        if added or replaced:
+            print(f"CCF cache: {added} days added, {replaced} days refreshed ({len(cube)} cached)")
         
-        if not file_list:
+        if not len(cube):
             print("The folder is empty")
             return
 
-        data_matrix = []
-        dates = []
-        lags = None
-        max_lag = 60.0 
-
-        for fname in file_list:
-            path = os.path.join(pair_folder, fname)
-            try:
-                st = obspy.read(path)
-                tr = st[0]
-                
-                npts = tr.stats.npts
-                samprate = tr.stats.sampling_rate
-                t_axis = np.linspace(-((npts-1)/2)/samprate, ((npts-1)/2)/samprate, npts)
-                
-                mask = (t_axis >= -max_lag) & (t_axis <= max_lag)
-                cut_data = tr.data[mask]
-                
-                if lags is None:
-                    lags = t_axis[mask]
-                
-                cut_data = cut_data / np.max(np.abs(cut_data))
-                
-                data_matrix.append(cut_data)
-                
-                date_str = fname.replace(".MSEED", "")
-                dates.append(UTCDateTime(date_str).datetime)
-                
-            except Exception as e:
-                print(f"Skipping {fname}: {e}")
+        max_lag = self.ccf_max_lag
+        out_file = os.path.join(self.figs_output, out_name or f"CCF_{pair_name}.png")
+        fingerprint = self._fingerprint(cube.index['sources'], max_lag, self.heatmap_decimation,
+                                        self.ccf_normalization, self.ccf_norm_window,
+                                        self.render_mode, self.dpi)
+        if self._is_current(out_file, fingerprint):
+            print(f"CCF Plot up to date: {out_file}")
+            stage("ccf_heatmap").add(files_skipped=1)
+            return out_file
 
-        if not data_matrix:
-            return
+        plt = pyplot()
+        import matplotlib.dates as mdates
 
-        matrix = np.array(data_matrix).T 
-        date_nums = mdates.date2num(dates)
+        figsize, dpi = (10, 6), self.dpi
+        if self.heatmap_decimation or self.render_mode != "full":
+            max_columns, max_rows = pixel_budget(figsize, dpi)
+        else:
+            max_columns = max_rows = None
+        norm_window = tuple(self.ccf_norm_window) if self.ccf_norm_window else None
+        matrix, lags, first_day, last_day = self.cache.get(
+            cube.data_path,
+            lambda _: heatmap_matrix(cube, max_lag, max_columns, max_rows,
+                                     normalization=self.ccf_normalization, norm_window=norm_window),
+            "heatmap", max_lag, max_columns, max_rows, self.ccf_normalization, norm_window)
+        date_nums = mdates.date2num([first_day, last_day])
 
-        fig, ax = plt.subplots(figsize=(10, 6))
+        fig, ax = plt.subplots(figsize=figsize)
         im = ax.imshow(matrix, aspect='auto', cmap='seismic', 
                        extent=[date_nums[0], date_nums[-1], lags[0], lags[-1]],
                        vmin=-1, vmax=1, interpolation='nearest')
@@ -95,96 +107,101 @@ class MSNoiseVisualizer:
         ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
         fig.autofmt_xdate()
 
-        plt.title(f"CCF Temporal Evolution: {self.pair_name}")
+        plt.title(f"CCF Temporal Evolution: {pair_name}")
         plt.ylabel("Lapse Time (s)")
         plt.xlabel("Date")
         plt.colorbar(im, label="Normalized Amplitude")
         plt.tight_layout()
         
-        out_file = os.path.join(self.figs_output, f"CCF_{self.pair_name}.png")
-        plt.savefig(out_file, dpi=300)
+        plt.savefig(out_file, dpi=dpi)
+        plt.close(fig)
+        self.figure_state[out_file] = fingerprint
+        stage("ccf_heatmap").add(files_written=1)
         print(f"CCF Plot saved to {out_file}")
+        return out_file
+
+    def _ccf_days(self, cc_base_dir, pair_name):
+        # Day files of one pair from the catalog; the STACKS tree is walked at most once per run.
+        self.catalog.ensure(split_folder(cc_base_dir)[0], "ccf")
+        return self.catalog.days(cc_base_dir, pair_name)
 
     def _get_filter_mapping(self):
         if not os.path.exists(self.db_path):
-            print("Can't find the database file: {self.db_path}")
+            print(f"Can't find the database file: {self.db_path}")
             return None
 
         try:
-            conn = sqlite3.connect(self.db_path)
-            df = pd.read_sql_query("SELECT ref, low, high FROM filters", conn)
-            conn.close()
             mapping = {}
-            for _, row in df.iterrows():
-                fmt_ref = f"{int(row['ref']):02d}"
-                mapping[fmt_ref] = f"{row['low']:.2f}-{row['high']:.2f} Hz"
+            for ref, low, high in msnoise_db.read_filters(self.db_path):
+                mapping[f"{int(ref):02d}"] = f"{low:.2f}-{high:.2f} Hz"
             return mapping
         except Exception as e:
             print(f"failed on reading filters: {e}")
             return None
 
-    def plot_dvv_heatmap(self):
+    @timed("dvv_heatmap")
+    def plot_dvv_heatmap(self, pair_name=None, dtt_folder=None, out_name=None):
+        import pandas as pd
+
+        pair_name = pair_name or self.pair_name
         filter_map = self._get_filter_mapping()
         
-        dtt_root = os.path.abspath(os.path.join(self.dtt_target_dir, "../../.."))
+        dtt_root, _, target_stack, component = split_folder(dtt_folder or self.dtt_target_dir)
         
-        print(f"Scanning DTT root: {dtt_root} for pair {self.pair_name}...")
+        print(f"Scanning DTT root: {dtt_root} for pair {pair_name}...")
         
-        target_stack = self.dtt_target_dir.split(os.sep)[-2] 
-        component = self.dtt_target_dir.split(os.sep)[-1]    
+        store = DTTStore(self.dtt_store_path, self.dtt_workers, cache=self.cache)
+        if dtt_root not in self.ingested_dtt_roots:
+            n_ingested = store.ingest(dtt_root, self.catalog)
+            self.ingested_dtt_roots.add(dtt_root)
+            stage("dvv_heatmap").add(files_read=n_ingested)
+            if n_ingested:
+                print(f"{n_ingested} new or changed dtt files ingested into {store.path}")
+        pivot_df = store.pivot(pair_name, target_stack, component, 'M')
+        store.close()
 
-        all_data = []
-        filter_dirs = sorted(glob.glob(os.path.join(dtt_root, "*"))) 
+        pivot_df = pivot_df[[f.isdigit() for f in pivot_df.index]]
+        if pivot_df.empty:
+            print("No data found for the specified pair and filters.")
+            return
 
-        for f_dir in filter_dirs:
-            filter_id = os.path.basename(f_dir)
-            if not filter_id.isdigit():
-                continue
+        def freq_label(filter_id):
+            if filter_map and filter_id in filter_map:
+                return filter_map[filter_id]
+            return f"Filter {filter_id}"
 
+        def sort_key(filter_id):
             if filter_map and filter_id in filter_map:
-                freq_label = filter_map[filter_id]
-            else:
-                freq_label = f"Filter {filter_id}"
-
-            target_path = os.path.join(f_dir, target_stack, component, "*.txt")
-            files = sorted(glob.glob(target_path))
-
-            for txt_file in files:
-                try:
-                    df_day = pd.read_csv(txt_file)
-                    target_row = df_day[df_day['Pairs'] == self.pair_name]
-                    
-                    if not target_row.empty:
-                        val = target_row.iloc[0]['M'] * 100 
-                        date_str = target_row.iloc[0]['Date']
-                        
-                        all_data.append({
-                            'date': pd.to_datetime(date_str),
-                            'freq_band': freq_label,
-                            'dvv': val,
-                            'filter_sort_key': float(filter_map[filter_id].split('-')[0]) if filter_map else int(filter_id)
-                        })
-                except Exception:
-                    continue
-
-        if not all_data:
-            print("No data found for the specified pair and filters.")
-            return
+                return float(filter_map[filter_id].split('-')[0])
+            return int(filter_id)
 
-        df_all = pd.DataFrame(all_data)
-        
-        pivot_df = df_all.pivot(index='freq_band', columns='date', values='dvv')
-        
-        sort_map = df_all[['freq_band', 'filter_sort_key']].drop_duplicates().set_index('freq_band')['filter_sort_key']
-        pivot_df = pivot_df.sort_index(key=lambda x: x.map(sort_map))
+        out_file = os.path.join(self.figs_output, out_name or f"dvv_{pair_name}.png")
+        fingerprint = self._fingerprint(int(pd.util.hash_pandas_object(pivot_df).sum()), filter_map,
+                                        self.render_mode, self.dpi)
+        if self._is_current(out_file, fingerprint):
+            print(f"dv/v Plot up to date: {out_file}")
+            stage("dvv_heatmap").add(files_skipped=1)
+            return out_file
 
-        plt.figure(figsize=(12, 6))
-        ax = sns.heatmap(pivot_df, cmap='RdBu_r', center=0, 
-                         cbar_kws={'label': 'dv/v (%)'},
-                         xticklabels=10) 
+        plt = pyplot()
 
-        date_labels = [d.strftime('%Y-%m-%d') for d in pivot_df.columns]
-        ax.set_xticklabels(date_labels[::10], rotation=45) 
+        filter_order = sorted(pivot_df.index, key=sort_key)
+        pivot_df = pivot_df.loc[filter_order] * 100
+        pivot_df.index = [freq_label(f) for f in filter_order]
+
+        figsize = (12, 6)
+        plt.figure(figsize=figsize)
+        if self.render_mode == "full":
+            import seaborn as sns
+            ax = sns.heatmap(pivot_df, cmap='RdBu_r', center=0, 
+                             cbar_kws={'label': 'dv/v (%)'},
+                             xticklabels=10) 
+
+            date_labels = [d.strftime('%Y-%m-%d') for d in pivot_df.columns]
+            ax.set_xticklabels(date_labels[::10], rotation=45) 
+            cbar = ax.collections[0].colorbar
+        else:
+            ax, cbar = self._raster_dvv_heatmap(plt, pivot_df, pixel_budget(figsize, self.dpi)[0])
         
         for _, spine in ax.spines.items():
             spine.set_visible(True)
@@ -194,25 +211,218 @@ class MSNoiseVisualizer:
         ax.set_axisbelow(False) 
         ax.grid(True, which='both', color='gray', linestyle='--', linewidth=0.5, alpha=0.5)
 
-        cbar = ax.collections[0].colorbar
         cbar.outline.set_visible(True)
         cbar.outline.set_linewidth(1)
         cbar.outline.set_edgecolor('black')
 
-        plt.title(f"dv/v Interferogram: {self.pair_name}")
+        plt.title(f"dv/v Interferogram: {pair_name}")
         plt.xlabel("Date")
         plt.ylabel("Frequency Band")
         plt.tight_layout()
         
-        out_file = os.path.join(self.figs_output, f"dvv_{self.pair_name}.png")
-        plt.savefig(out_file, dpi=300)
+        plt.savefig(out_file, dpi=self.dpi)
+        plt.close()
+        self.figure_state[out_file] = fingerprint
+        stage("dvv_heatmap").add(files_written=1)
         print(f"dv/v Plot saved to {out_file}")
+        return out_file
+
+    def _raster_dvv_heatmap(self, plt, pivot_df, max_columns):
+        # The same day x filter grid as sns.heatmap, drawn as one image instead
+        # of a patch per cell, with days averaged down to the pixel width.
+        import numpy as np
+        from render import centered_colormap, reduce_to_pixels
+
+        values = pivot_df.to_numpy(dtype=np.float64)
+        n_rows, n_days = values.shape
+        reduced, _, _ = reduce_to_pixels(values, max_cols=max_columns)
+        cmap, vmin, vmax = centered_colormap('RdBu_r', values)
+
+        ax = plt.gca()
+        im = ax.imshow(np.ma.masked_invalid(reduced), aspect='auto', cmap=cmap, vmin=vmin, vmax=vmax,
+                       extent=[0, n_days, n_rows, 0], interpolation='nearest')
+        cbar = plt.colorbar(im, ax=ax, label='dv/v (%)')
+
+        # At least every 10th day as in the full rendering, but never more than ~30 labels.
+        step = max(10, -(-n_days // 30))
+        ticks = np.arange(0, n_days, step)
+        ax.set_xticks(ticks + 0.5)
+        ax.set_xticklabels([pivot_df.columns[i].strftime('%Y-%m-%d') for i in ticks], rotation=45)
+        ax.set_yticks(np.arange(n_rows) + 0.5)
+        ax.set_yticklabels(pivot_df.index)
+        return ax, cbar
+
+    @timed("stretching")
+    def plot_stretching_dvv(self, pair_name=None, cc_base_dir=None, out_name=None):
+        from ccf_cache import CCFCube, cube_dir
+        from dvv_stretching import stretching_dvv
+
+        pair_name = pair_name or self.pair_name
+        cc_base_dir = cc_base_dir or self.cc_base_dir
+        pair_folder = os.path.join(cc_base_dir, pair_name)
+        days = self._ccf_days(cc_base_dir, pair_name)
+
+        if not days:
+            print(f"No Folder: {pair_folder}")
+            return
+
+        cube = CCFCube(cube_dir(self.ccf_cache_root, cc_base_dir, pair_name))
+        stage("stretching").add(files_read=sum(cube.update(pair_folder, files=days)))
+        if not len(cube):
+            print("The folder is empty")
+            return
+
+        stretch_cfg = self.config.get('stretching', {})
+        print(f"Stretching {len(cube)} days of {pair_name} ...")
+        df = self.cache.get(cube.data_path, lambda _: stretching_dvv(cube, stretch_cfg),
+                            "stretching", json.dumps(stretch_cfg, sort_keys=True))
+        if df.empty:
+            print("No day could be compared with the reference.")
+            return
+
+        plt = pyplot()
+        import matplotlib.dates as mdates
+        stack_days = stretch_cfg.get('stack_days', 1)
+        fig, ax = plt.subplots(figsize=(10, 5))
+        sc = ax.scatter(df['date'], df['dvv'], c=df['cc'], cmap='viridis', s=12, zorder=3,
+                        rasterized=self.render_mode != "full")
+        ax.plot(df['date'], df['dvv'], color='black', linewidth=0.8)
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
+        fig.autofmt_xdate()
+        ax.grid(True, linestyle='--', alpha=0.5)
+
+        plt.title(f"Stretching dv/v: {pair_name} ({stack_days}-day stack)")
+        plt.xlabel("Date")
+        plt.ylabel("dv/v (%)")
+        plt.colorbar(sc, label="Correlation Coefficient")
+        plt.tight_layout()
+
+        out_file = os.path.join(self.figs_output, out_name or f"stretching_dvv_{pair_name}.png")
+        plt.savefig(out_file, dpi=self.dpi)
+        plt.close(fig)
+        df.to_csv(os.path.splitext(out_file)[0] + ".csv", index=False)
+        stage("stretching").add(files_written=2)
+        print(f"Stretching dv/v saved to {out_file}")
+        return out_file
+
+    def _fingerprint(self, *inputs):
+        return hashlib.sha1(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _is_current(self, out_file, fingerprint):
+        return self.figure_state.get(out_file) == fingerprint and os.path.exists(out_file)
+
+    def _figure_state_path(self):
+        return os.path.join(self.figs_output, ".figure_state.json")
+
+    def load_figure_state(self):
+        if os.path.exists(self._figure_state_path()):
+            with open(self._figure_state_path(), 'r') as f:
+                self.figure_state = json.load(f)
+
+    def save_figure_state(self):
+        tmp = self._figure_state_path() + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.figure_state, f, indent=1, sort_keys=True)
+        os.replace(tmp, self._figure_state_path())
+
+    def batch_jobs(self, components=None):
+        jobs = defaultdict(list)
+
+        stacks_root, _, cc_stack, _ = split_folder(self.cc_base_dir)
+        self.catalog.ensure(stacks_root, "ccf")
+        for f_dir, _, comp, pair in self.catalog.groups(stacks_root, cc_stack, components):
+            if f_dir.isdigit():
+                comp_dir = os.path.join(stacks_root, f_dir, cc_stack, comp)
+                jobs[pair].append(("ccf", comp_dir, f"CCF_{pair}_{f_dir}_{comp}.png"))
+
+        dtt_root, dtt_filter, dtt_stack, _ = split_folder(self.dtt_target_dir)
+        store = DTTStore(self.dtt_store_path, self.dtt_workers)
+        store.ingest(dtt_root, self.catalog)
+        self.ingested_dtt_roots.add(dtt_root)
+        for pair, comp in store.pairs(dtt_stack):
+            if components and comp not in components:
+                continue
+            dtt_folder = os.path.join(dtt_root, dtt_filter, dtt_stack, comp)
+            jobs[pair].append(("dvv", dtt_folder, f"dvv_{pair}_{comp}.png"))
+        store.close()
+        return jobs
+
+    def render_pair(self, pair_name, pair_jobs):
+        for kind, folder, out_name in pair_jobs:
+            try:
+                if kind == "ccf":
+                    self.plot_ccf_heatmap(pair_name, cc_base_dir=folder, out_name=out_name)
+                else:
+                    self.plot_dvv_heatmap(pair_name, dtt_folder=folder, out_name=out_name)
+            except Exception as e:
+                print(f"Failed {out_name}: {e}")
+                stage("batch").error(f"{out_name}: {e}")
+        return self.figure_state
+
+    def run_batch(self, components=None, workers=None, force=False):
+        if not force:
+            self.load_figure_state()
+        jobs = self.batch_jobs(components)
+        n_figs = sum(len(j) for j in jobs.values())
+        print(f"Batch: {len(jobs)} pairs, {n_figs} figures")
+
+        workers = workers or os.cpu_count() or 1
+        if workers > 1 and len(jobs) > 1:
+            # Each worker renders every figure of a pair, so a pair's CCF cube
+            # and DTT rows are loaded once and stay in that worker.
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_render_pair_worker, self.config_path, self.render_mode,
+                                           self.figure_state, self.ingested_dtt_roots,
+                                           self.catalog.refreshed, pair, pair_jobs)
+                           for pair, pair_jobs in jobs.items()]
+                for future in futures:
+                    figure_state, stages = future.result()
+                    self.figure_state.update(figure_state)
+                    instrumentation.current().merge(stages)
+        else:
+            for pair, pair_jobs in jobs.items():
+                self.render_pair(pair, pair_jobs)
+        self.save_figure_state()
+
+def _render_pair_worker(config_path, render_mode, figure_state, ingested_dtt_roots, catalog_refreshed,
+                        pair_name, pair_jobs):
+    viz = MSNoiseVisualizer(config_path, render_mode)
+    viz.figure_state = dict(figure_state)
+    viz.ingested_dtt_roots = set(ingested_dtt_roots)
+    # The parent already brought the catalog up to date; workers only read it.
+    viz.catalog.refreshed = set(catalog_refreshed)
+    # A fresh report per task, merged by the parent, so nothing is counted twice.
+    report = instrumentation.setup(viz.config, "02_Analysis", write_at_exit=False)
+    return viz.render_pair(pair_name, pair_jobs), report.to_dict()["stages"]
+
 
 if __name__ == "__main__":
-    viz = MSNoiseVisualizer("config.json")
-    
-    print("--- 1. Plotting CCF Heatmap ---")
-    viz.plot_ccf_heatmap()
+    parser = argparse.ArgumentParser(description="CCF and dv/v heatmaps from MSNoise outputs")
+    parser.add_argument("--config", default="config.json")
+    parser.add_argument("--batch", action="store_true",
+                        help="plot every pair found under the STACKS and DTT trees")
+    parser.add_argument("--components", help="comma-separated components for --batch, e.g. ZZ,NN")
+    parser.add_argument("--workers", type=int, help="worker processes for --batch")
+    parser.add_argument("--force", action="store_true", help="re-render figures whose inputs have not changed")
+    parser.add_argument("--stretching", action="store_true",
+                        help="also compute dv/v by trace stretching from the cached CCFs")
+    parser.add_argument("--render-mode", choices=RENDER_MODES,
+                        help="override visualization.render_mode")
+    args = parser.parse_args()
+
+    viz = MSNoiseVisualizer(args.config, args.render_mode)
+    instrumentation.setup(viz.config, "02_Analysis")
     
-    print("\n--- 2. Plotting dv/v Heatmap ---")
-    viz.plot_dvv_heatmap()
\ No newline at end of file
+    if args.batch:
+        components = args.components.split(",") if args.components else None
+        viz.run_batch(components, args.workers, args.force)
+    else:
+        print("--- 1. Plotting CCF Heatmap ---")
+        viz.plot_ccf_heatmap()
+        
+        print("\n--- 2. Plotting dv/v Heatmap ---")
+        viz.plot_dvv_heatmap()
+
+        if args.stretching:
+            print("\n--- 3. Stretching dv/v ---")
+            viz.plot_stretching_dvv()
@@ -0,0 +1,145 @@
+import csv
+import itertools
+import os
+import sqlite3
+from typing import List, Tuple
+
+import numpy as np
+from obspy import Stream, Trace, UTCDateTime
+
+NETWORK = "XX"
+START = UTCDateTime("2025-01-01")
+
+
+def station_codes(n_stations: int) -> List[str]:
+    return [f"S{i:03d}" for i in range(n_stations)]
+
+
+def pair_names(n_stations: int, max_pairs: int = 0) -> List[str]:
+    stations = [f"{NETWORK}_{s}" for s in station_codes(n_stations)]
+    pairs = [f"{a}_{b}" for a, b in itertools.combinations(sorted(stations), 2)]
+    return pairs[:max_pairs] if max_pairs else pairs
+
+
+def write_station_metadata(path: str, n_stations: int, seed: int = 0) -> None:
+    """downloaded_stations_metadata.csv as written by step 1."""
+    rng = np.random.default_rng(seed)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Network", "Station", "Longitude", "Latitude", "Elevation"])
+        for sta in station_codes(n_stations):
+            writer.writerow([NETWORK, sta, 120.0 + rng.uniform(0, 1), 23.0 + rng.uniform(0, 1),
+                             rng.uniform(0, 2000)])
+
+
+def make_raw(source_folder: str, n_stations: int, n_days: int, sampling_rate: float,
+             gap_fraction: float = 0.05, seed: int = 0) -> Tuple[int, int]:
+    """Raw day files laid out like step 1 output: {source}/{sta}/{net}.{sta}.{date}.mseed.
+
+    Every file holds HHZ plus horizontals named HH1/HH2 (renamed to N/E by
+    step 2) and a gap of `gap_fraction` of the day, so merging and
+    availability gaps are exercised. Returns (files, samples).
+    """
+    rng = np.random.default_rng(seed)
+    npts = int(86400 * sampling_rate)
+    gap = int(npts * gap_fraction)
+    gap_start = npts // 2
+    n_files = n_samples = 0
+    for sta in station_codes(n_stations):
+        station_dir = os.path.join(source_folder, sta)
+        os.makedirs(station_dir, exist_ok=True)
+        for day in range(n_days):
+            t0 = START + day * 86400
+            st = Stream()
+            for chan in ("HHZ", "HH1", "HH2"):
+                data = rng.integers(-2 ** 15, 2 ** 15, npts, dtype=np.int32)
+                pieces = [(0, gap_start), (gap_start + gap, npts)] if gap else [(0, npts)]
+                for i0, i1 in pieces:
+                    st.append(Trace(data=data[i0:i1].copy(), header={
+                        "network": NETWORK, "station": sta, "channel": chan,
+                        "sampling_rate": sampling_rate, "starttime": t0 + i0 / sampling_rate}))
+                    n_samples += i1 - i0
+            st.write(os.path.join(station_dir, f"{NETWORK}.{sta}.{t0.strftime('%Y-%m-%d')}.mseed"),
+                     format="MSEED", encoding="STEIM2", reclen=4096)
+            n_files += 1
+    return n_files, n_samples
+
+
+def _ccf_trace(lags: np.ndarray, dvv: float, distance_s: float, rng) -> np.ndarray:
+    # Two symmetric wave packets whose arrival time shifts with dv/v, plus noise.
+    t = lags * (1 + dvv)
+    packet = np.exp(-((np.abs(t) - distance_s) / 2.0) ** 2) * np.cos(2 * np.pi * 0.3 * t)
+    coda = np.exp(-np.abs(t) / 30.0) * np.sin(2 * np.pi * 0.25 * t)
+    return (packet + 0.3 * coda + 0.05 * rng.standard_normal(len(t))).astype(np.float32)
+
+
+def make_ccf_stacks(stacks_root: str, pairs: List[str], n_days: int, filters: List[str],
+                    component: str = "ZZ", sampling_rate: float = 20.0, max_lag: float = 120.0,
+                    seed: int = 0) -> int:
+    """Daily CCFs in STACKS/{filter}/001_DAYS/{comp}/{pair}/{date}.MSEED; returns the file count."""
+    rng = np.random.default_rng(seed)
+    npts = int(2 * max_lag * sampling_rate) + 1
+    lags = np.linspace(-max_lag, max_lag, npts)
+    dvv = 0.002 * np.sin(2 * np.pi * np.arange(n_days) / 365.0)
+    n_files = 0
+    for filter_id in filters:
+        for pair in pairs:
+            folder = os.path.join(stacks_root, filter_id, "001_DAYS", component, pair)
+            os.makedirs(folder, exist_ok=True)
+            distance_s = rng.uniform(5, 40)
+            for day in range(n_days):
+                t0 = START + day * 86400
+                tr = Trace(data=_ccf_trace(lags, dvv[day], distance_s, rng), header={
+                    "network": NETWORK, "station": pair[:5], "sampling_rate": sampling_rate,
+                    "starttime": t0})
+                tr.write(os.path.join(folder, f"{t0.strftime('%Y-%m-%d')}.MSEED"), format="MSEED")
+                n_files += 1
+    return n_files
+
+
+def make_dtt_tree(dtt_root: str, pairs: List[str], n_days: int, filters: List[str],
+                  component: str = "ZZ", stack: str = "005_DAYS", seed: int = 0) -> int:
+    """One MSNoise-style DTT .txt per filter/day with a row per pair and an ALL row."""
+    rng = np.random.default_rng(seed)
+    n_files = 0
+    header = ["Date", "A", "EA", "EM", "M", "M0", "EM0", "Pairs", "Method"]
+    for filter_id in filters:
+        folder = os.path.join(dtt_root, filter_id, stack, component)
+        os.makedirs(folder, exist_ok=True)
+        for day in range(n_days):
+            date = (START + day * 86400).strftime("%Y-%m-%d")
+            m = 0.002 * np.sin(2 * np.pi * day / 365.0) + 1e-4 * rng.standard_normal(len(pairs) + 1)
+            with open(os.path.join(folder, f"{date}.txt"), "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(header)
+                for pair, value in zip(pairs + ["ALL"], m):
+                    err = abs(rng.normal(1e-4, 2e-5))
+                    writer.writerow([date, 0.0, 1e-3, err, value, value, err, pair, "WLS"])
+            n_files += 1
+    return n_files
+
+
+MINIMAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS config (name VARCHAR(255) PRIMARY KEY, value VARCHAR(255));
+CREATE TABLE IF NOT EXISTS stations (
+    ref INTEGER PRIMARY KEY, net VARCHAR(10), sta VARCHAR(10), X FLOAT, Y FLOAT,
+    altitude FLOAT, coordinates VARCHAR(3), instrument VARCHAR(255), used BOOLEAN);
+CREATE TABLE IF NOT EXISTS filters (
+    ref INTEGER PRIMARY KEY, low FLOAT, mwcs_low FLOAT, high FLOAT, mwcs_high FLOAT,
+    rms_threshold FLOAT, mwcs_wlen FLOAT, mwcs_step FLOAT, used BOOLEAN);
+CREATE TABLE IF NOT EXISTS data_availability (
+    ref INTEGER PRIMARY KEY, net VARCHAR(10), sta VARCHAR(10), comp VARCHAR(20),
+    path TEXT, file VARCHAR(255), starttime DATETIME, endtime DATETIME,
+    data_duration FLOAT, gaps_duration FLOAT, samplerate FLOAT, flag CHAR(1));
+CREATE UNIQUE INDEX IF NOT EXISTS da_path_file ON data_availability (path, file);
+"""
+
+
+def init_msnoise_db(path: str, filters: List[str]) -> None:
+    """The tables step 3 writes, as `msnoise db init` creates them (reduced to the used columns)."""
+    conn = sqlite3.connect(path)
+    conn.executescript(MINIMAL_SCHEMA)
+    conn.executemany("INSERT OR REPLACE INTO filters VALUES (?, ?, ?, ?, ?, 0, 12, 4, 1)",
+                     [(int(f), 0.1 * int(f), 0.1 * int(f), 0.5 * int(f), 0.5 * int(f)) for f in filters])
+    conn.commit()
+    conn.close()
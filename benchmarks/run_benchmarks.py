@@ -0,0 +1,282 @@
+import argparse
+import contextlib
+import gc
+import importlib.util
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+sys.path[:0] = [REPO, HERE]
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import instrumentation  # noqa: E402
+import fixtures  # noqa: E402
+
+SCALES = {
+    "small": {"stations": 3, "days": 2, "sampling_rate": 10.0,
+              "ccf_pairs": 3, "ccf_days": 120, "filters": 2},
+    "medium": {"stations": 8, "days": 7, "sampling_rate": 20.0,
+               "ccf_pairs": 10, "ccf_days": 365, "filters": 3},
+    "large": {"stations": 20, "days": 30, "sampling_rate": 50.0,
+              "ccf_pairs": 45, "ccf_days": 1095, "filters": 5},
+}
+BENCHMARKS = ["step2_cold", "step2_incremental", "step3_cold", "step3_incremental",
+              "ccf_heatmap_cold", "ccf_heatmap_warm", "dvv_heatmap_cold", "dvv_heatmap_warm"]
+OUTPUTS = ["SDS", "sds_conversion_state.sqlite", "msnoise.sqlite", "ccf_cache",
+           "dtt_store.sqlite", "catalog.sqlite", "Figs", "config.json"]
+
+
+def load_script(name):
+    """Import one of the digit-named pipeline scripts as a module."""
+    path = os.path.join(REPO, f"{name}.py")
+    spec = importlib.util.spec_from_file_location(f"msnoise_demo_{name.split('_', 1)[1].lower()}", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def prepare(work, scale, seed):
+    """Generate the fixtures once per work directory and clear previous outputs."""
+    marker = os.path.join(work, "fixtures.json")
+    params = {"scale": scale, "seed": seed}
+    if os.path.exists(marker):
+        with open(marker) as f:
+            if json.load(f) != params:
+                raise SystemExit(f"{work} holds fixtures of another scale/seed; use a new --workdir")
+    else:
+        filters = [f"{i + 1:02d}" for i in range(scale["filters"])]
+        pairs = fixtures.pair_names(max(scale["stations"], 2), scale["ccf_pairs"])
+        started = time.perf_counter()
+        fixtures.write_station_metadata(os.path.join(work, "downloaded_stations_metadata.csv"),
+                                        scale["stations"], seed)
+        fixtures.make_raw(os.path.join(work, "raw"), scale["stations"], scale["days"],
+                          scale["sampling_rate"], seed=seed)
+        fixtures.make_ccf_stacks(os.path.join(work, "STACKS"), pairs, scale["ccf_days"], filters, seed=seed)
+        fixtures.make_dtt_tree(os.path.join(work, "DTT"), pairs, scale["ccf_days"], filters, seed=seed)
+        with open(marker, "w") as f:
+            json.dump(params, f)
+        print(f"Fixtures generated in {time.perf_counter() - started:.1f}s under {work}")
+
+    for name in OUTPUTS:
+        path = os.path.join(work, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+def pipeline_config(work, scale, workers):
+    filters = [f"{i + 1:02d}" for i in range(scale["filters"])]
+    return {
+        "seismic_processing": {
+            "source_folder": os.path.join(work, "raw"),
+            "output_folder": os.path.join(work, "SDS"),
+            "workers": workers, "verbose": False, "incremental": True,
+            "state_path": os.path.join(work, "sds_conversion_state.sqlite"),
+        },
+        "data_scan": {
+            "sds_root": work,
+            "db_path": os.path.join(work, "msnoise.sqlite"),
+            "workers": workers, "incremental": True,
+            "filter_config": [{"ref": int(f), "low": 0.1 * int(f), "mwcs_low": 0.1 * int(f),
+                               "high": 0.5 * int(f), "mwcs_high": 0.5 * int(f), "rms_threshold": 0,
+                               "mwcs_wlen": 12, "mwcs_step": 4} for f in filters],
+        },
+        "search_criteria": {"start_date": "2025-01-01", "end_date": "2025-12-31"},
+        "instrumentation": {"report_dir": None},
+        "visualization": {
+            "figs_folder": os.path.join(work, "Figs"),
+            "ccf_cache_folder": os.path.join(work, "ccf_cache"),
+            "dtt_store": os.path.join(work, "dtt_store.sqlite"),
+            "catalog": os.path.join(work, "catalog.sqlite"),
+            "dtt_workers": workers,
+            "heatmap_decimation": True,
+            "ccf_max_lag": 60.0,
+            "ccf_normalization": "max",
+            "filter_set": filters[0],
+            "component": "ZZ",
+            "cc_files_template": os.path.join(work, "STACKS", "{filter_set}", "001_DAYS", "{component}"),
+            "dtt_folder_template": os.path.join(work, "DTT", "{filter_set}", "005_DAYS", "{component}"),
+            "station1": "XX-S000",
+            "station2": "XX-S001",
+        },
+    }
+
+
+def measure(name, stage_name, func, trace_memory, quiet):
+    report = instrumentation.setup({"instrumentation": {"report_dir": None}}, name, write_at_exit=False)
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+    sink = io.StringIO() if quiet else None
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(sink) if quiet else contextlib.nullcontext():
+        func()
+    elapsed = time.perf_counter() - started
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    stage = report.stages.get(stage_name)
+    counters = {k: v for k, v in stage.counters.items() if v} if stage else {}
+    result = {
+        "seconds": round(elapsed, 4),
+        "peak_mb": round(peak / 2 ** 20, 2) if peak is not None else None,
+        "counters": counters,
+        "throughput": {f"{k}_per_s": round(counters[k] / elapsed, 2)
+                       for k in ("files_read", "files_written", "samples") if k in counters},
+    }
+    if stage and stage.errors:
+        result["errors"] = stage.errors[:5]
+    throughput = ", ".join(f"{k} {v:,.1f}" for k, v in result["throughput"].items())
+    memory = f"{result['peak_mb']:8.1f} MB" if peak is not None else ""
+    print(f"  {name:<20} {elapsed:9.3f}s {memory}  {throughput}")
+    return result
+
+
+def run(args):
+    scale = dict(SCALES[args.scale])
+    for key in scale:
+        if getattr(args, key, None) is not None:
+            scale[key] = getattr(args, key)
+    selected = args.only.split(",") if args.only else BENCHMARKS
+
+    work = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix="msnoise_demo_bench_")
+    os.makedirs(work, exist_ok=True)
+    prepare(work, scale, args.seed)
+    config = pipeline_config(work, scale, args.workers)
+    config["visualization"]["render_mode"] = args.render_mode
+    config_path = os.path.join(work, "config.json")
+    with open(config_path, "w") as f:
+        json.dump(config, f, indent=1)
+
+    setting = load_script("00_Config_setting")
+    analysis = load_script("02_Analysis")
+    pairs = fixtures.pair_names(max(scale["stations"], 2), scale["ccf_pairs"])
+    fixtures.init_msnoise_db(config["data_scan"]["db_path"], [f"{i + 1:02d}" for i in range(scale["filters"])])
+
+    def plot_all(method):
+        viz = analysis.MSNoiseVisualizer(config_path)
+        for pair in pairs:
+            getattr(viz, method)(pair)
+
+    steps = {
+        "step2_cold": ("sds", lambda: setting.step2_process_to_sds(config)),
+        "step2_incremental": ("sds", lambda: setting.step2_process_to_sds(config)),
+        "step3_cold": ("scan", lambda: setting.step3_scan_to_db(config)),
+        "step3_incremental": ("scan", lambda: setting.step3_scan_to_db(config)),
+        "ccf_heatmap_cold": ("ccf_heatmap", lambda: plot_all("plot_ccf_heatmap")),
+        "ccf_heatmap_warm": ("ccf_heatmap", lambda: plot_all("plot_ccf_heatmap")),
+        "dvv_heatmap_cold": ("dvv_heatmap", lambda: plot_all("plot_dvv_heatmap")),
+        "dvv_heatmap_warm": ("dvv_heatmap", lambda: plot_all("plot_dvv_heatmap")),
+    }
+
+    print(f"Scale '{args.scale}': {scale}, workers={args.workers}")
+    results = {}
+    cwd = os.getcwd()
+    # Step 3 reads downloaded_stations_metadata.csv from the working directory.
+    os.chdir(work)
+    try:
+        for name in BENCHMARKS:
+            if name in selected:
+                stage_name, func = steps[name]
+                results[name] = measure(name, stage_name, func, not args.no_memory, not args.verbose)
+    finally:
+        os.chdir(cwd)
+        if not args.workdir and not args.keep:
+            shutil.rmtree(work, ignore_errors=True)
+
+    record = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "scale_name": args.scale,
+        "scale": scale,
+        "seed": args.seed,
+        "workers": args.workers,
+        "render_mode": args.render_mode,
+        "tracemalloc": not args.no_memory,
+        "results": results,
+    }
+    if args.compare:
+        compare(record, args.output)
+    with open(args.output, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+    print(f"Results appended to {args.output}")
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO,
+                               capture_output=True, text=True, check=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(record, path):
+    """Print the change against the last recorded run with the same scale, workers, render mode and tracing."""
+    previous = None
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                old = json.loads(line)
+                # Runs recorded before render modes existed rendered in full.
+                old.setdefault("render_mode", "full")
+                if all(old.get(k) == record[k] for k in ("scale", "seed", "workers", "render_mode", "tracemalloc")):
+                    previous = old
+    if previous is None:
+        print("No earlier run with the same settings to compare against.")
+        return
+    print(f"Compared with {previous['commit']} ({previous['timestamp']}):")
+    for name, res in record["results"].items():
+        old = previous["results"].get(name)
+        if old and old["seconds"]:
+            print(f"  {name:<20} {res['seconds'] / old['seconds']:6.2f}x time"
+                  + (f", {res['peak_mb'] - old['peak_mb']:+.1f} MB peak"
+                     if res.get("peak_mb") is not None and old.get("peak_mb") is not None else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the SDS, scan and figure stages on synthetic data")
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--stations", type=int, help="override the number of stations")
+    parser.add_argument("--days", type=int, help="override the number of raw days")
+    parser.add_argument("--sampling-rate", dest="sampling_rate", type=float)
+    parser.add_argument("--ccf-pairs", dest="ccf_pairs", type=int)
+    parser.add_argument("--ccf-days", dest="ccf_days", type=int)
+    parser.add_argument("--filters", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes for the stages (peak memory only covers the main process)")
+    parser.add_argument("--render-mode", dest="render_mode", choices=("full", "fast", "preview"), default="full",
+                        help="visualization.render_mode used by the heatmap benchmarks")
+    parser.add_argument("--only", help=f"comma-separated subset of {','.join(BENCHMARKS)}")
+    parser.add_argument("--workdir", help="keep fixtures here and reuse them on the next run")
+    parser.add_argument("--keep", action="store_true", help="do not delete the temporary work directory")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip tracemalloc (faster, no peak memory figures)")
+    parser.add_argument("--output", default=os.path.join(HERE, "results.jsonl"))
+    parser.add_argument("--compare", action="store_true", help="compare with the last matching run in --output")
+    parser.add_argument("--verbose", action="store_true", help="show the stages' own output")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Directory levels below the root of each MSNoise output tree, and the day files at the bottom:
+#   STACKS/{filter}/{stack}/{component}/{pair}/{date}.MSEED
+#   DTT/{filter}/{stack}/{component}/{date}.txt
+LAYOUTS = {
+    "ccf": (("filter", "stack", "component", "pair"), ".MSEED"),
+    "dtt": (("filter", "stack", "component"), ".txt"),
+}
+# A directory modified this recently may still change within the same mtime
+# tick (1-2 s on some network filesystems); it is listed again next time.
+RACY_NS = 2_000_000_000
+
+FileStamp = Tuple[str, int, int]
+
+
+def station_pair(station1: str, station2: str) -> str:
+    """"NET-STA" codes -> the MSNoise pair folder name, NET_STA_NET_STA in sorted order."""
+    return "_".join(sorted(s.replace("-", "_") for s in (station1, station2)))
+
+
+def split_folder(folder: str) -> Tuple[str, str, str, str]:
+    """./DTT/01/005_DAYS/ZZ -> ("DTT", "01", "005_DAYS", "ZZ"); the same for STACKS folders."""
+    rest, component = os.path.split(os.path.normpath(folder))
+    rest, stack = os.path.split(rest)
+    root, filter_id = os.path.split(rest)
+    return root or ".", filter_id, stack, component
+
+
+def _stat_dir(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _list_subdirs(path: str) -> List[str]:
+    try:
+        return sorted(e.name for e in os.scandir(path)
+                      if e.is_dir() and not e.name.startswith("."))
+    except OSError:
+        return []
+
+
+def _list_files(path: str, suffix: str) -> List[Tuple[str, int, int]]:
+    out = []
+    try:
+        for entry in os.scandir(path):
+            if entry.name.endswith(suffix) and not entry.name.startswith("."):
+                st = entry.stat()
+                out.append((entry.name, st.st_size, st.st_mtime_ns))
+    except OSError:
+        pass
+    return out
+
+
+def _stat_file(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+    except OSError:
+        return None
+
+
+class Catalog:
+    """Persisted index of the STACKS and DTT trees: pair x filter x stack x component x date -> file.
+
+    `refresh` walks a tree level by level. A directory whose mtime has not
+    changed since the last walk is not listed again (its subdirectories or
+    day files are taken from the index), so a refresh of an unchanged tree
+    costs one stat per directory. With `verify_files`, the day files of
+    unchanged directories are still stat'ed to catch files rewritten in place,
+    which does not touch the directory's mtime.
+    """
+
+    def __init__(self, path: str, workers: int = 8, verify_files: bool = True):
+        self.path = path
+        self.workers = max(1, int(workers))
+        self.verify_files = verify_files
+        # Pipeline stages running side by side may refresh the same catalog.
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS catalog_dirs (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                children TEXT
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS catalog_files (
+                root TEXT NOT NULL,
+                filter TEXT NOT NULL,
+                stack TEXT NOT NULL,
+                component TEXT NOT NULL,
+                pair TEXT NOT NULL,
+                date TEXT NOT NULL,
+                dir TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                PRIMARY KEY (root, filter, stack, component, pair, date)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS catalog_files_dir ON catalog_files (dir);
+        """)
+        self.conn.commit()
+        self.refreshed = set()
+
+    def _map(self, func, items):
+        if len(items) < 2:
+            return [func(i) for i in items]
+        # Listing and stat'ing are latency-bound on network filesystems.
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(func, items))
+
+    def refresh(self, root: str, kind: str) -> Dict[str, int]:
+        """Bring the index of one tree up to date; returns counts of listed dirs and changed files."""
+        levels, suffix = LAYOUTS[kind]
+        root = os.path.abspath(root)
+        prefix = root + os.sep
+        known = {p: (m, c) for p, m, c in self.conn.execute(
+            "SELECT path, mtime_ns, children FROM catalog_dirs WHERE path = ? OR substr(path, 1, ?) = ?",
+            (root, len(prefix), prefix))}
+        now = time.time_ns()
+        stats = {"dirs_listed": 0, "files_added": 0, "files_changed": 0, "files_removed": 0}
+        seen_dirs, dir_rows = set(), []
+
+        def unchanged(path, mtime):
+            return mtime is not None and known.get(path, (None,))[0] == mtime
+
+        def stamp(mtime):
+            return -1 if now - mtime < RACY_NS else mtime
+
+        # Inner levels: only directories whose mtime moved are listed.
+        frontier = [(root, ())]
+        for _ in levels:
+            mtimes = self._map(_stat_dir, [d for d, _ in frontier])
+            relist = [d for (d, _), m in zip(frontier, mtimes) if m is not None and not unchanged(d, m)]
+            listings = dict(zip(relist, self._map(_list_subdirs, relist)))
+            stats["dirs_listed"] += len(relist)
+            next_frontier = []
+            for (directory, keys), mtime in zip(frontier, mtimes):
+                if mtime is None:
+                    continue
+                seen_dirs.add(directory)
+                if directory in listings:
+                    children = listings[directory]
+                    dir_rows.append((directory, stamp(mtime), json.dumps(children)))
+                else:
+                    children = json.loads(known[directory][1])
+                next_frontier.extend((os.path.join(directory, c), keys + (c,)) for c in children)
+            frontier = next_frontier
+
+        # Leaf level: the day files.
+        mtimes = self._map(_stat_dir, [d for d, _ in frontier])
+        leaves = [(d, k, m) for (d, k), m in zip(frontier, mtimes) if m is not None]
+        relist = [d for d, _, m in leaves if not unchanged(d, m)]
+        listings = dict(zip(relist, self._map(lambda d: _list_files(d, suffix), relist)))
+        stats["dirs_listed"] += len(relist)
+
+        indexed = {}
+        for d, *rest in self.conn.execute(
+                "SELECT dir, date, path, size, mtime_ns FROM catalog_files WHERE root = ?", (root,)):
+            indexed.setdefault(d, {})[rest[0]] = tuple(rest[1:])
+
+        upserts, deletes = [], []
+        if self.verify_files:
+            to_verify = [(d, date, path) for d, _, m in leaves if d not in listings
+                         for date, (path, _, _) in indexed.get(d, {}).items()]
+            verified = dict(zip(((d, date) for d, date, _ in to_verify),
+                                self._map(_stat_file, [p for _, _, p in to_verify])))
+        else:
+            verified = {}
+
+        for directory, keys, mtime in leaves:
+            seen_dirs.add(directory)
+            fields = dict(zip(levels, keys))
+            row_keys = (root, fields["filter"], fields["stack"], fields["component"], fields.get("pair", ""))
+            old = indexed.pop(directory, {})
+            if directory in listings:
+                dir_rows.append((directory, stamp(mtime), None))
+                current = {name[:-len(suffix)]: (os.path.join(directory, name), size, mt)
+                           for name, size, mt in listings[directory]}
+            else:
+                current = dict(old)
+                for date, (path, _, _) in old.items():
+                    if (directory, date) in verified:
+                        st = verified[(directory, date)]
+                        if st is None:
+                            del current[date]
+                        else:
+                            current[date] = (path, *st)
+            for date, value in current.items():
+                if date not in old:
+                    stats["files_added"] += 1
+                elif old[date] != value:
+                    stats["files_changed"] += 1
+                else:
+                    continue
+                upserts.append(row_keys + (date, directory) + value)
+            for date in old.keys() - current.keys():
+                stats["files_removed"] += 1
+                deletes.append(row_keys + (date,))
+
+        # Leaf directories left in `indexed` disappeared since the last walk.
+        stats["files_removed"] += sum(len(dates) for dates in indexed.values())
+        gone = [(d,) for d in known if d not in seen_dirs]
+
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO catalog_dirs VALUES (?, ?, ?)", dir_rows)
+            self.conn.executemany("DELETE FROM catalog_dirs WHERE path = ?", gone)
+            self.conn.executemany("DELETE FROM catalog_files WHERE dir = ?", [(d,) for d in indexed])
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO catalog_files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", upserts)
+            self.conn.executemany(
+                "DELETE FROM catalog_files WHERE root = ? AND filter = ? AND stack = ? "
+                "AND component = ? AND pair = ? AND date = ?", deletes)
+        self.refreshed.add((root, kind))
+        return stats
+
+    def ensure(self, root: str, kind: str) -> None:
+        """Refresh a tree once per Catalog object; later lookups in the same run reuse the index."""
+        if (os.path.abspath(root), kind) not in self.refreshed:
+            self.refresh(root, kind)
+
+    def days(self, folder: str, pair: str = "") -> Dict[str, FileStamp]:
+        """date -> (path, size, mtime_ns) of one {root}/{filter}/{stack}/{component} folder (and pair)."""
+        root, filter_id, stack, component = split_folder(folder)
+        rows = self.conn.execute(
+            "SELECT date, path, size, mtime_ns FROM catalog_files WHERE root = ? AND filter = ? "
+            "AND stack = ? AND component = ? AND pair = ? ORDER BY date",
+            (os.path.abspath(root), filter_id, stack, component, pair))
+        return {date: (path, size, mtime) for date, path, size, mtime in rows}
+
+    def files(self, root: str, stack: Optional[str] = None,
+              components: Optional[Iterable[str]] = None) -> List[Tuple]:
+        """(path, filter, stack, component, pair, date, size, mtime_ns) of every indexed file under a root."""
+        sql = ("SELECT path, filter, stack, component, pair, date, size, mtime_ns "
+               "FROM catalog_files WHERE root = ?")
+        params: List = [os.path.abspath(root)]
+        if stack is not None:
+            sql += " AND stack = ?"
+            params.append(stack)
+        rows = self.conn.execute(sql + " ORDER BY filter, stack, component, pair, date", params).fetchall()
+        if components:
+            rows = [r for r in rows if r[3] in set(components)]
+        return rows
+
+    def groups(self, root: str, stack: Optional[str] = None,
+               components: Optional[Sequence[str]] = None) -> List[Tuple[str, str, str, str]]:
+        """Distinct (filter, stack, component, pair) folders under a root that hold at least one file."""
+        sql = "SELECT DISTINCT filter, stack, component, pair FROM catalog_files WHERE root = ?"
+        params: List = [os.path.abspath(root)]
+        if stack is not None:
+            sql += " AND stack = ?"
+            params.append(stack)
+        rows = self.conn.execute(sql + " ORDER BY filter, stack, component, pair", params).fetchall()
+        return [r for r in rows if not components or r[2] in components]
+
+    def fingerprint(self, root: str) -> Optional[str]:
+        """Hash of every indexed file's path, size and mtime under a root (None if it holds none)."""
+        h = hashlib.sha1()
+        n = 0
+        for path, size, mtime in self.conn.execute(
+                "SELECT path, size, mtime_ns FROM catalog_files WHERE root = ? ORDER BY path",
+                (os.path.abspath(root),)):
+            h.update(f"{path}\0{size}\0{mtime}\n".encode())
+            n += 1
+        return h.hexdigest() if n else None
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def open_catalog(viz_cfg: dict) -> Catalog:
+    return Catalog(viz_cfg.get("catalog", "./catalog.sqlite"),
+                   verify_files=bool(viz_cfg.get("catalog_verify_files", True)))
@@ -0,0 +1,373 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from fractions import Fraction
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import instrumentation
+from catalog import station_pair
+from config_loader import load_config
+from mseed_scan import list_sds
+
+STACK_DIR = "001_DAYS"
+DEFAULTS = {
+    "sds_folder": None,            # seismic_processing.output_folder when null
+    "output_folder": "./STACKS",
+    "components": ["ZZ"],
+    "filters": None,               # refs from data_scan.filter_config; all when null
+    "cc_sampling_rate": 20.0,
+    "maxlag": 120.0,
+    "corr_duration": 1800.0,
+    "overlap": 0.0,
+    "max_gap_fraction": 0.05,
+    "normalization": "onebit",     # onebit, clip or none
+    "clip_factor": 3.0,
+    "whitening": True,
+    "taper_fraction": 0.2,
+    "workers": None,
+    "overwrite": False,
+}
+NORMALIZATIONS = ("onebit", "clip", "none")
+# Bytes of cross-spectral matrices computed at once (frequencies x stations x stations).
+CHUNK_BYTES = 64 * 1024 ** 2
+
+
+def engine_settings(config: Dict[str, Any]) -> Dict[str, Any]:
+    settings = dict(DEFAULTS, **config.get("cc_engine", {}))
+    settings["sds_folder"] = settings["sds_folder"] or \
+        config.get("seismic_processing", {}).get("output_folder", "SDS")
+    if settings["normalization"] not in NORMALIZATIONS:
+        raise ValueError(f"Unknown normalization '{settings['normalization']}', expected one of {NORMALIZATIONS}")
+    return settings
+
+
+def filter_bands(config: Dict[str, Any], refs: Optional[List[int]] = None) -> List[Tuple[str, float, float]]:
+    """(folder, low, high) of every filter in data_scan.filter_config, e.g. ("01", 0.1, 0.3)."""
+    raw = config.get("data_scan", {}).get("filter_config", [])
+    if isinstance(raw, dict):
+        raw = [raw]
+    return [(f"{int(f['ref']):02d}", float(f["low"]), float(f["high"])) for f in raw
+            if not refs or int(f["ref"]) in refs]
+
+
+def sds_index(sds_folder: str) -> Dict[str, Dict[Tuple[str, str], str]]:
+    """date -> {(NET_STA, component letter): path} of the day files written by step 2."""
+    index: Dict[str, Dict[Tuple[str, str], str]] = {}
+    for root, files in list_sds(sds_folder):
+        for fname in files:
+            parts = fname.split(".")
+            # {net}.{sta}.{loc}.{chan}.D.{year}.{jday}
+            if len(parts) != 7 or parts[4] != "D":
+                continue
+            net, sta, _, chan, _, year, jday = parts
+            try:
+                day = datetime.strptime(f"{year}{jday}", "%Y%j").strftime("%Y-%m-%d")
+            except ValueError:
+                continue
+            index.setdefault(day, {})[(f"{net}_{sta}", chan[-1])] = os.path.join(root, fname)
+    return index
+
+
+def band_taper(freqs: np.ndarray, low: float, high: float, fraction: float) -> np.ndarray:
+    """1 inside [low, high] with cosine roll-offs of `fraction` of the band width on both sides."""
+    width = max(fraction * (high - low), freqs[1] - freqs[0])
+    taper = ((freqs >= low) & (freqs <= high)).astype(np.float64)
+    rise = (freqs >= low - width) & (freqs < low)
+    taper[rise] = 0.5 * (1 - np.cos(np.pi * (freqs[rise] - (low - width)) / width))
+    fall = (freqs > high) & (freqs <= high + width)
+    taper[fall] = 0.5 * (1 + np.cos(np.pi * (freqs[fall] - high) / width))
+    return taper
+
+
+class Spectra:
+    """FFT grid shared by every station-day: window length, padded FFT size and the used frequency band."""
+
+    def __init__(self, settings: Dict[str, Any], bands: List[Tuple[str, float, float]]):
+        from scipy.fft import next_fast_len, rfftfreq
+
+        self.sr = float(settings["cc_sampling_rate"])
+        self.nwin = int(round(settings["corr_duration"] * self.sr))
+        self.step = max(1, int(round(self.nwin * (1 - settings["overlap"]))))
+        self.n_day = int(round(86400 * self.sr))
+        # Zero padding to at least 2 * nwin - 1 keeps the correlation from wrapping around.
+        self.nfft = next_fast_len(2 * self.nwin - 1, real=True)
+        self.maxlag = min(int(round(settings["maxlag"] * self.sr)), self.nwin - 1)
+        freqs = rfftfreq(self.nfft, 1 / self.sr)
+        self.tapers = {name: band_taper(freqs, low, high, settings["taper_fraction"])
+                       for name, low, high in bands}
+        used = np.nonzero(np.any(list(self.tapers.values()), axis=0))[0]
+        self.band = slice(int(used[0]), int(used[-1]) + 1) if len(used) else slice(0, 0)
+        self.n_freq = len(freqs)
+
+
+def _resample(data: np.ndarray, valid: np.ndarray, sr: float, target: float) -> Tuple[np.ndarray, np.ndarray]:
+    from scipy import signal
+
+    if sr == target:
+        return data, valid
+    ratio = Fraction(target / sr).limit_denominator(1000)
+    if ratio.numerator == 1:
+        # Integer decimation: anti-alias low-pass, then keep every n-th sample.
+        sos = signal.butter(8, 0.4 * target, fs=sr, output="sos")
+        factor = ratio.denominator
+        return signal.sosfiltfilt(sos, data)[::factor], valid[::factor]
+    out = signal.resample_poly(data, ratio.numerator, ratio.denominator)
+    idx = np.minimum((np.arange(len(out)) * sr / target).astype(np.int64), len(valid) - 1)
+    return out, valid[idx]
+
+
+def preprocess_station_day(path: str, day: str, settings: Dict[str, Any],
+                           grid: Spectra) -> Optional[Tuple[np.ndarray, np.ndarray, int]]:
+    """Whitened spectra (windows x band frequencies) of one station-day, the usable windows and the samples read.
+
+    The day is placed on a zero-filled 24 h grid at cc_sampling_rate, cut
+    into corr_duration windows, normalized in time (one-bit or clipping),
+    transformed once and, with whitening, reduced to its phase. Band limits
+    are applied later per filter, so this FFT serves every filter and pair.
+    """
+    import obspy
+    from numpy.lib.stride_tricks import sliding_window_view
+    from scipy.fft import rfft
+    from scipy.signal.windows import tukey
+
+    st = obspy.read(path)
+    st.merge(method=1)
+    tr = max(st, key=lambda t: t.stats.npts)
+    raw = np.ma.asarray(tr.data, dtype=np.float64)
+    valid = ~np.ma.getmaskarray(raw)
+    data = raw.filled(0.0)
+    if valid.any():
+        data[valid] -= data[valid].mean()
+    data, valid = _resample(data, valid, tr.stats.sampling_rate, grid.sr)
+
+    x = np.zeros(grid.n_day)
+    ok = np.zeros(grid.n_day, dtype=bool)
+    offset = int(round((tr.stats.starttime - obspy.UTCDateTime(day)) * grid.sr))
+    src0, dst0 = max(0, -offset), max(0, offset)
+    n = min(len(data) - src0, grid.n_day - dst0)
+    if n <= 0:
+        return None
+    x[dst0:dst0 + n] = data[src0:src0 + n]
+    ok[dst0:dst0 + n] = valid[src0:src0 + n]
+
+    starts = np.arange(0, grid.n_day - grid.nwin + 1, grid.step)
+    segs = sliding_window_view(x, grid.nwin)[starts].copy()
+    seg_ok = sliding_window_view(ok, grid.nwin)[starts]
+    usable = seg_ok.mean(axis=1) >= 1 - settings["max_gap_fraction"]
+    counts = np.maximum(seg_ok.sum(axis=1, keepdims=True), 1)
+    segs = np.where(seg_ok, segs - segs.sum(axis=1, keepdims=True) / counts, 0.0)
+
+    if settings["normalization"] == "onebit":
+        segs = np.sign(segs)
+    elif settings["normalization"] == "clip":
+        rms = np.sqrt(np.mean(segs ** 2, axis=1, keepdims=True))
+        limit = settings["clip_factor"] * rms
+        segs = np.clip(segs, -limit, limit)
+
+    spec = rfft(segs * tukey(grid.nwin, 0.04), grid.nfft, axis=1)[:, grid.band]
+    if settings["whitening"]:
+        amp = np.abs(spec)
+        spec = np.divide(spec, amp, out=np.zeros_like(spec), where=amp > 0)
+    spec[~usable] = 0
+    return spec.astype(np.complex64), usable, int(valid.sum())
+
+
+def cross_spectra(x1: np.ndarray, x2: np.ndarray, ii: np.ndarray, jj: np.ndarray) -> np.ndarray:
+    """Window-summed conj(S_i) * S_j for the pairs (ii, jj), shape (pairs, frequencies).
+
+    Per frequency this is one (stations x windows) @ (windows x stations)
+    matrix product, so every pair reuses the stations' spectra instead of
+    transforming each pair again.
+    """
+    n_sta, _, n_freq = x1.shape
+    out = np.empty((len(ii), n_freq), dtype=np.complex64)
+    chunk = max(1, CHUNK_BYTES // (8 * n_sta * n_sta))
+    for f0 in range(0, n_freq, chunk):
+        a = np.conj(x1[:, :, f0:f0 + chunk]).transpose(2, 0, 1)
+        b = x2[:, :, f0:f0 + chunk].transpose(2, 1, 0)
+        out[:, f0:f0 + chunk] = (a @ b)[:, ii, jj].T
+    return out
+
+
+def _write_ccf(path: str, data: np.ndarray, sr: float, day: str, component: str) -> None:
+    from obspy import Trace, UTCDateTime
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lag = (len(data) - 1) / 2 / sr
+    tr = Trace(data=data.astype(np.float32), header={
+        "network": "CC", "channel": component, "sampling_rate": sr,
+        "starttime": UTCDateTime(day) - lag})
+    tmp = f"{path}.{os.getpid()}.tmp"
+    tr.write(tmp, format="MSEED")
+    os.replace(tmp, path)
+
+
+def _pairs(stations: List[str], inputs: Dict[Tuple[str, str], str], component: str):
+    c1, c2 = component
+    return [(i, j) for i in range(len(stations)) for j in range(i + 1, len(stations))
+            if (stations[i], c1) in inputs and (stations[j], c2) in inputs]
+
+
+def _outputs(output_folder: str, day: str, stations, inputs, components, bands):
+    return [os.path.join(output_folder, name, STACK_DIR, comp,
+                         station_pair(stations[i], stations[j]), f"{day}.MSEED")
+            for comp in components for i, j in _pairs(stations, inputs, comp) for name, _, _ in bands]
+
+
+def _is_current(outputs: List[str], inputs: Dict[Tuple[str, str], str]) -> bool:
+    try:
+        newest_input = max(os.path.getmtime(p) for p in inputs.values())
+        return bool(outputs) and min(os.path.getmtime(p) for p in outputs) >= newest_input
+    except OSError:
+        return False
+
+
+def correlate_day(day: str, inputs: Dict[Tuple[str, str], str], settings: Dict[str, Any],
+                  bands: List[Tuple[str, float, float]]) -> Dict[str, Any]:
+    """Daily CCFs of every pair, component and filter for one day; returns counters and errors."""
+    from scipy.fft import irfft
+
+    result = {"day": day, "files_read": 0, "files_written": 0, "files_skipped": 0,
+              "files_failed": 0, "samples": 0, "pairs": 0, "errors": []}
+    components = settings["components"]
+    stations = sorted({sta for sta, _ in inputs})
+    letters = {c for comp in components for c in comp}
+    inputs = {k: v for k, v in inputs.items() if k[1] in letters}
+    outputs = _outputs(settings["output_folder"], day, stations, inputs, components, bands)
+    if not outputs:
+        return result
+    if not settings["overwrite"] and _is_current(outputs, inputs):
+        result["files_skipped"] = len(outputs)
+        return result
+
+    grid = Spectra(settings, bands)
+    spectra = {}
+    # One preprocessing and FFT per station-day and channel, shared by all pairs and filters.
+    for key, path in sorted(inputs.items()):
+        try:
+            out = preprocess_station_day(path, day, settings, grid)
+        except Exception as e:
+            result["files_failed"] += 1
+            result["errors"].append(f"{path}: {e}")
+            continue
+        result["files_read"] += 1
+        if out is not None:
+            spectra[key] = out
+            result["samples"] += out[2]
+    if not spectra:
+        return result
+
+    n_win = next(iter(spectra.values()))[0].shape[0]
+    n_band = grid.band.stop - grid.band.start
+    lag = grid.maxlag
+    for comp in components:
+        x, usable = {}, {}
+        for c in set(comp):
+            x[c] = np.zeros((len(stations), n_win, n_band), dtype=np.complex64)
+            usable[c] = np.zeros((len(stations), n_win))
+            for i, sta in enumerate(stations):
+                if (sta, c) in spectra:
+                    x[c][i], usable[c][i] = spectra[(sta, c)][:2]
+        pairs = _pairs(stations, spectra, comp)
+        if not pairs:
+            continue
+        ii, jj = (np.array(v) for v in zip(*pairs))
+        # Number of windows both stations of a pair could use, to average the sum.
+        n_common = (usable[comp[0]] @ usable[comp[1]].T)[ii, jj]
+        keep = n_common > 0
+        if not keep.any():
+            continue
+        ii, jj, n_common = ii[keep], jj[keep], n_common[keep]
+        cross = cross_spectra(x[comp[0]], x[comp[1]], ii, jj) / n_common[:, None].astype(np.float32)
+        result["pairs"] += len(ii)
+
+        full = np.zeros((len(ii), grid.n_freq), dtype=np.complex64)
+        for name, _, _ in bands:
+            full[:, grid.band] = cross * grid.tapers[name][grid.band] ** 2
+            ccfs = irfft(full, grid.nfft, axis=1)
+            # Negative lags sit at the end of the circular correlation.
+            ccfs = np.concatenate([ccfs[:, -lag:], ccfs[:, :lag + 1]], axis=1) if lag else ccfs[:, :1]
+            for k, (i, j) in enumerate(zip(ii, jj)):
+                path = os.path.join(settings["output_folder"], name, STACK_DIR, comp,
+                                    station_pair(stations[i], stations[j]), f"{day}.MSEED")
+                try:
+                    _write_ccf(path, ccfs[k], grid.sr, day, comp)
+                    result["files_written"] += 1
+                except Exception as e:
+                    result["files_failed"] += 1
+                    result["errors"].append(f"{path}: {e}")
+    return result
+
+
+@instrumentation.timed("cc")
+def run(config: Dict[str, Any], start: Optional[str] = None, end: Optional[str] = None) -> Dict[str, int]:
+    print("\n" + "=" * 60)
+    print("Cross-correlating SDS day files")
+    print("=" * 60)
+
+    settings = engine_settings(config)
+    bands = filter_bands(config, settings["filters"])
+    st = instrumentation.stage("cc")
+    if not bands:
+        print("No filters in data_scan.filter_config; nothing to correlate.")
+        st.error("no filters configured")
+        return {}
+    search = config.get("search_criteria", {})
+    start = (start or search.get("start_date") or "0000")[:10]
+    end = (end or search.get("end_date") or "9999")[:10]
+
+    index = sds_index(settings["sds_folder"])
+    days = [d for d in sorted(index) if start <= d <= end]
+    print(f"--> {len(days)} days in {settings['sds_folder']}, components {','.join(settings['components'])}, "
+          f"filters {','.join(name for name, _, _ in bands)}")
+    workers = int(settings["workers"] or os.cpu_count() or 1)
+
+    if workers > 1 and len(days) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(correlate_day, days, [index[d] for d in days],
+                                   [settings] * len(days), [bands] * len(days))
+            results = list(results)
+    else:
+        results = [correlate_day(d, index[d], settings, bands) for d in days]
+
+    totals = {}
+    for res in results:
+        for msg in res.pop("errors"):
+            print(f"Failed {msg}")
+            st.error(msg)
+        day = res.pop("day")
+        for key, value in res.items():
+            totals[key] = totals.get(key, 0) + value
+        if res["files_written"]:
+            print(f"{day}: {res['pairs']} pairs, {res['files_written']} CCFs written")
+    st.add(**totals)
+    print(f"--> {totals.get('files_written', 0)} CCFs written, {totals.get('files_skipped', 0)} up to date, "
+          f"{totals.get('files_failed', 0)} failed")
+    return totals
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, int]:
+    parser = argparse.ArgumentParser(
+        description="Daily CCFs of all station pairs from the SDS archive, in the MSNoise STACKS layout")
+    parser.add_argument("--config", default="config.json")
+    parser.add_argument("--start", help="first day (YYYY-MM-DD), default search_criteria.start_date")
+    parser.add_argument("--end", help="last day (YYYY-MM-DD), default search_criteria.end_date")
+    parser.add_argument("--components", help="comma-separated components, e.g. ZZ,ZN")
+    parser.add_argument("--workers", type=int, help="days processed in parallel")
+    parser.add_argument("--overwrite", action="store_true", help="recompute days whose CCFs are up to date")
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    overrides = {k: v for k, v in (("components", args.components and args.components.split(",")),
+                                   ("workers", args.workers), ("overwrite", args.overwrite or None))
+                 if v is not None}
+    config = dict(config, cc_engine=dict(config.get("cc_engine", {}), **overrides))
+    instrumentation.setup(config, "cc_engine")
+    return run(config, args.start, args.end)
+
+
+if __name__ == "__main__":
+    main()
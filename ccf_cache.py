@@ -0,0 +1,222 @@
+import json
+import math
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from catalog import FileStamp, split_folder
+from ccf_processing import lag_axis, lag_mask, lag_window, normalize
+
+INDEX_FILE = "index.json"
+DATA_FILE = "data.f32"
+
+
+class CCFCube:
+    """All daily CCFs of one pair/filter/stack/component packed as float32 rows.
+
+    Rows live in a raw float32 file in the order they were added, so new days
+    are appended without rewriting anything; `index.json` maps row -> date and
+    remembers the size/mtime of the source file each row came from.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, INDEX_FILE)
+        self.data_path = os.path.join(cache_dir, DATA_FILE)
+        self.index = self._read_index()
+
+    def _read_index(self) -> Dict:
+        if os.path.exists(self.index_path) and os.path.exists(self.data_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            row_bytes = index["npts"] * 4 if index.get("npts") else 0
+            # A crash between appending data and saving the index leaves extra
+            # bytes at the end; those rows are simply ignored and overwritten.
+            if row_bytes and os.path.getsize(self.data_path) >= row_bytes * len(index["dates"]):
+                return index
+        return {"npts": None, "sampling_rate": None, "dates": [], "sources": {}}
+
+    def _write_index(self) -> None:
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self.index_path)
+
+    def __len__(self) -> int:
+        return len(self.index["dates"])
+
+    @property
+    def npts(self) -> Optional[int]:
+        return self.index["npts"]
+
+    @property
+    def sampling_rate(self) -> Optional[float]:
+        return self.index["sampling_rate"]
+
+    def update(self, pair_folder: str, suffix: str = ".MSEED",
+               files: Optional[Dict[str, FileStamp]] = None) -> Tuple[int, int]:
+        """Read new or changed day files into the cube; `files` (date -> (path, size, mtime_ns),
+        e.g. from the catalog) replaces listing and stat'ing `pair_folder`."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if files is None:
+            files = {}
+            for fname in sorted(os.listdir(pair_folder)):
+                if fname.endswith(suffix):
+                    st = os.stat(os.path.join(pair_folder, fname))
+                    files[fname[:-len(suffix)]] = (os.path.join(pair_folder, fname), st.st_size, st.st_mtime_ns)
+
+        # Rows cannot be cut out of the packed file in place, so a day whose
+        # source file was deleted makes the cube start over from the files left.
+        stale = [d for d in self.index["dates"] if d not in files]
+        if stale:
+            print(f"{len(stale)} cached days no longer exist in {pair_folder}; rebuilding the cube")
+            self.index = {"npts": None, "sampling_rate": None, "dates": [], "sources": {}}
+            if os.path.exists(self.data_path):
+                os.unlink(self.data_path)
+
+        dates: List[str] = self.index["dates"]
+        sources: Dict[str, List[int]] = self.index["sources"]
+        rows = {d: i for i, d in enumerate(dates)}
+        added = replaced = 0
+        todo = [(date_str, path, [size, mtime]) for date_str, (path, size, mtime) in sorted(files.items())
+                if sources.get(date_str) != [size, mtime]]
+        if not todo:
+            if stale:
+                self._write_index()
+            return 0, 0
+
+        # Drop any half-written tail left by an interrupted update.
+        if os.path.exists(self.data_path):
+            with open(self.data_path, "r+b") as f:
+                f.truncate(len(dates) * (self.npts or 0) * 4)
+
+        # Each file is packed once, so it is read directly rather than through the
+        # shared loader cache, where it would only evict entries the plots reuse.
+        import obspy
+
+        with open(self.data_path, "ab") as out:
+            for date_str, path, stamp in todo:
+                fname = os.path.basename(path)
+                try:
+                    tr = obspy.read(path)[0]
+                except Exception as e:
+                    print(f"Skipping {fname}: {e}")
+                    continue
+                if self.npts is None:
+                    self.index["npts"] = int(tr.stats.npts)
+                    self.index["sampling_rate"] = float(tr.stats.sampling_rate)
+                if tr.stats.sampling_rate != self.sampling_rate:
+                    print(f"Skipping {fname}: sampling rate differs from the cached cube")
+                    continue
+
+                row = fit_to_npts(np.asarray(tr.data, dtype=np.float32), self.npts)
+                if date_str in rows:
+                    out.flush()
+                    with open(self.data_path, "r+b") as f:
+                        f.seek(rows[date_str] * self.npts * 4)
+                        f.write(row.tobytes())
+                    replaced += 1
+                else:
+                    out.write(row.tobytes())
+                    rows[date_str] = len(dates)
+                    dates.append(date_str)
+                    added += 1
+                sources[date_str] = stamp
+
+        self._write_index()
+        return added, replaced
+
+    def load(self, sort: bool = True) -> Tuple[List[str], np.ndarray]:
+        """Return (dates, matrix); matrix is a read-only memmap of shape (days, npts)."""
+        if not len(self):
+            return [], np.empty((0, 0), dtype=np.float32)
+        data = np.memmap(self.data_path, dtype=np.float32, mode="r",
+                         shape=(len(self), self.npts))
+        dates = self.index["dates"]
+        if sort:
+            order = np.argsort(dates, kind="stable")
+            if np.any(order != np.arange(len(order))):
+                # Only an out-of-order append pays for a reordered copy.
+                return [dates[i] for i in order], data[order]
+        return list(dates), data
+
+    def lags(self) -> np.ndarray:
+        return lag_axis(self.npts, self.sampling_rate)
+
+    def lag_window(self, max_lag: float) -> slice:
+        return lag_window(self.npts, self.sampling_rate, max_lag)
+
+
+def fit_to_npts(row: np.ndarray, npts: int) -> np.ndarray:
+    """Centre-crop or NaN-pad a CCF so zero lag stays in the middle of the row."""
+    if len(row) == npts:
+        return np.ascontiguousarray(row)
+    out = np.full(npts, np.nan, dtype=np.float32)
+    if len(row) > npts:
+        start = (len(row) - npts) // 2
+        out[:] = row[start:start + npts]
+    else:
+        start = (npts - len(row)) // 2
+        out[start:start + len(row)] = row
+    return out
+
+
+def _peak_decimate(block: np.ndarray, step: int) -> np.ndarray:
+    # Keep the largest-magnitude sample of every `step` lags so that
+    # oscillating arrivals survive the reduction instead of averaging out.
+    n_rows, n_lags = block.shape
+    pad = (-n_lags) % step
+    if pad:
+        block = np.concatenate([block, np.zeros((n_rows, pad), dtype=block.dtype)], axis=1)
+    blocks = block.reshape(n_rows, -1, step)
+    pick = np.argmax(np.abs(np.nan_to_num(blocks)), axis=2)[..., None]
+    return np.take_along_axis(blocks, pick, axis=2)[..., 0]
+
+
+def heatmap_matrix(cube: CCFCube, max_lag: float, max_columns: Optional[int] = None,
+                   max_rows: Optional[int] = None, chunk_days: int = 256,
+                   normalization: str = "max", norm_window: Optional[Tuple[float, float]] = None):
+    """Lag x day matrix built chunk by chunk into a preallocated array.
+
+    Days are placed on a regular daily grid (missing days stay NaN), optionally
+    averaged into at most `max_columns` columns, and lags are peak-decimated to
+    at most `max_rows` rows, so memory follows the output size, not the date range.
+    """
+    dates, data = cube.load(sort=False)
+    days = np.array(dates, dtype="datetime64[D]")
+    first = days.min()
+    col = (days - first).astype(np.int64)
+    n_cols_full = int(col.max()) + 1
+
+    window = cube.lag_window(max_lag)
+    lags = cube.lags()[window]
+    mask = lag_mask(len(lags), cube.sampling_rate, *norm_window) if norm_window else None
+    col_step = math.ceil(n_cols_full / max_columns) if max_columns else 1
+    lag_step = math.ceil(len(lags) / max_rows) if max_rows else 1
+    n_cols = math.ceil(n_cols_full / col_step)
+    n_rows = math.ceil(len(lags) / lag_step)
+
+    out = np.zeros((n_cols, n_rows), dtype=np.float32)
+    counts = np.zeros(n_cols, dtype=np.int64)
+    for start in range(0, len(days), chunk_days):
+        block = np.array(data[start:start + chunk_days, window], dtype=np.float32)
+        normalize(block, normalization, mask, out=block)
+        if lag_step > 1:
+            block = _peak_decimate(block, lag_step)
+        target = col[start:start + chunk_days] // col_step
+        np.add.at(out, target, np.nan_to_num(block))
+        np.add.at(counts, target, 1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out /= counts[:, None]
+    out[counts == 0] = np.nan
+    last = first + np.timedelta64((n_cols - 1) * col_step, "D")
+    return (out.T, lags[::lag_step],
+            datetime.fromisoformat(str(first)), datetime.fromisoformat(str(last)))
+
+
+def cube_dir(cache_root: str, cc_base_dir: str, pair_name: str) -> str:
+    # Mirror STACKS/{filter}/{stack}/{component} so cubes never collide.
+    return os.path.join(cache_root, *split_folder(cc_base_dir)[1:], pair_name)
@@ -0,0 +1,87 @@
+import warnings
+from functools import lru_cache
+from typing import Optional, Union
+
+import numpy as np
+
+NORMALIZATIONS = ("none", "max", "rms", "window_max")
+
+
+@lru_cache(maxsize=64)
+def _lag_axis(npts: int, sampling_rate: float) -> np.ndarray:
+    half = (npts - 1) / 2 / sampling_rate
+    axis = np.linspace(-half, half, npts)
+    axis.setflags(write=False)
+    return axis
+
+
+def lag_axis(npts: int, sampling_rate: float) -> np.ndarray:
+    """Read-only lag axis (s) of a CCF with zero lag in the middle, cached per shape."""
+    return _lag_axis(int(npts), float(sampling_rate))
+
+
+@lru_cache(maxsize=256)
+def _lag_window(npts: int, sampling_rate: float, max_lag: float) -> slice:
+    centre = (npts - 1) / 2
+    half = max_lag * sampling_rate
+    lo = int(np.ceil(centre - half - 1e-9))
+    hi = int(np.floor(centre + half + 1e-9)) + 1
+    return slice(max(0, lo), min(npts, hi))
+
+
+def lag_window(npts: int, sampling_rate: float, max_lag: Optional[float]) -> slice:
+    """Index bounds of |lag| <= max_lag, the same samples a lag-axis mask would keep."""
+    if max_lag is None:
+        return slice(0, int(npts))
+    return _lag_window(int(npts), float(sampling_rate), float(max_lag))
+
+
+def crop(data: np.ndarray, sampling_rate: float, max_lag: Optional[float]) -> np.ndarray:
+    """Crop the last axis to |lag| <= max_lag; returns a view, never a copy."""
+    return data[..., lag_window(data.shape[-1], sampling_rate, max_lag)]
+
+
+def lag_mask(npts: int, sampling_rate: float, min_lag: float, max_lag: float) -> np.ndarray:
+    """Boolean mask of min_lag <= |lag| <= max_lag, covering both causal and acausal sides."""
+    abs_lag = np.abs(lag_axis(npts, sampling_rate))
+    return (abs_lag >= min_lag) & (abs_lag <= max_lag)
+
+
+def normalize(block: np.ndarray, method: str = "max",
+              window: Optional[Union[slice, np.ndarray]] = None,
+              out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Normalize every row of a 1-D/2-D block of CCFs in one pass.
+
+    `max` and `rms` use the whole row, `window_max` the peak inside `window`
+    (a slice or a `lag_mask`, e.g. a coda window). Rows whose reference
+    amplitude is zero or NaN are left as zeros instead of turning into NaN/inf.
+    """
+    if method not in NORMALIZATIONS:
+        raise ValueError(f"Unknown normalization '{method}', expected one of {NORMALIZATIONS}")
+    block = np.asarray(block)
+    if out is None:
+        out = np.array(block, dtype=np.float32 if block.dtype != np.float64 else np.float64)
+    elif out is not block:
+        out[...] = block
+    if method == "none":
+        return out
+
+    if not out.size:
+        return out
+    if method == "window_max" and window is None:
+        raise ValueError("window_max normalization needs a lag window")
+
+    with warnings.catch_warnings():
+        # All-NaN rows (padded or missing days) are handled below.
+        warnings.simplefilter("ignore", RuntimeWarning)
+        if method == "max":
+            ref = np.nanmax(np.abs(out), axis=-1, keepdims=True)
+        elif method == "rms":
+            ref = np.sqrt(np.nanmean(np.square(out), axis=-1, keepdims=True))
+        else:
+            ref = np.nanmax(np.abs(out[..., window]), axis=-1, keepdims=True)
+
+    valid = np.isfinite(ref) & (ref > 0)
+    np.divide(out, ref, out=out, where=valid)
+    out[np.broadcast_to(~valid, out.shape)] = 0
+    return out
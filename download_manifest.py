@@ -0,0 +1,106 @@
+import glob
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Iterable, Set, Tuple
+
+FETCHED = "fetched"
+EMPTY = "empty"
+FAILED_RETRYABLE = "failed_retryable"
+FAILED_PERMANENT = "failed_permanent"
+
+# States that a rerun never needs to ask the server about again. FETCHED and
+# EMPTY are only final once recorded `settle_days` after the day ended: data
+# centres publish recent data with a delay, so a fresh day may come back
+# empty or partial.
+FINAL_STATES = (FETCHED, EMPTY, FAILED_PERMANENT)
+SETTLING_STATES = (FETCHED, EMPTY)
+DEFAULT_SETTLE_DAYS = 3
+
+
+class DownloadManifest:
+    """SQLite record of every station-day step 1 has attempted."""
+
+    def __init__(self, path: str, commit_every: int = 200):
+        self.path = path
+        self.commit_every = commit_every
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS download_manifest (
+                net TEXT NOT NULL,
+                sta TEXT NOT NULL,
+                day TEXT NOT NULL,
+                status TEXT NOT NULL,
+                bytes INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                message TEXT,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (net, sta, day)
+            )
+        """)
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS download_manifest_day ON download_manifest (day, status)")
+        self.conn.commit()
+
+    def is_empty(self) -> bool:
+        return self.conn.execute("SELECT 1 FROM download_manifest LIMIT 1").fetchone() is None
+
+    def seed_from_files(self, source_folder: str) -> int:
+        # One-off import of day files downloaded before the manifest existed.
+        rows = []
+        now = datetime.now().isoformat(timespec="seconds")
+        for path in glob.glob(os.path.join(source_folder, "*", "*.mseed")):
+            parts = os.path.basename(path)[:-len(".mseed")].split(".")
+            if len(parts) != 3:
+                continue
+            net, sta, day = parts
+            rows.append((net, sta, day, FETCHED, os.path.getsize(path), 1, None, now))
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO download_manifest VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.conn.commit()
+        return len(rows)
+
+    def completed(self, start_day: str, end_day: str,
+                  settle_days: int = DEFAULT_SETTLE_DAYS) -> Set[Tuple[str, str, str]]:
+        """Station-days that need no new request: permanent failures, and days
+        fetched or found empty at least `settle_days` after they ended."""
+        settling = ",".join("?" * len(SETTLING_STATES))
+        cur = self.conn.execute(
+            f"SELECT net, sta, day FROM download_manifest "
+            f"WHERE day BETWEEN ? AND ? AND (status = ? OR (status IN ({settling}) "
+            f"AND updated_at >= date(day, ?)))",
+            (start_day, end_day, FAILED_PERMANENT) + SETTLING_STATES
+            + (f"+{1 + max(0, int(settle_days))} days",))
+        return set(cur.fetchall())
+
+    def record(self, net: str, sta: str, day: str, status: str,
+               nbytes: int = 0, message: str = None) -> None:
+        now = datetime.now().isoformat(timespec="seconds")
+        with self._lock:
+            self.conn.execute("""
+                INSERT INTO download_manifest (net, sta, day, status, bytes, attempts, message, updated_at)
+                VALUES (?, ?, ?, ?, ?, 1, ?, ?)
+                ON CONFLICT (net, sta, day) DO UPDATE SET
+                    status = excluded.status,
+                    bytes = excluded.bytes,
+                    attempts = attempts + 1,
+                    message = excluded.message,
+                    updated_at = excluded.updated_at
+            """, (net, sta, day, status, nbytes, message, now))
+            self._pending += 1
+            if self._pending >= self.commit_every:
+                self.conn.commit()
+                self._pending = 0
+
+    def counts(self) -> Iterable[Tuple[str, int]]:
+        return self.conn.execute(
+            "SELECT status, COUNT(*) FROM download_manifest GROUP BY status").fetchall()
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.commit()
+            self.conn.close()
@@ -0,0 +1,195 @@
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from catalog import Catalog
+    from loader_cache import LoaderCache
+
+# pandas/numpy are imported where they are used, so listing pairs or
+# finding changed files does not pull them in.
+# Only what the plots use: M for the heatmap, M0/EM0 for the dv/v series.
+VALUE_COLUMNS = ["M", "M0", "EM0"]
+READ_COLUMNS = {"Date", "Pairs", *VALUE_COLUMNS}
+
+
+def read_dtt_file(path: str, filter_id: str, stack: str, component: str) -> List[tuple]:
+    import pandas as pd
+
+    # Only the columns the store keeps are parsed; dtype hints skip inference.
+    df = pd.read_csv(path, usecols=lambda c: c in READ_COLUMNS,
+                     dtype={c: "float64" for c in VALUE_COLUMNS}, engine="c")
+    for col in VALUE_COLUMNS:
+        if col not in df.columns:
+            df[col] = None
+    df["Date"] = pd.to_datetime(df["Date"]).dt.strftime("%Y-%m-%d")
+    return [(filter_id, stack, component, r[0], r[1]) + tuple(r[2:]) for r in
+            df[["Pairs", "Date"] + VALUE_COLUMNS].itertuples(index=False, name=None)]
+
+
+def _safe_read(job: tuple) -> Tuple[tuple, Optional[List[tuple]], Optional[str]]:
+    try:
+        return job, read_dtt_file(*job[:4]), None
+    except Exception as e:
+        return job, None, str(e)
+
+
+def _list_txt(directory: str) -> List[os.DirEntry]:
+    try:
+        return [e for e in os.scandir(directory) if e.name.endswith(".txt")]
+    except OSError:
+        return []
+
+
+def _scandir_dirs(directory: str) -> List[os.DirEntry]:
+    try:
+        return sorted((e for e in os.scandir(directory) if e.is_dir()), key=lambda e: e.name)
+    except OSError:
+        return []
+
+
+class DTTStore:
+    """Every MSNoise DTT row in one SQLite table keyed by (filter, stack, component, pair, date)."""
+
+    def __init__(self, path: str, workers: int = 1, cache: Optional["LoaderCache"] = None):
+        self.path = path
+        self.workers = max(1, int(workers))
+        self.cache = cache
+        self.conn = sqlite3.connect(path)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(dtt)")]
+        if columns and columns[5:] != VALUE_COLUMNS:
+            # Written with another set of value columns: the store is only a
+            # cache of the DTT tree, so it is dropped and ingested again.
+            self.conn.executescript("DROP TABLE dtt; DROP TABLE IF EXISTS dtt_files;")
+        self.conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS dtt (
+                filter TEXT NOT NULL,
+                stack TEXT NOT NULL,
+                component TEXT NOT NULL,
+                pair TEXT NOT NULL,
+                date TEXT NOT NULL,
+                {", ".join(f"{c} REAL" for c in VALUE_COLUMNS)},
+                PRIMARY KEY (filter, stack, component, pair, date)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS dtt_pair ON dtt (pair, stack, component, filter, date);
+            CREATE TABLE IF NOT EXISTS dtt_files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL
+            );
+        """)
+        self.conn.commit()
+
+    def _changed_files(self, dtt_root: str, catalog: Optional["Catalog"] = None) -> List[tuple]:
+        known = {p: (size, mtime) for p, size, mtime in
+                 self.conn.execute("SELECT path, size, mtime_ns FROM dtt_files")}
+        if catalog is not None:
+            catalog.ensure(dtt_root, "dtt")
+            return [(path, filter_id, stack, component, size, mtime)
+                    for path, filter_id, stack, component, _, _, size, mtime in catalog.files(dtt_root)
+                    if known.get(path) != (size, mtime)]
+
+        leaf_dirs = []
+        for filter_entry in _scandir_dirs(dtt_root):
+            for stack_entry in _scandir_dirs(filter_entry.path):
+                for comp_entry in _scandir_dirs(stack_entry.path):
+                    leaf_dirs.append((comp_entry.path, filter_entry.name,
+                                      stack_entry.name, comp_entry.name))
+
+        # Listing directories is latency-bound on network filesystems, so the
+        # filter/stack/component folders are scanned concurrently.
+        with ThreadPoolExecutor(max_workers=max(self.workers, 4)) as executor:
+            listings = executor.map(_list_txt, [d[0] for d in leaf_dirs])
+            changed = []
+            for (_, filter_id, stack, component), entries in zip(leaf_dirs, listings):
+                for entry in entries:
+                    st = entry.stat()
+                    path = os.path.abspath(entry.path)
+                    if known.get(path) != (st.st_size, st.st_mtime_ns):
+                        changed.append((path, filter_id, stack, component, st.st_size, st.st_mtime_ns))
+        return changed
+
+    def ingest(self, dtt_root: str, catalog: Optional["Catalog"] = None) -> int:
+        """Parse new or changed DTT files; with a catalog, they are found in its index instead of by listing."""
+        jobs = self._changed_files(dtt_root, catalog)
+        if self.workers > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(_safe_read, jobs,
+                                            chunksize=max(1, len(jobs) // (self.workers * 8))))
+        else:
+            results = [_safe_read(job) for job in jobs]
+
+        rows, stamps = [], []
+        for job, file_rows, error in results:
+            if error is not None:
+                print(f"Error {job[0]}: {error}")
+                continue
+            rows.extend(file_rows)
+            stamps.append((job[0], job[4], job[5]))
+
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO dtt VALUES (?, ?, ?, ?, ?{', ?' * len(VALUE_COLUMNS)})",
+                rows)
+            self.conn.executemany("INSERT OR REPLACE INTO dtt_files VALUES (?, ?, ?)", stamps)
+        return len(stamps)
+
+    def version(self) -> Tuple:
+        """Changes whenever `ingest` stores a new or changed file; the cache key of every query."""
+        return tuple(self.conn.execute(
+            "SELECT COUNT(*), TOTAL(size), MAX(mtime_ns) FROM dtt_files").fetchone())
+
+    def cached(self, name: str, load, *args):
+        """load() memoized in the loader cache until the store changes; results must not be modified in place."""
+        if self.cache is None:
+            return load()
+        return self.cache.get(self.path, lambda _: load(), name, *args, stamp=self.version())
+
+    def query(self, pair: str, stack: str, component: str,
+              filter_id: Optional[str] = None) -> "pd.DataFrame":
+        return self.cached("query", lambda: self._query(pair, stack, component, filter_id),
+                           pair, stack, component, filter_id)
+
+    def _query(self, pair: str, stack: str, component: str,
+               filter_id: Optional[str] = None) -> "pd.DataFrame":
+        import pandas as pd
+
+        sql = (f"SELECT filter, date, {', '.join(VALUE_COLUMNS)} FROM dtt "
+               "WHERE pair = ? AND stack = ? AND component = ?")
+        params = [pair, stack, component]
+        if filter_id is not None:
+            sql += " AND filter = ?"
+            params.append(filter_id)
+        df = pd.read_sql_query(sql + " ORDER BY filter, date", self.conn, params=params)
+        df["date"] = pd.to_datetime(df["date"])
+        return df
+
+    def pairs(self, stack: str) -> List[Tuple[str, str]]:
+        return self.conn.execute(
+            "SELECT DISTINCT pair, component FROM dtt WHERE stack = ? ORDER BY pair, component",
+            (stack,)).fetchall()
+
+    def pivot(self, pair: str, stack: str, component: str, value: str = "M") -> "pd.DataFrame":
+        """filter x date matrix of one value column, assembled straight from the query."""
+        return self.cached("pivot", lambda: self._pivot(pair, stack, component, value),
+                           pair, stack, component, value)
+
+    def _pivot(self, pair: str, stack: str, component: str, value: str) -> "pd.DataFrame":
+        import numpy as np
+        import pandas as pd
+
+        if value not in VALUE_COLUMNS:
+            raise ValueError(f"Unknown DTT column: {value}")
+        df = pd.read_sql_query(
+            f"SELECT filter, date, {value} FROM dtt WHERE pair = ? AND stack = ? AND component = ?",
+            self.conn, params=[pair, stack, component])
+        filters, f_idx = np.unique(df["filter"].to_numpy(), return_inverse=True)
+        dates, d_idx = np.unique(df["date"].to_numpy(), return_inverse=True)
+        matrix = np.full((len(filters), len(dates)), np.nan)
+        matrix[f_idx, d_idx] = df[value].to_numpy(dtype=float)
+        return pd.DataFrame(matrix, index=filters, columns=pd.to_datetime(dates))
+
+    def close(self) -> None:
+        self.conn.close()
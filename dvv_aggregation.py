@@ -0,0 +1,161 @@
+import csv
+import os
+import sqlite3
+import warnings
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+import msnoise_db
+from dtt_store import DTTStore
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def load_pair_matrix(store: DTTStore, stack: str, component: str, filter_id: str,
+                     value: str = "M0", error: str = "EM0"):
+    """(dates, pairs, values, errors) with values/errors shaped (days, pairs); 'ALL' is excluded."""
+    return store.cached("pair_matrix", lambda: _read_pair_matrix(store, stack, component, filter_id, value, error),
+                        stack, component, filter_id, value, error)
+
+
+def _read_pair_matrix(store: DTTStore, stack: str, component: str, filter_id: str,
+                      value: str, error: str):
+    df = pd.read_sql_query(
+        f"SELECT date, pair, {value} AS v, {error} AS e FROM dtt "
+        "WHERE stack = ? AND component = ? AND filter = ? AND pair != 'ALL'",
+        store.conn, params=[stack, component, filter_id])
+    dates, d_idx = np.unique(df["date"].to_numpy(), return_inverse=True)
+    pairs, p_idx = np.unique(df["pair"].to_numpy(), return_inverse=True)
+    values = np.full((len(dates), len(pairs)), np.nan)
+    errors = np.full((len(dates), len(pairs)), np.nan)
+    values[d_idx, p_idx] = df["v"].to_numpy(dtype=float)
+    errors[d_idx, p_idx] = df["e"].to_numpy(dtype=float)
+    return pd.to_datetime(dates), list(pairs), values, errors
+
+
+def station_coordinates(metadata_csv: str = "downloaded_stations_metadata.csv",
+                        db_path: Optional[str] = None) -> Dict[str, Tuple[float, float]]:
+    """NET_STA -> (lon, lat), from the MSNoise stations table when available, else the CSV."""
+    coords = {}
+    if db_path and os.path.exists(db_path):
+        try:
+            conn = msnoise_db.connect(db_path, readonly=True)
+            for net, sta, x, y in conn.execute("SELECT net, sta, X, Y FROM stations"):
+                coords[f"{net}_{sta}"] = (float(x), float(y))
+        except sqlite3.Error:
+            coords = {}
+    if not coords and os.path.exists(metadata_csv):
+        with open(metadata_csv, "r", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                coords[f"{row['Network']}_{row['Station']}"] = (
+                    float(row["Longitude"]), float(row["Latitude"]))
+    return coords
+
+
+def split_pair(pair: str, coords: Dict[str, Tuple[float, float]]) -> Optional[Tuple[str, str]]:
+    # Pair folders are NET_STA_NET_STA; try every split so codes with '_' still resolve.
+    parts = pair.split("_")
+    for i in range(1, len(parts)):
+        left, right = "_".join(parts[:i]), "_".join(parts[i:])
+        if left in coords and right in coords:
+            return left, right
+    if len(parts) == 4:
+        return "_".join(parts[:2]), "_".join(parts[2:])
+    return None
+
+
+def pair_distances(pairs: Sequence[str], coords: Dict[str, Tuple[float, float]]) -> np.ndarray:
+    """Great-circle inter-station distance (km) per pair; NaN when a station is unknown."""
+    lon1, lat1, lon2, lat2 = (np.full(len(pairs), np.nan) for _ in range(4))
+    for i, pair in enumerate(pairs):
+        stations = split_pair(pair, coords)
+        if stations and stations[0] in coords and stations[1] in coords:
+            (lon1[i], lat1[i]), (lon2[i], lat2[i]) = coords[stations[0]], coords[stations[1]]
+    lon1, lat1, lon2, lat2 = map(np.radians, (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def weighted_mean(values: np.ndarray, errors: np.ndarray,
+                  columns: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Inverse-variance mean over pairs for every day, with its formal error."""
+    if columns is not None:
+        values, errors = values[:, columns], errors[:, columns]
+    weights = np.where(np.isfinite(values) & np.isfinite(errors) & (errors > 0),
+                       1.0 / np.square(errors), 0.0)
+    wsum = weights.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.nansum(np.where(weights > 0, values, 0.0) * weights, axis=1) / wsum
+        err = 1.0 / np.sqrt(wsum)
+    mean[wsum == 0] = np.nan
+    err[wsum == 0] = np.nan
+    return mean, err
+
+
+def robust_stats(values: np.ndarray) -> Dict[str, np.ndarray]:
+    """Median, scaled MAD, and pair count per day."""
+    with warnings.catch_warnings():
+        # Days without any pair give all-NaN rows and stay NaN.
+        warnings.simplefilter("ignore", RuntimeWarning)
+        median = np.nanmedian(values, axis=1)
+        mad = 1.4826 * np.nanmedian(np.abs(values - median[:, None]), axis=1)
+    return {"median": median, "mad": mad, "count": np.isfinite(values).sum(axis=1)}
+
+
+def distance_binned(values: np.ndarray, errors: np.ndarray, distances: np.ndarray,
+                    bins: Sequence[float]) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    out = {}
+    which = np.digitize(distances, bins)
+    for k in range(1, len(bins)):
+        cols = np.nonzero(which == k)[0]
+        if len(cols):
+            out[f"{bins[k - 1]:g}-{bins[k]:g} km"] = weighted_mean(values, errors, cols)
+    return out
+
+
+def group_columns(pairs: Sequence[str], coords: Dict[str, Tuple[float, float]],
+                  groups: Dict[str, List[str]]) -> Dict[str, np.ndarray]:
+    """Columns of pairs whose two stations both belong to each named sub-array."""
+    out = {}
+    split = [split_pair(p, coords) for p in pairs]
+    for name, members in groups.items():
+        members = {m.replace("-", "_") for m in members}
+        cols = [i for i, s in enumerate(split) if s and s[0] in members and s[1] in members]
+        if cols:
+            out[name] = np.array(cols)
+    return out
+
+
+def aggregate(store: DTTStore, stack: str, component: str, filter_id: str, mode: str,
+              metadata_csv: str = "downloaded_stations_metadata.csv", db_path: Optional[str] = None,
+              distance_bins: Sequence[float] = (0, 25, 50, 100, 200),
+              groups: Optional[Dict[str, List[str]]] = None) -> pd.DataFrame:
+    """Long table (day, label, m0, error) of the requested network aggregate."""
+    dates, pairs, values, errors = load_pair_matrix(store, stack, component, filter_id)
+    if not pairs:
+        return pd.DataFrame(columns=["day", "label", "m0", "error"])
+
+    series = {}
+    if mode == "weighted":
+        series["weighted mean"] = weighted_mean(values, errors)
+    elif mode == "median":
+        stats = robust_stats(values)
+        # Standard error of the median for roughly Gaussian scatter.
+        series["median"] = (stats["median"],
+                            1.2533 * stats["mad"] / np.sqrt(np.maximum(stats["count"], 1)))
+    elif mode in ("distance", "groups"):
+        coords = station_coordinates(metadata_csv, db_path)
+        if mode == "distance":
+            series = distance_binned(values, errors, pair_distances(pairs, coords), distance_bins)
+        else:
+            series = {name: weighted_mean(values, errors, cols)
+                      for name, cols in group_columns(pairs, coords, groups or {}).items()}
+    else:
+        raise ValueError(f"Unknown dv/v aggregation mode: {mode}")
+
+    frames = [pd.DataFrame({"day": dates, "label": label, "m0": mean, "error": err})
+              for label, (mean, err) in series.items()]
+    return pd.concat(frames, ignore_index=True).dropna(subset=["m0"]) if frames else \
+        pd.DataFrame(columns=["day", "label", "m0", "error"])
@@ -0,0 +1,120 @@
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ccf_cache import CCFCube
+from ccf_processing import lag_mask
+
+
+def daily_grid(cube: CCFCube, max_lag: Optional[float] = None) -> Tuple[pd.DatetimeIndex, np.ndarray]:
+    """Cube rows cropped to |lag| <= max_lag on a regular daily grid; missing days are NaN."""
+    dates, data = cube.load(sort=False)
+    days = np.array(dates, dtype="datetime64[D]")
+    first = days.min()
+    n_days = int((days.max() - first).astype(np.int64)) + 1
+    window = cube.lag_window(max_lag) if max_lag else slice(0, cube.npts)
+
+    grid = np.full((n_days, window.stop - window.start), np.nan, dtype=np.float32)
+    grid[(days - first).astype(np.int64)] = data[:, window]
+    return pd.date_range(str(first), periods=n_days, freq="D"), grid
+
+
+def reference_stack(grid: np.ndarray, dates: pd.DatetimeIndex,
+                    ref_start: Optional[str] = None, ref_end: Optional[str] = None) -> np.ndarray:
+    in_ref = np.ones(len(dates), dtype=bool)
+    if ref_start:
+        in_ref &= dates >= pd.Timestamp(ref_start)
+    if ref_end:
+        in_ref &= dates <= pd.Timestamp(ref_end)
+    rows = grid[in_ref]
+    rows = rows[~np.isnan(rows).all(axis=1)]
+    if not len(rows):
+        raise ValueError("No CCF days inside the reference window")
+    # Lags padded with NaN in every reference day would poison the interpolation.
+    return np.nan_to_num(np.nanmean(rows, axis=0))
+
+
+def moving_stack(grid: np.ndarray, length: int) -> np.ndarray:
+    """Trailing mean over `length` days, computed for every day at once from cumulative sums."""
+    if length <= 1:
+        return grid
+    valid = ~np.isnan(grid)
+    csum = np.zeros((grid.shape[0] + 1, grid.shape[1]), dtype=np.float64)
+    np.cumsum(np.where(valid, grid, 0.0), axis=0, out=csum[1:])
+    ccount = np.zeros_like(csum)
+    np.cumsum(valid, axis=0, out=ccount[1:])
+
+    idx = np.arange(1, grid.shape[0] + 1)
+    lo = np.maximum(idx - length, 0)
+    sums = csum[idx] - csum[lo]
+    counts = ccount[idx] - ccount[lo]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (sums / counts).astype(np.float32)
+
+
+def _unit_rows(block: np.ndarray) -> np.ndarray:
+    block = block - block.mean(axis=-1, keepdims=True)
+    norm = np.linalg.norm(block, axis=-1, keepdims=True)
+    return np.divide(block, norm, out=np.zeros_like(block), where=norm > 0)
+
+
+def stretching(grid: np.ndarray, reference: np.ndarray, lags: np.ndarray,
+               eps_grid: Sequence[float], mask: Optional[np.ndarray] = None,
+               chunk_days: int = 1024) -> Tuple[np.ndarray, np.ndarray]:
+    """dv/v and correlation of every day against stretched copies of the reference.
+
+    The reference is resampled once per trial epsilon as ref(t * (1 + eps));
+    the best eps for a day is its dv/v (with faster velocities arrivals come
+    earlier, i.e. the day matches a time-compressed reference). All days are correlated
+    with all trials in one matrix product per chunk, and the peak is refined
+    with a parabola through its neighbours.
+    """
+    eps_grid = np.asarray(eps_grid, dtype=np.float64)
+    mask = np.ones(len(lags), dtype=bool) if mask is None else mask
+    stretched = np.stack([np.interp(lags * (1 + e), lags, reference) for e in eps_grid])
+    ref_unit = _unit_rows(stretched[:, mask]).astype(np.float32)
+
+    dvv = np.full(grid.shape[0], np.nan)
+    coeff = np.full(grid.shape[0], np.nan)
+    step = eps_grid[1] - eps_grid[0] if len(eps_grid) > 1 else 0.0
+    for start in range(0, grid.shape[0], chunk_days):
+        block = grid[start:start + chunk_days][:, mask]
+        ok = ~np.isnan(block).any(axis=1)
+        if not ok.any():
+            continue
+        cc = _unit_rows(block[ok].astype(np.float32)) @ ref_unit.T
+        best = np.argmax(cc, axis=1)
+        peak = cc[np.arange(len(best)), best]
+
+        shift = np.zeros(len(best))
+        inner = (best > 0) & (best < len(eps_grid) - 1)
+        if inner.any():
+            b = best[inner]
+            rows = np.nonzero(inner)[0]
+            y0, y1, y2 = cc[rows, b - 1], cc[rows, b], cc[rows, b + 1]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                vertex = 0.5 * (y0 - y2) / (y0 - 2 * y1 + y2)
+            shift[inner] = np.where(np.isfinite(vertex), vertex, 0.0)
+
+        idx = np.arange(start, min(start + chunk_days, grid.shape[0]))[ok]
+        dvv[idx] = eps_grid[best] + shift * step
+        coeff[idx] = peak
+    return dvv, coeff
+
+
+def stretching_dvv(cube: CCFCube, cfg: Optional[dict] = None) -> pd.DataFrame:
+    cfg = cfg or {}
+    max_lag = cfg.get("max_lag", 60.0)
+    dates, grid = daily_grid(cube, max_lag)
+    lags = cube.lags()[cube.lag_window(max_lag)]
+
+    reference = reference_stack(grid, dates, cfg.get("ref_start"), cfg.get("ref_end"))
+    stacked = moving_stack(grid, int(cfg.get("stack_days", 1)))
+    coda = cfg.get("coda_window")
+    mask = lag_mask(len(lags), cube.sampling_rate, *coda) if coda else None
+
+    max_dvv = float(cfg.get("max_dvv", 0.01))
+    eps_grid = np.linspace(-max_dvv, max_dvv, int(cfg.get("n_eps", 201)))
+    dvv, coeff = stretching(stacked, reference, lags, eps_grid, mask)
+    return pd.DataFrame({"date": dates, "dvv": dvv * 100, "cc": coeff}).dropna()
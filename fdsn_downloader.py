@@ -0,0 +1,313 @@
+import os
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from obspy import Stream
+from obspy.clients.fdsn import Client
+from obspy.clients.fdsn.header import (FDSNBadRequestException,
+                                       FDSNForbiddenException,
+                                       FDSNNoDataException,
+                                       FDSNUnauthorizedException)
+
+import download_manifest
+
+# Errors that will not go away by asking again (malformed or refused requests).
+PERMANENT_ERRORS = (FDSNBadRequestException, FDSNUnauthorizedException,
+                    FDSNForbiddenException)
+
+
+class ClientPool:
+    """Long-lived FDSN clients for one data centre, capped at `size` in flight."""
+
+    def __init__(self, name: str, size: int = 4, timeout: float = 60,
+                 client_factory: Callable[..., Any] = Client):
+        self.name = name
+        self.size = max(1, int(size))
+        self.timeout = timeout
+        self._factory = client_factory
+        self._idle: "queue.Queue[Any]" = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _new_client(self) -> Any:
+        # Data centre names ("GFZ") and plain URLs ("http://127.0.0.1:8080")
+        # are both accepted by obspy, which lets us point at a local server.
+        return self._factory(self.name, timeout=self.timeout)
+
+    @contextmanager
+    def acquire(self) -> Iterator[Any]:
+        client = None
+        try:
+            client = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    client = self._new_client()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                client = self._idle.get()
+        try:
+            yield client
+        finally:
+            self._idle.put(client)
+
+
+class DownloadStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.requests = 0
+        self.bytes = 0
+        self.downloaded = 0
+        self.empty = 0
+        self.failed = 0
+        self.retries = 0
+
+    def start(self) -> None:
+        # Rates cover the waveform requests only, not the station queries before them.
+        self.started = time.monotonic()
+
+    def add(self, **counts: int) -> None:
+        with self._lock:
+            for key, value in counts.items():
+                setattr(self, key, getattr(self, key) + value)
+
+    def summary(self) -> Dict[str, float]:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return {
+            "elapsed_s": elapsed,
+            "requests": self.requests,
+            "bytes": self.bytes,
+            "downloaded": self.downloaded,
+            "empty": self.empty,
+            "failed": self.failed,
+            "retries": self.retries,
+            "requests_per_s": self.requests / elapsed,
+            "mb_per_s": self.bytes / elapsed / 1e6,
+        }
+
+    def report(self) -> str:
+        s = self.summary()
+        return (f"{s['requests']} requests in {s['elapsed_s']:.1f}s "
+                f"({s['requests_per_s']:.2f} req/s, {s['mb_per_s']:.2f} MB/s) | "
+                f"downloaded: {s['downloaded']}, empty: {s['empty']}, "
+                f"failed: {s['failed']}, retries: {s['retries']}")
+
+
+class AdaptiveBatchSize:
+    """Station-days per bulk request: halves on rejection, grows back on success."""
+
+    def __init__(self, start: int, maximum: int):
+        self.maximum = max(1, int(maximum))
+        self.value = max(1, min(int(start), self.maximum))
+        self._lock = threading.Lock()
+
+    def shrink(self, failed_size: int) -> int:
+        with self._lock:
+            self.value = max(1, min(self.value, failed_size // 2))
+            return self.value
+
+    def grow(self) -> int:
+        with self._lock:
+            self.value = min(self.maximum, self.value * 2)
+            return self.value
+
+
+def _bulk_lines(tasks: List[Dict[str, Any]], channels: str) -> List[tuple]:
+    # Consecutive days of one station collapse into a single multi-day window.
+    by_station = defaultdict(list)
+    for task in tasks:
+        by_station[(task["net"], task["sta"])].append(task)
+
+    lines = []
+    for (net, sta), days in by_station.items():
+        days.sort(key=lambda t: t["t1"])
+        t1, t2 = days[0]["t1"], days[0]["t2"]
+        for task in days[1:]:
+            if task["t1"] <= t2:
+                t2 = max(t2, task["t2"])
+            else:
+                lines.extend((net, sta, "*", cha, t1, t2) for cha in channels.split(","))
+                t1, t2 = task["t1"], task["t2"]
+        lines.extend((net, sta, "*", cha, t1, t2) for cha in channels.split(","))
+    return lines
+
+
+def _day_window(st: Any, task: Dict[str, Any]) -> Any:
+    # Servers return the records overlapping [t1, t2], which usually spill a
+    # few samples past midnight; every fetch path keeps the same [t1, t2) day.
+    return st.slice(task["t1"], task["t2"] - 0.000001, nearest_sample=False)
+
+
+class WaveformDownloader:
+    def __init__(self, download_cfg: Optional[Dict[str, Any]] = None,
+                 client_factory: Callable[..., Any] = Client,
+                 manifest: Optional[download_manifest.DownloadManifest] = None):
+        download_cfg = download_cfg or {}
+        self.manifest = manifest
+        self.max_workers = int(download_cfg.get("max_workers", 8))
+        self.per_client = int(download_cfg.get("per_client_concurrency", 4))
+        self.max_retries = int(download_cfg.get("max_retries", 3))
+        self.backoff = float(download_cfg.get("retry_backoff", 2.0))
+        self.timeout = float(download_cfg.get("timeout", 60))
+        self.bulk_size = int(download_cfg.get("bulk_size", 50))
+        self.max_bulk_size = int(download_cfg.get("max_bulk_size", 400))
+        self._batch_sizes: Dict[str, AdaptiveBatchSize] = {}
+        self._factory = client_factory
+        self._pools: Dict[str, ClientPool] = {}
+        self._pools_lock = threading.Lock()
+        self.stats = DownloadStats()
+
+    def pool(self, client_name: str) -> ClientPool:
+        with self._pools_lock:
+            if client_name not in self._pools:
+                self._pools[client_name] = ClientPool(
+                    client_name, self.per_client, self.timeout, self._factory)
+            return self._pools[client_name]
+
+    def _with_retry(self, client_name: str, call: Callable[[Any], Any]) -> Any:
+        attempt = 0
+        while True:
+            try:
+                with self.pool(client_name).acquire() as client:
+                    self.stats.add(requests=1)
+                    return call(client)
+            except (FDSNNoDataException,) + PERMANENT_ERRORS:
+                raise
+            except Exception:
+                if attempt >= self.max_retries:
+                    raise
+                self.stats.add(retries=1)
+                time.sleep(self.backoff ** attempt)
+                attempt += 1
+
+    def _record(self, task: Dict[str, Any], status: str, nbytes: int = 0,
+                message: Optional[str] = None) -> None:
+        if self.manifest is not None:
+            self.manifest.record(task["net"], task["sta"], task["t1"].strftime("%Y-%m-%d"),
+                                 status, nbytes, message)
+
+    def _write_day(self, task: Dict[str, Any], st: Any) -> None:
+        date_str = task["t1"].strftime("%Y-%m-%d")
+        label = f"{task['net']}.{task['sta']} {date_str}"
+        if len(st) > 0:
+            st.write(task["filename"], format="MSEED")
+            nbytes = os.path.getsize(task["filename"])
+            self.stats.add(downloaded=1, bytes=nbytes)
+            self._record(task, download_manifest.FETCHED, nbytes)
+            comps = sorted(set(tr.stats.channel for tr in st))
+            print(f"  - {label}: Downloaded {len(st)} traces. Chans: {comps}")
+        else:
+            self.stats.add(empty=1)
+            self._record(task, download_manifest.EMPTY)
+            print(f"  - {label}: No data found on server.")
+
+    def _fail(self, task: Dict[str, Any], exc: Exception) -> None:
+        date_str = task["t1"].strftime("%Y-%m-%d")
+        msg = str(exc).splitlines()[0] if str(exc) else type(exc).__name__
+        status = (download_manifest.FAILED_PERMANENT if isinstance(exc, PERMANENT_ERRORS)
+                  else download_manifest.FAILED_RETRYABLE)
+        self.stats.add(failed=1)
+        self._record(task, status, message=msg)
+        print(f"  - {task['net']}.{task['sta']} {date_str}: Failed ({msg})")
+
+    def _fetch_day(self, task: Dict[str, Any], channels: str) -> None:
+        try:
+            st = self._with_retry(task["client"], lambda c: c.get_waveforms(
+                task["net"], task["sta"], "*", channels, task["t1"], task["t2"]))
+        except FDSNNoDataException:
+            st = Stream()
+        except Exception as e:
+            self._fail(task, e)
+            return
+        self._write_day(task, _day_window(st, task))
+
+    def _fetch_batch(self, tasks: List[Dict[str, Any]], channels: str) -> None:
+        if len(tasks) == 1:
+            self._fetch_day(tasks[0], channels)
+            return
+
+        client_name = tasks[0]["client"]
+        sizer = self._batch_sizes[client_name]
+        lines = _bulk_lines(tasks, channels)
+        try:
+            with self.pool(client_name).acquire() as client:
+                self.stats.add(requests=1)
+                st = client.get_waveforms_bulk(lines)
+        except FDSNNoDataException:
+            for task in tasks:
+                self._write_day(task, Stream())
+            return
+        except Exception:
+            # Rejected or timed out: shrink the batch for this data centre and
+            # bisect, so the request eventually fits whatever the server allows.
+            size = sizer.shrink(len(tasks))
+            self.stats.add(retries=1)
+            for i in range(0, len(tasks), size):
+                self._fetch_batch(tasks[i:i + size], channels)
+            return
+
+        sizer.grow()
+        missing = []
+        for task in tasks:
+            day = _day_window(st.select(network=task["net"], station=task["sta"]), task)
+            if len(day) > 0:
+                self._write_day(task, day)
+            else:
+                missing.append(task)
+
+        # Servers may silently truncate large responses, so an absent day in a
+        # multi-day answer is only trusted once it has been asked for alone.
+        if missing and len(missing) < len(tasks):
+            half = max(1, len(missing) // 2)
+            for i in range(0, len(missing), half):
+                self._fetch_batch(missing[i:i + half], channels)
+        else:
+            for task in missing:
+                self._write_day(task, Stream())
+
+    def download(self, tasks: List[Dict[str, Any]], channels: str) -> DownloadStats:
+        self.stats.start()
+        queues: Dict[str, deque] = {}
+        for task in tasks:
+            queues.setdefault(task["client"], deque()).append(task)
+        for client_name, client_tasks in queues.items():
+            # Keep each station's days adjacent so batches become few,
+            # long multi-day windows rather than many scattered lines.
+            queues[client_name] = deque(sorted(client_tasks, key=lambda t: (t["net"], t["sta"], t["t1"])))
+            self._batch_sizes[client_name] = (AdaptiveBatchSize(self.bulk_size, self.max_bulk_size)
+                                              if self.bulk_size > 1 else AdaptiveBatchSize(1, 1))
+
+        def next_batch() -> List[Dict[str, Any]]:
+            # Data centres take turns. Each batch is cut when it is submitted,
+            # at the size its data centre has accepted so far, so growth after
+            # successful requests applies to the days still queued.
+            client_name = next(iter(queues))
+            queue_ = queues.pop(client_name)
+            size = self._batch_sizes[client_name].value
+            batch = [queue_.popleft() for _ in range(min(size, len(queue_)))]
+            if queue_:
+                queues[client_name] = queue_
+            return batch
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running = set()
+            while queues or running:
+                while queues and len(running) < self.max_workers:
+                    running.add(executor.submit(self._fetch_batch, next_batch(), channels))
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+        return self.stats
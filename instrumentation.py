@@ -0,0 +1,235 @@
+import atexit
+import functools
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+COUNTERS = ("bytes_downloaded", "files_read", "files_written", "files_skipped",
+            "files_failed", "samples")
+MAX_ERRORS = 20
+
+
+class Stage:
+    """Timer and counters of one pipeline stage; every run of the same stage adds up."""
+
+    def __init__(self, name: str, report: "RunReport"):
+        self.name = name
+        self.report = report
+        self.calls = 0
+        self.elapsed_s = 0.0
+        self.failed = 0
+        self.counters: Dict[str, int] = {c: 0 for c in COUNTERS}
+        self.errors: List[str] = []
+        self._lock = threading.Lock()
+        self._started: Optional[float] = None
+        self._profiler = None
+
+    def add(self, **counts: int) -> None:
+        with self._lock:
+            for key, value in counts.items():
+                self.counters[key] = self.counters.get(key, 0) + int(value)
+
+    def error(self, message: Any) -> None:
+        """Record a failure that the stage handled and carried on from."""
+        with self._lock:
+            self.counters["errors"] = self.counters.get("errors", 0) + 1
+            if len(self.errors) < MAX_ERRORS:
+                self.errors.append(str(message))
+
+    def start(self) -> "Stage":
+        self.calls += 1
+        self._started = time.perf_counter()
+        self._profiler = self.report._start_profiler(self.name)
+        return self
+
+    def stop(self, exc: Optional[BaseException] = None) -> None:
+        if self._started is None:
+            return
+        self.elapsed_s += time.perf_counter() - self._started
+        self._started = None
+        if self._profiler is not None:
+            self.report._stop_profiler(self.name, self._profiler)
+            self._profiler = None
+        if exc is not None:
+            self.failed += 1
+            self.error(f"{type(exc).__name__}: {exc}")
+
+    def __enter__(self) -> "Stage":
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.stop(exc if isinstance(exc, Exception) else None)
+        return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = self.elapsed_s
+        if self._started is not None:
+            elapsed += time.perf_counter() - self._started
+        out = {
+            "status": "running" if self._started is not None else ("failed" if self.failed else "ok"),
+            "calls": self.calls,
+            "elapsed_s": round(elapsed, 6),
+            "failed": self.failed,
+            "counters": dict(self.counters),
+        }
+        if elapsed > 0:
+            out["rates_per_s"] = {k: v / elapsed for k, v in self.counters.items()
+                                  if k in ("bytes_downloaded", "files_read", "files_written", "samples") and v}
+        if self.errors:
+            out["errors"] = list(self.errors)
+        return out
+
+
+class RunReport:
+    """Per-stage timings and counters of one script run, written as a JSON report."""
+
+    def __init__(self, name: str, report_dir: Optional[str] = "run_reports",
+                 profile_stage: Optional[str] = None, profiler: str = "cprofile",
+                 profile_dir: str = "profiles"):
+        self.name = name
+        self.report_dir = report_dir
+        self.profile_stage = profile_stage
+        self.profiler = profiler
+        self.profile_dir = profile_dir
+        self.started_at = datetime.now()
+        self._started = time.perf_counter()
+        self.stages: Dict[str, Stage] = {}
+        self._lock = threading.Lock()
+
+    def stage(self, name: str) -> Stage:
+        with self._lock:
+            if name not in self.stages:
+                self.stages[name] = Stage(name, self)
+            return self.stages[name]
+
+    def merge(self, stages: Dict[str, Dict[str, Any]]) -> None:
+        """Fold in `to_dict()["stages"]` of a report from a worker process."""
+        for name, data in stages.items():
+            st = self.stage(name)
+            with st._lock:
+                st.calls += data["calls"]
+                st.elapsed_s += data["elapsed_s"]
+                st.failed += data["failed"]
+                for key, value in data["counters"].items():
+                    st.counters[key] = st.counters.get(key, 0) + value
+                st.errors.extend(data.get("errors", [])[:MAX_ERRORS - len(st.errors)])
+
+    def _start_profiler(self, name: str):
+        if name != self.profile_stage:
+            return None
+        if self.profiler == "pyinstrument":
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                print("pyinstrument is not installed, profiling with cProfile instead")
+            else:
+                profiler = Profiler()
+                profiler.start()
+                return profiler
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def _stop_profiler(self, name: str, profiler) -> None:
+        os.makedirs(self.profile_dir, exist_ok=True)
+        stamp = self.started_at.strftime("%Y%m%d_%H%M%S")
+        base = os.path.join(self.profile_dir, f"{self.name}_{name}_{stamp}")
+        if hasattr(profiler, "output_html"):
+            profiler.stop()
+            path = base + ".html"
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(profiler.output_html())
+        else:
+            profiler.disable()
+            path = base + ".prof"
+            profiler.dump_stats(path)
+        print(f"Profile of stage '{name}' written to {path}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "script": self.name,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "elapsed_s": round(time.perf_counter() - self._started, 6),
+            "stages": {name: st.to_dict() for name, st in self.stages.items()},
+        }
+
+    def summary(self) -> str:
+        lines = []
+        for name, st in self.stages.items():
+            counts = ", ".join(f"{k}={v}" for k, v in st.counters.items() if v)
+            lines.append(f"  {name:<16} {st.elapsed_s:9.2f}s  x{st.calls}"
+                         f"{'  FAILED' if st.failed else ''}{'  ' + counts if counts else ''}")
+        return "\n".join(lines)
+
+    def write(self, path: Optional[str] = None) -> Optional[str]:
+        if path is None:
+            if not self.report_dir:
+                return None
+            stamp = self.started_at.strftime("%Y%m%d_%H%M%S")
+            path = os.path.join(self.report_dir, f"{self.name}_{stamp}_{os.getpid()}.json")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=1)
+        os.replace(tmp, path)
+        return path
+
+
+_current: Optional[RunReport] = None
+
+
+def current() -> RunReport:
+    """The report of this process; a silent one is created if `setup` was never called."""
+    global _current
+    if _current is None:
+        _current = RunReport(os.path.splitext(os.path.basename(
+            getattr(__import__("__main__"), "__file__", "run")))[0], report_dir=None)
+    return _current
+
+
+def stage(name: str) -> Stage:
+    return current().stage(name)
+
+
+def timed(name: str):
+    """Decorator running the whole function as one call of stage `name`."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def setup(config: Dict[str, Any], name: str, write_at_exit: bool = True) -> RunReport:
+    """Start this script's report from the `instrumentation` config block.
+
+    With `write_at_exit` the JSON report and a short summary are written when
+    the interpreter exits, so runs that stop early through sys.exit still report.
+    """
+    global _current
+    cfg = config.get("instrumentation", {})
+    _current = RunReport(name, report_dir=cfg.get("report_dir", "run_reports"),
+                         profile_stage=os.environ.get("MSNOISE_DEMO_PROFILE") or cfg.get("profile_stage"),
+                         profiler=cfg.get("profiler", "cprofile"),
+                         profile_dir=cfg.get("profile_dir", "profiles"))
+    if write_at_exit:
+        atexit.register(_finish, _current)
+    return _current
+
+
+def _finish(report: RunReport) -> None:
+    if not report.stages:
+        return
+    path = report.write()
+    print("\nStage timings:\n" + report.summary())
+    if path:
+        print(f"Run report written to {path}")
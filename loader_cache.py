@@ -0,0 +1,139 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import instrumentation
+
+DEFAULT_BUDGET_MB = 512
+
+
+def estimate_size(value: Any) -> int:
+    """Bytes held by a loaded object: arrays, ObsPy streams, DataFrames, or tuples of them."""
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    if hasattr(value, "traces"):
+        return sum(estimate_size(tr.data) for tr in value.traces) + sys.getsizeof(value)
+    if hasattr(value, "memory_usage"):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value.values())
+    return sys.getsizeof(value)
+
+
+class LoaderCache:
+    """LRU of decoded files keyed on (path, size, mtime) plus whatever options shaped the result.
+
+    A file that changes on disk gets a new key, so a stale entry is never
+    returned; the old one is dropped on the next miss for that path. Entries
+    are evicted least-recently-used first once `max_bytes` is exceeded; an
+    object larger than the whole budget is returned without being kept.
+    Hits, misses and evictions are counted here and in the `loader_cache`
+    stage of the run report.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_BUDGET_MB * 1024 ** 2):
+        self.max_bytes = max(0, int(max_bytes))
+        self._entries: "OrderedDict[Tuple, Tuple[Any, int]]" = OrderedDict()
+        self._by_path: Dict[Tuple, Tuple] = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, path: str, loader: Callable[[str], Any], *options: Hashable,
+            stamp: Optional[Tuple[int, int]] = None,
+            sizeof: Callable[[Any], int] = estimate_size) -> Any:
+        """`loader(path)` through the cache; `stamp` is (size, mtime_ns) when the caller already has it."""
+        path = os.path.abspath(path)
+        if stamp is None:
+            st = os.stat(path)
+            stamp = (st.st_size, st.st_mtime_ns)
+        key = (path, tuple(stamp), options)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if entry is not None:
+            instrumentation.stage("loader_cache").add(hits=1)
+            return entry[0]
+
+        value = loader(path)
+        size = sizeof(value)
+        evicted = 0
+        with self._lock:
+            self.misses += 1
+            stale = self._by_path.get((path, options))
+            if stale is not None and stale != key:
+                self._drop(stale)
+            if size <= self.max_bytes:
+                self._entries[key] = (value, size)
+                self._by_path[(path, options)] = key
+                self.bytes += size
+                evicted = self._evict()
+        instrumentation.stage("loader_cache").add(misses=1, evictions=evicted, bytes_loaded=size)
+        return value
+
+    def _evict(self) -> int:
+        # Least recently used first, until the budget holds; called with the lock held.
+        evicted = 0
+        while self.bytes > self.max_bytes and self._entries:
+            self._drop(next(iter(self._entries)))
+            evicted += 1
+        self.evictions += evicted
+        return evicted
+
+    def resize(self, max_bytes: int) -> None:
+        with self._lock:
+            self.max_bytes = max(0, int(max_bytes))
+            evicted = self._evict()
+        if evicted:
+            instrumentation.stage("loader_cache").add(evictions=evicted)
+
+    def _drop(self, key: Tuple) -> None:
+        _, size = self._entries.pop(key, (None, 0))
+        self.bytes -= size
+        if self._by_path.get((key[0], key[2])) == key:
+            del self._by_path[(key[0], key[2])]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_path.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self._entries), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "hit_rate": self.hits / lookups if lookups else None}
+
+
+_shared: Optional[LoaderCache] = None
+
+
+def shared(viz_cfg: Optional[dict] = None) -> LoaderCache:
+    """The process-wide cache used by both visualization scripts.
+
+    The first caller that passes the visualization config sets the budget
+    (`loader_cache_mb`); a later, different value resizes the cache.
+    """
+    global _shared
+    if _shared is None:
+        _shared = LoaderCache()
+    if viz_cfg is not None:
+        max_bytes = int(float(viz_cfg.get("loader_cache_mb", DEFAULT_BUDGET_MB)) * 1024 ** 2)
+        if max_bytes != _shared.max_bytes:
+            _shared.resize(max_bytes)
+    return _shared
+
+
+def read_stream(path: str, stamp: Optional[Tuple[int, int]] = None, cache: Optional[LoaderCache] = None):
+    """obspy.read through the shared cache; callers must not modify the returned stream in place."""
+    import obspy
+
+    return (cache or shared()).get(path, obspy.read, stamp=stamp)
@@ -0,0 +1,185 @@
+import calendar
+import mmap
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from itertools import repeat
+from typing import Any, Dict, List, Optional, Tuple
+
+# Fixed section of data header (SEED 2.4, ch. 8), byte order prefix added per record.
+FIXED_HEADER = "6scc5s2s3s2sHHBBBBHHhhBBBBiHH"
+EPOCH = datetime(1970, 1, 1)
+
+_year_start: Dict[int, int] = {}
+
+
+def _epoch_seconds(year: int, doy: int, hour: int, minute: int, sec: int, fract: int) -> float:
+    if year not in _year_start:
+        _year_start[year] = calendar.timegm((year, 1, 1, 0, 0, 0))
+    return (_year_start[year] + (doy - 1) * 86400 + hour * 3600 + minute * 60 + sec
+            + fract * 0.0001)
+
+
+def _sample_rate(factor: int, multiplier: int) -> float:
+    if factor == 0 or multiplier == 0:
+        return 0.0
+    if factor > 0 and multiplier > 0:
+        return float(factor * multiplier)
+    if factor > 0 > multiplier:
+        return -factor / multiplier
+    if factor < 0 < multiplier:
+        return -multiplier / factor
+    return 1.0 / (factor * multiplier)
+
+
+def read_record_headers(path: str) -> List[Dict[str, Any]]:
+    """Walk the fixed headers of a MiniSEED 2 file without decoding any samples."""
+    records = []
+    size = os.path.getsize(path)
+    if size < 64:
+        raise ValueError("file too small for MiniSEED")
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        offset = 0
+        while offset + 48 <= size:
+            # Byte order is not flagged in the header; a sane year decides it.
+            year = struct.unpack_from(">H", mm, offset + 20)[0]
+            bo = ">" if 1900 <= year <= 2100 else "<"
+            (_, quality, _, sta, loc, cha, net, year, doy, hour, minute, sec, _, fract,
+             nsamp, factor, multiplier, activity, _, _, nblockettes, correction,
+             _, next_blockette) = struct.unpack_from(bo + FIXED_HEADER, mm, offset)
+            if quality not in (b"D", b"R", b"Q", b"M"):
+                raise ValueError(f"not a MiniSEED data record at byte {offset}")
+
+            rate = _sample_rate(factor, multiplier)
+            reclen = None
+            for _ in range(nblockettes):
+                if not next_blockette or offset + next_blockette + 4 > size:
+                    break
+                btype, following = struct.unpack_from(bo + "HH", mm, offset + next_blockette)
+                if btype == 1000:
+                    reclen = 2 ** mm[offset + next_blockette + 6]
+                elif btype == 100:
+                    rate = struct.unpack_from(bo + "f", mm, offset + next_blockette + 4)[0]
+                next_blockette = following
+            if reclen is None:
+                raise ValueError("record without blockette 1000")
+
+            start = _epoch_seconds(year, doy, hour, minute, sec, fract)
+            if not activity & 0x02:
+                start += correction * 0.0001
+            records.append({
+                "net": net.decode().strip(), "sta": sta.decode().strip(),
+                "loc": loc.decode().strip(), "chan": cha.decode().strip(),
+                "start": start, "nsamp": nsamp, "rate": rate,
+            })
+            offset += reclen
+    return records
+
+
+def summarize_records(records: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    records = [r for r in records if r["nsamp"] > 0 and r["rate"] > 0]
+    if not records:
+        return None
+    first = records[0]
+    chan_records = sorted(
+        (r for r in records if (r["net"], r["sta"], r["loc"], r["chan"]) ==
+         (first["net"], first["sta"], first["loc"], first["chan"])),
+        key=lambda r: r["start"])
+
+    rate = chan_records[0]["rate"]
+    delta = 1.0 / rate
+    seg_start = chan_records[0]["start"]
+    seg_end = seg_start + (chan_records[0]["nsamp"] - 1) * delta
+    data_duration = 0.0
+    gaps_duration = 0.0
+    for r in chan_records[1:]:
+        r_end = r["start"] + (r["nsamp"] - 1) * delta
+        expected = seg_end + delta
+        # Same half-sample tolerance ObsPy uses when deciding traces are contiguous.
+        if r["start"] - expected > 0.5 * delta:
+            data_duration += seg_end - seg_start
+            gaps_duration += r["start"] - expected
+            seg_start = r["start"]
+        seg_end = max(seg_end, r_end)
+    data_duration += seg_end - seg_start
+
+    return {
+        "net": first["net"], "sta": first["sta"], "loc": first["loc"], "chan": first["chan"],
+        "starttime": chan_records[0]["start"], "endtime": seg_end,
+        "data_duration": data_duration, "gaps_duration": gaps_duration,
+        "samplerate": rate,
+    }
+
+
+def _scan_with_obspy(path: str) -> Optional[Dict[str, Any]]:
+    import obspy
+
+    st = obspy.read(path, headonly=True)
+    if not len(st):
+        return None
+    st.sort(keys=["starttime"])
+    tr = st[0]
+    gaps = sum(max(g[6], 0) for g in st.get_gaps())
+    return {
+        "net": tr.stats.network, "sta": tr.stats.station,
+        "loc": tr.stats.location, "chan": tr.stats.channel,
+        "starttime": st[0].stats.starttime.timestamp,
+        "endtime": max(t.stats.endtime for t in st).timestamp,
+        "data_duration": sum(t.stats.endtime - t.stats.starttime for t in st),
+        "gaps_duration": gaps, "samplerate": tr.stats.sampling_rate,
+    }
+
+
+def to_datetime(timestamp: float) -> datetime:
+    return EPOCH + timedelta(seconds=timestamp)
+
+
+def scan_file(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        return summarize_records(read_record_headers(path))
+    except (ValueError, struct.error, OSError):
+        # Unusual encodings (no blockette 1000, MiniSEED 3) go through ObsPy.
+        return _scan_with_obspy(path)
+
+
+def scan_directory(root: str, files: List[str], sds_root: str) -> List[Dict[str, Any]]:
+    rows = []
+    rel_dir = os.path.relpath(root, sds_root)
+    for file in files:
+        try:
+            info = scan_file(os.path.join(root, file))
+        except Exception as e:
+            print(f"   ! Could not scan {os.path.join(rel_dir, file)}: {e}")
+            info = None
+        if info is None:
+            continue
+        info["path"] = rel_dir
+        info["file"] = file
+        rows.append(info)
+    return rows
+
+
+def list_sds(sds_path: str) -> List[Tuple[str, List[str]]]:
+    jobs = []
+    for root, dirs, files in os.walk(sds_path):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        files = sorted(f for f in files if not f.startswith(".") and not f.endswith(".tmp"))
+        if files:
+            jobs.append((root, files))
+    return jobs
+
+
+def scan_jobs(jobs: List[Tuple[str, List[str]]], sds_root: str,
+              workers: int = 1) -> List[Dict[str, Any]]:
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunks = executor.map(scan_directory, [j[0] for j in jobs], [j[1] for j in jobs],
+                                  repeat(sds_root))
+            return [row for chunk in chunks for row in chunk]
+    return [row for root, files in jobs for row in scan_directory(root, files, sds_root)]
+
+
+def scan_sds(sds_path: str, sds_root: str, workers: int = 1) -> List[Dict[str, Any]]:
+    return scan_jobs(list_sds(sds_path), sds_root, workers)
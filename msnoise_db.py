@@ -0,0 +1,93 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# One connection per (database, thread): sqlite3 connections cannot be shared
+# across threads, but reopening them for every statement throws away the page
+# cache and re-runs the PRAGMA setup.
+_local = threading.local()
+
+BUSY_TIMEOUT_MS = 30000
+DEFAULT_CHUNK = 5000
+
+
+def _configure(conn: sqlite3.Connection, readonly: bool) -> None:
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    if not readonly:
+        # WAL lets MSNoise workers keep reading while availability rows are
+        # written; the mode is stored in the file, so MSNoise picks it up too.
+        conn.execute("PRAGMA journal_mode = WAL")
+        # In WAL mode NORMAL only syncs at checkpoints and stays crash-safe.
+        conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -65536")
+
+
+def connect(db_path: str, readonly: bool = False) -> sqlite3.Connection:
+    """Reused, configured connection to the MSNoise database for the calling thread."""
+    key = (os.path.abspath(db_path), readonly)
+    pool: Dict[Tuple[str, bool], sqlite3.Connection] = getattr(_local, "pool", None)
+    if pool is None:
+        pool = _local.pool = {}
+    conn = pool.get(key)
+    if conn is None:
+        if readonly:
+            conn = sqlite3.connect(f"file:{key[0]}?mode=ro", uri=True,
+                                   timeout=BUSY_TIMEOUT_MS / 1000)
+        else:
+            conn = sqlite3.connect(key[0], timeout=BUSY_TIMEOUT_MS / 1000)
+        _configure(conn, readonly)
+        pool[key] = conn
+    return conn
+
+
+def close(db_path: Optional[str] = None) -> None:
+    """Close this thread's connections (all of them, or those to `db_path`)."""
+    pool = getattr(_local, "pool", {})
+    for key in list(pool):
+        if db_path is None or key[0] == os.path.abspath(db_path):
+            pool.pop(key).close()
+
+
+def executemany_chunked(conn: sqlite3.Connection, sql: str, rows: Iterable[Sequence],
+                        chunk_size: int = DEFAULT_CHUNK, commit: bool = True) -> int:
+    """executemany in transactions of `chunk_size` rows, so the write lock is held briefly.
+
+    Any transaction already open on `conn` is committed first. With
+    `commit=False` the chunks only bound memory: they run inside the caller's
+    transaction, which the caller commits (e.g. a delete-and-reinsert that
+    readers must never see half done).
+    """
+    count = 0
+    chunk: List[Sequence] = []
+    if commit:
+        conn.commit()
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            _execute_chunk(conn, sql, chunk, commit)
+            count += len(chunk)
+            chunk = []
+    if chunk:
+        _execute_chunk(conn, sql, chunk, commit)
+        count += len(chunk)
+    return count
+
+
+def _execute_chunk(conn: sqlite3.Connection, sql: str, chunk: List[Sequence], commit: bool) -> None:
+    if commit:
+        with conn:
+            conn.executemany(sql, chunk)
+    else:
+        conn.executemany(sql, chunk)
+
+
+def set_config(conn: sqlite3.Connection, values: Dict[str, str]) -> None:
+    conn.executemany("INSERT OR REPLACE INTO config (name, value) VALUES (?, ?)",
+                     [(k, str(v)) for k, v in values.items()])
+
+
+def read_filters(db_path: str) -> List[Tuple[int, float, float]]:
+    return connect(db_path, readonly=True).execute(
+        "SELECT ref, low, high FROM filters ORDER BY ref").fetchall()
@@ -0,0 +1,346 @@
+import argparse
+import copy
+import hashlib
+import importlib.util
+import json
+import os
+import shlex
+import sqlite3
+import subprocess
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import instrumentation
+from catalog import open_catalog, split_folder
+from config_loader import load_config
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+METADATA_CSV = "downloaded_stations_metadata.csv"
+
+
+def load_script(name: str):
+    """Import one of the digit-named scripts (00_..., 02_...) once per process."""
+    module_name = f"msnoise_demo_{name.split('_', 1)[1].lower()}"
+    if module_name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(module_name, os.path.join(HERE, f"{name}.py"))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[module_name]
+
+
+def tree_fingerprint(root: Optional[str], suffixes: Optional[Sequence[str]] = None) -> Optional[str]:
+    """Hash of every file's relative path, size and mtime under `root` (None if it is missing)."""
+    if not root or not os.path.isdir(root):
+        return None
+    h = hashlib.sha1()
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = sorted(os.scandir(directory), key=lambda e: e.name)
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.name.startswith(".") or entry.name.endswith(".tmp"):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            elif not suffixes or entry.name.endswith(tuple(suffixes)):
+                st = entry.stat()
+                h.update(f"{os.path.relpath(entry.path, root)}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+
+def file_fingerprint(path: Optional[str]) -> Optional[List[int]]:
+    if not path or not os.path.exists(path):
+        return None
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def availability_fingerprint(db_path: str) -> Optional[List[Any]]:
+    # A summary of data_availability ignoring the flag column, which MSNoise
+    # itself rewrites when it creates jobs.
+    if not os.path.exists(db_path):
+        return None
+    try:
+        conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+        row = conn.execute("SELECT COUNT(*), TOTAL(data_duration), TOTAL(gaps_duration), "
+                           "MAX(endtime) FROM data_availability").fetchone()
+        conn.close()
+        return list(row)
+    except sqlite3.Error:
+        return None
+
+
+class Stage:
+    def __init__(self, name: str, deps: Sequence[str], run: Callable[[Dict[str, Any]], bool],
+                 inputs: Callable[[Dict[str, Any]], Any], always: Callable[[Dict[str, Any]], bool] = None):
+        self.name = name
+        self.deps = list(deps)
+        self.run = run
+        self.inputs = inputs
+        # Stages whose inputs live outside this tree (the FDSN servers) can ask to run anyway.
+        self.always = always or (lambda config: False)
+
+
+def _stage_ok(*names: str) -> bool:
+    """False if any item of these stages failed (e.g. one station-day); the stage then runs again next time."""
+    report = instrumentation.current()
+    for name in names:
+        st = report.stages.get(name)
+        if st and (st.failed or st.counters.get("errors") or st.counters.get("files_failed")):
+            return False
+    return True
+
+
+def _run_download(config):
+    load_script("00_Config_setting").step1_search_and_download(config)
+    return _stage_ok("download")
+
+
+def _run_sds(config):
+    load_script("00_Config_setting").step2_process_to_sds(config)
+    return _stage_ok("sds")
+
+
+def _run_scan(config):
+    load_script("00_Config_setting").step3_scan_to_db(config)
+    return _stage_ok("scan")
+
+
+def _run_cc(config):
+    import cc_engine
+
+    cc_engine.run(config)
+    return _stage_ok("cc")
+
+
+def _run_msnoise(config):
+    commands = config.get("pipeline", {}).get("msnoise_commands", [])
+    if not commands:
+        print("No msnoise_commands configured; run the MSNoise jobs yourself.")
+        return True
+    workdir = os.path.dirname(os.path.abspath(config.get("data_scan", {}).get("db_path", "msnoise.sqlite")))
+    with instrumentation.stage("msnoise") as st:
+        for command in commands:
+            print(f"--> {command}")
+            proc = subprocess.run(shlex.split(command), cwd=workdir)
+            if proc.returncode:
+                # Later commands and the figures depend on this one's output.
+                raise RuntimeError(f"'{command}' exited with {proc.returncode}")
+    return True
+
+
+def _visualizer(config):
+    return load_script("02_Analysis").MSNoiseVisualizer(config["_config_path"])
+
+
+def _run_figures(config):
+    pipe_cfg = config.get("pipeline", {})
+    _visualizer(config).run_batch(pipe_cfg.get("components"), pipe_cfg.get("figure_workers"),
+                                  force=config.get("_force", False))
+    return _stage_ok("batch")
+
+
+def _run_stretching(config):
+    _visualizer(config).plot_stretching_dvv()
+    return _stage_ok("stretching")
+
+
+def _dates(config):
+    search = config.get("search_criteria", {})
+    return search.get("start_date"), search.get("end_date")
+
+
+def _download_always(config):
+    # New days keep appearing on the servers until the range lies in the past;
+    # the manifest makes such reruns cheap.
+    end = config.get("search_criteria", {}).get("end_date")
+    return not end or end[:10] >= datetime.now().strftime("%Y-%m-%d")
+
+
+def _sds_folder(config):
+    return os.path.abspath(config.get("seismic_processing", {}).get("output_folder", "SDS"))
+
+
+def _viz_roots(config):
+    viz = config.get("visualization", {})
+    cc = viz.get("cc_files") or viz.get("cc_files_template", "").format(
+        filter_set=viz.get("filter_set"), component=viz.get("component"))
+    dtt = viz.get("dtt_folder") or viz.get("dtt_folder_template", "").format(
+        filter_set=viz.get("filter_set"), component=viz.get("component"))
+    # STACKS/{filter}/{stack}/{comp} -> STACKS, DTT likewise.
+    return tuple(split_folder(p)[0] if p else None for p in (cc, dtt))
+
+
+def catalog_fingerprint(config, root: Optional[str], kind: str) -> Optional[str]:
+    """tree_fingerprint of a STACKS/DTT tree, read from the catalog after an incremental refresh."""
+    if not root or not os.path.isdir(root):
+        return None
+    catalog = open_catalog(config.get("visualization", {}))
+    try:
+        catalog.refresh(root, kind)
+        return catalog.fingerprint(root)
+    finally:
+        catalog.close()
+
+
+STAGES = [
+    Stage("download", [], _run_download,
+          lambda c: [c.get("search_criteria"), c.get("download")], always=_download_always),
+    Stage("sds", ["download"], _run_sds,
+          lambda c: [c.get("seismic_processing"),
+                     tree_fingerprint(c.get("seismic_processing", {}).get("source_folder"), [".mseed"])]),
+    Stage("scan", ["sds"], _run_scan,
+          lambda c: [c.get("data_scan"), _dates(c), tree_fingerprint(_sds_folder(c)),
+                     file_fingerprint(METADATA_CSV)]),
+    Stage("msnoise", ["scan"], _run_msnoise,
+          lambda c: [c.get("pipeline", {}).get("msnoise_commands"),
+                     availability_fingerprint(c.get("data_scan", {}).get("db_path", "msnoise.sqlite"))]),
+    Stage("cc", ["sds"], _run_cc,
+          lambda c: [c.get("cc_engine"), c.get("data_scan", {}).get("filter_config"), _dates(c),
+                     tree_fingerprint(c.get("cc_engine", {}).get("sds_folder") or _sds_folder(c))]),
+    Stage("figures", ["msnoise", "cc"], _run_figures,
+          lambda c: [c.get("visualization"), c.get("pipeline", {}).get("components"),
+                     [catalog_fingerprint(c, r, k) for r, k in zip(_viz_roots(c), ("ccf", "dtt"))]]),
+    Stage("stretching", ["msnoise", "cc"], _run_stretching,
+          lambda c: [c.get("visualization"), c.get("stretching"), catalog_fingerprint(c, _viz_roots(c)[0], "ccf")]),
+]
+STAGE_NAMES = [s.name for s in STAGES]
+DEFAULT_STAGES = ["download", "sds", "scan", "msnoise", "figures"]
+
+
+def _fingerprint(value: Any) -> str:
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class Pipeline:
+    """Runs the selected stages in dependency order, skipping those whose inputs are unchanged.
+
+    A stage's fingerprint covers its configuration and the files it reads
+    (e.g. the raw tree for `sds`, the SDS tree for `scan`), so a stage that
+    rewrites its outputs automatically invalidates the stages below it.
+    Stages whose dependencies are all done run concurrently.
+    """
+
+    def __init__(self, config: Dict[str, Any], state_path: str, force: bool = False,
+                 max_parallel: int = 2):
+        self.config = config
+        self.state_path = state_path
+        self.force = force
+        self.max_parallel = max(1, max_parallel)
+        self.state = self._load_state()
+        self._lock = threading.Lock()
+
+    def _load_state(self) -> Dict[str, Any]:
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return {}
+
+    def _save_state(self) -> None:
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.state_path)
+
+    def _execute(self, stage: Stage) -> str:
+        fingerprint = _fingerprint(stage.inputs(self.config))
+        previous = self.state.get(stage.name, {})
+        if not self.force and not stage.always(self.config) and previous.get("fingerprint") == fingerprint:
+            print(f"[pipeline] {stage.name}: inputs unchanged, skipped")
+            return "skipped"
+
+        print(f"[pipeline] {stage.name}: running")
+        try:
+            status = "done" if stage.run(self.config) else "partial"
+        except Exception as e:
+            print(f"[pipeline] {stage.name}: failed ({e})")
+            instrumentation.stage(stage.name).error(e)
+            status = "failed"
+        if status == "partial":
+            # Handled per-item failures are in the run report; what succeeded
+            # is usable downstream, and the stage retries the rest next time.
+            print(f"[pipeline] {stage.name}: finished with errors, runs again next time")
+        with self._lock:
+            # Inputs are fingerprinted again after the run: a stage may only
+            # be skipped next time if nothing changed under it since.
+            self.state[stage.name] = {
+                "fingerprint": _fingerprint(stage.inputs(self.config)) if status == "done" else None,
+                "finished_at": datetime.now().isoformat(timespec="seconds"),
+                "status": {"done": "ok"}.get(status, status),
+            }
+            self._save_state()
+        return status
+
+    def run(self, selected: Sequence[str]) -> Dict[str, str]:
+        stages = [s for s in STAGES if s.name in selected]
+        results: Dict[str, str] = {}
+        pending = {s.name: s for s in stages}
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_parallel) as executor:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    deps = [d for d in stage.deps if d in selected]
+                    # Only a stage that raised blocks its dependents; "partial" ones do not.
+                    if any(results.get(d) in ("failed", "blocked") for d in deps):
+                        print(f"[pipeline] {name}: not run, an upstream stage failed")
+                        results[name] = "blocked"
+                        del pending[name]
+                    elif all(d in results for d in deps):
+                        running[executor.submit(self._execute, stage)] = name
+                        del pending[name]
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+        return results
+
+
+def build_config(config_path: str, start: Optional[str] = None, end: Optional[str] = None,
+                 force: bool = False) -> Dict[str, Any]:
+    config = copy.deepcopy(load_config(config_path))
+    search = config.setdefault("search_criteria", {})
+    if start:
+        search["start_date"] = start
+    if end:
+        search["end_date"] = end
+    config["_config_path"] = config_path
+    config["_force"] = force
+    return config
+
+
+def main(argv: Optional[List[str]] = None, default_stages: Sequence[str] = DEFAULT_STAGES,
+         report_name: str = "pipeline") -> Dict[str, str]:
+    parser = argparse.ArgumentParser(description="Run the download -> SDS -> scan -> MSNoise -> figures pipeline")
+    parser.add_argument("--config", default="config.json")
+    parser.add_argument("--stages", help=f"comma-separated stages to run ({','.join(STAGE_NAMES)}); "
+                                         f"default: {','.join(default_stages)}")
+    parser.add_argument("--start", help="override search_criteria.start_date (YYYY-MM-DD)")
+    parser.add_argument("--end", help="override search_criteria.end_date (YYYY-MM-DD)")
+    parser.add_argument("--force", action="store_true", help="run the selected stages even if their inputs are unchanged")
+    args = parser.parse_args(argv)
+
+    selected = args.stages.split(",") if args.stages else list(default_stages)
+    unknown = [s for s in selected if s not in STAGE_NAMES]
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(unknown)}")
+
+    config = build_config(args.config, args.start, args.end, args.force)
+    instrumentation.setup(config, report_name)
+    pipe_cfg = config.get("pipeline", {})
+    pipeline = Pipeline(config, pipe_cfg.get("state_path", ".pipeline_state.json"), args.force,
+                        int(pipe_cfg.get("max_parallel_stages", 2)))
+    results = pipeline.run(selected)
+    print("\n[pipeline] " + ", ".join(f"{name}: {status}" for name, status in results.items()))
+    return results
+
+
+if __name__ == "__main__":
+    main()
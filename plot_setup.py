@@ -0,0 +1,76 @@
+import glob
+import json
+import os
+
+FONT_FAMILY = "Nimbus Sans"
+FONT_SIZE = 13
+FONT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "msnoise_demo", "fonts.json")
+RENDER_MODES = ("full", "fast", "preview")
+
+_pyplot = None
+
+
+def resolve_font(family: str = FONT_FAMILY) -> str:
+    """`family` if matplotlib can find it, else its default sans-serif.
+
+    The answer is cached on disk, keyed on matplotlib's own font list, so
+    later runs neither repeat the lookup nor print a findfont warning per text.
+    """
+    import matplotlib
+
+    fontlists = glob.glob(os.path.join(matplotlib.get_cachedir(), "fontlist-*.json"))
+    key = f"{matplotlib.__version__}:{max((os.path.getmtime(p) for p in fontlists), default=0)}:{family}"
+    cache = {}
+    if os.path.exists(FONT_CACHE):
+        try:
+            with open(FONT_CACHE, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+    if key in cache:
+        return cache[key]
+
+    from matplotlib import font_manager
+    try:
+        font_manager.findfont(family, fallback_to_default=False)
+        resolved = family
+    except ValueError:
+        resolved = "sans-serif"
+    cache = {k: v for k, v in cache.items() if not k.startswith(matplotlib.__version__ + ":")}
+    cache[key] = resolved
+    try:
+        os.makedirs(os.path.dirname(FONT_CACHE), exist_ok=True)
+        with open(FONT_CACHE, "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+    except OSError:
+        pass  # read-only home: the lookup is simply repeated next run
+    return resolved
+
+
+def pyplot():
+    """matplotlib.pyplot, imported on first use with the non-interactive Agg backend and the figure font."""
+    global _pyplot
+    if _pyplot is None:
+        import matplotlib
+        if "MPLBACKEND" not in os.environ:
+            matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+        plt.rcParams['font.family'] = resolve_font()
+        plt.rcParams['font.size'] = FONT_SIZE
+        _pyplot = plt
+    return _pyplot
+
+
+def render_settings(viz_cfg: dict, mode: str = None):
+    """(mode, dpi) for the figures: `render_mode` unless `mode` overrides it; `preview` uses `preview_dpi`."""
+    mode = mode or viz_cfg.get("render_mode", "full")
+    if mode not in RENDER_MODES:
+        raise ValueError(f"Unknown render_mode '{mode}', expected one of {', '.join(RENDER_MODES)}")
+    if mode == "preview":
+        return mode, int(viz_cfg.get("preview_dpi", 72))
+    return mode, int(viz_cfg.get("figure_dpi", 300))
+
+
+def pixel_budget(figsize, dpi):
+    """Width and height of the whole figure in pixels, an upper bound for any axes in it."""
+    return int(figsize[0] * dpi), int(figsize[1] * dpi)
@@ -0,0 +1,67 @@
+import math
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+def envelope(x: np.ndarray, y: np.ndarray, n_bins: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Min/max envelope of a trace with at most 2 * n_bins points.
+
+    Each bin keeps its smallest and largest sample, in their original order,
+    so a line through them draws the same pixels as the full trace.
+    """
+    n = len(y)
+    if n_bins <= 0 or n <= 2 * n_bins:
+        return x, y
+    step = math.ceil(n / n_bins)
+    pad = (-n) % step
+    blocks = np.pad(np.asarray(y), (0, pad), mode="edge").reshape(-1, step)
+    i_min = blocks.argmin(axis=1)
+    i_max = blocks.argmax(axis=1)
+    first = np.minimum(i_min, i_max)
+    second = np.maximum(i_min, i_max)
+    base = np.arange(len(blocks)) * step
+    idx = np.empty(2 * len(blocks), dtype=np.int64)
+    idx[0::2] = base + first
+    idx[1::2] = base + second
+    np.minimum(idx, n - 1, out=idx)
+    return np.asarray(x)[idx], np.asarray(y)[idx]
+
+
+def block_mean(matrix: np.ndarray, step: int, axis: int) -> np.ndarray:
+    """NaN-aware mean over consecutive blocks of `step` entries along `axis`."""
+    if step <= 1:
+        return matrix
+    a = np.moveaxis(np.asarray(matrix, dtype=np.float64), axis, -1)
+    pad = (-a.shape[-1]) % step
+    if pad:
+        a = np.concatenate([a, np.full(a.shape[:-1] + (pad,), np.nan)], axis=-1)
+    blocks = a.reshape(a.shape[:-1] + (-1, step))
+    valid = ~np.isnan(blocks)
+    counts = valid.sum(axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = np.where(valid, blocks, 0.0).sum(axis=-1) / counts
+    out[counts == 0] = np.nan
+    return np.moveaxis(out, -1, axis)
+
+
+def reduce_to_pixels(matrix: np.ndarray, max_rows: Optional[int] = None,
+                     max_cols: Optional[int] = None) -> Tuple[np.ndarray, int, int]:
+    """Block-average a matrix down to at most max_rows x max_cols; returns (matrix, row_step, col_step)."""
+    row_step = math.ceil(matrix.shape[0] / max_rows) if max_rows else 1
+    col_step = math.ceil(matrix.shape[1] / max_cols) if max_cols else 1
+    out = block_mean(block_mean(matrix, row_step, 0), col_step, 1)
+    return out, row_step, col_step
+
+
+def centered_colormap(cmap_name: str, matrix: np.ndarray, center: float = 0.0):
+    """(cmap, vmin, vmax) coloured like seaborn's `center`: the data range, with `center` at the colormap's midpoint."""
+    import matplotlib
+    from matplotlib.colors import ListedColormap
+
+    finite = matrix[np.isfinite(matrix)]
+    vmin, vmax = (float(finite.min()), float(finite.max())) if finite.size else (center - 1.0, center + 1.0)
+    span = max(vmax - center, center - vmin) or 1.0
+    lo, hi = (vmin - center + span) / (2 * span), (vmax - center + span) / (2 * span)
+    cmap = matplotlib.colormaps[cmap_name]
+    return ListedColormap(cmap(np.linspace(lo, hi, cmap.N))), vmin, vmax
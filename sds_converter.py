@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import sqlite3
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+import numpy as np
+import obspy
+from obspy import Trace, UTCDateTime
+
+
+def normalize_channel(original_chan: str) -> Tuple[str, str]:
+    if len(original_chan) >= 1:
+        last_char = original_chan[-1].upper()
+
+        if last_char in ['Z', 'N', 'E']:
+            return original_chan, f"Keep the chanels ({original_chan})"
+        elif last_char == '1':
+            new_chan = original_chan[:-1] + 'N'
+            return new_chan, f"Modify the chanel ({original_chan} -> {new_chan})"
+        elif last_char == '2':
+            new_chan = original_chan[:-1] + 'E'
+            return new_chan, f"Modify the chanel ({original_chan} -> {new_chan})"
+        else:
+            return "HHZ", f"Force the component of DAS to Z (bc it's {last_char})"
+    return "HHZ", "Force the component of DAS to Z (because no channel name)"
+
+
+def split_by_day(tr: Trace) -> List[Tuple[UTCDateTime, Trace]]:
+    npts = tr.stats.npts
+    if npts == 0:
+        return []
+    sr = tr.stats.sampling_rate
+    start = tr.stats.starttime
+    first_day = UTCDateTime(start.date)
+    n_days = int((tr.stats.endtime - first_day) // 86400) + 1
+
+    # Index of the first sample at or after each following midnight, all at once.
+    # The small tolerance keeps a sample stamped exactly at midnight in the new day.
+    offsets = np.arange(1, n_days + 1) * 86400.0 - (start - first_day)
+    bounds = np.concatenate(([0], np.ceil(offsets * sr - 1e-6).astype(np.int64)))
+    np.clip(bounds, 0, npts, out=bounds)
+
+    days = []
+    for i in range(n_days):
+        i0, i1 = int(bounds[i]), int(bounds[i + 1])
+        if i1 <= i0:
+            continue
+        header = tr.stats.copy()
+        header.starttime = start + i0 / sr
+        header.npts = i1 - i0
+        # Basic slicing returns a view, so no sample data is copied here.
+        days.append((first_day + i * 86400, Trace(data=tr.data[i0:i1], header=header)))
+    return days
+
+
+def sds_relpath(net: str, sta: str, chan: str, day: UTCDateTime) -> str:
+    year = str(day.year)
+    return os.path.join(year, net, sta, f"{net}.{sta}..{chan}.D.{year}.{day.julday:03d}")
+
+
+def list_outputs(filepath: str, verbose: bool = False) -> Dict[str, Any]:
+    """SDS day files (relative paths) a raw file contributes to, from its headers only."""
+    result = {"path": filepath, "outputs": [], "error": None}
+    try:
+        outputs = set()
+        for tr in obspy.read(filepath, headonly=True):
+            if tr.stats.npts == 0:
+                continue
+            chan, note = normalize_channel(tr.stats.channel)
+            if verbose:
+                print(f"   [DEBUG] {tr.stats.network}.{tr.stats.station} "
+                      f"original chanel: {tr.stats.channel} => {note}")
+            day = UTCDateTime(tr.stats.starttime.date)
+            while day <= tr.stats.endtime:
+                outputs.add(sds_relpath(tr.stats.network, tr.stats.station, chan, day))
+                day += 86400
+        result["outputs"] = sorted(outputs)
+    except Exception as e:
+        result["error"] = str(e).splitlines()[0] if str(e) else type(e).__name__
+    return result
+
+
+def build_day(rel_path: str, sources: List[str], output_folder: str) -> Dict[str, Any]:
+    """Write one SDS day file from every raw file that has samples in that day.
+
+    FDSN day files usually spill a few minutes past midnight, so a day is
+    assembled from its own raw file and its neighbours' tails, merged into
+    one trace, instead of being taken from whichever file is converted first.
+    """
+    result = {"path": rel_path, "written": 0, "removed": 0, "samples": 0, "error": None, "warnings": []}
+    parts = os.path.basename(rel_path).split(".")
+    net, sta, chan = parts[0], parts[1], parts[3]
+    day = UTCDateTime(year=int(parts[5]), julday=int(parts[6]))
+    final_path = os.path.join(output_folder, rel_path)
+    tmp_path = f"{final_path}.{os.getpid()}.tmp"
+    try:
+        st = obspy.Stream()
+        for src in sources:
+            for tr in obspy.read(src, starttime=day, endtime=day + 86400):
+                tr.stats.channel = normalize_channel(tr.stats.channel)[0]
+                if (tr.stats.network, tr.stats.station, tr.stats.channel) == (net, sta, chan):
+                    st += tr
+        try:
+            st.merge(method=1, fill_value='interpolate')
+        except Exception as e:
+            # Traces that cannot be merged (e.g. differing sampling rates) are
+            # written side by side; the reason is reported to the caller.
+            result["warnings"].append(f"not merged: {e}")
+
+        pieces = obspy.Stream([piece for tr in st for d, piece in split_by_day(tr) if d == day])
+        if not pieces:
+            # No raw file reaches into this day any more (e.g. a changed file got shorter).
+            if os.path.exists(final_path):
+                os.unlink(final_path)
+                result["removed"] = 1
+            return result
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        pieces.write(tmp_path, format="MSEED")
+        os.replace(tmp_path, final_path)
+        result["written"] = 1
+        result["samples"] = sum(tr.stats.npts for tr in pieces)
+    except Exception as e:
+        result["error"] = str(e).splitlines()[0] if str(e) else type(e).__name__
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    return result
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ConversionState:
+    """Index of raw files already converted, with the SDS day files each produced."""
+
+    def __init__(self, path: str, use_hash: bool = False):
+        self.use_hash = use_hash
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS raw_files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha1 TEXT,
+                outputs TEXT NOT NULL,
+                converted_at TEXT NOT NULL
+            )
+        """)
+        self.conn.commit()
+        self._known = {row[0]: row[1:4] for row in self.conn.execute(
+            "SELECT path, size, mtime_ns, sha1, outputs FROM raw_files")}
+        self._outputs = {path: json.loads(outputs) for path, outputs in self.conn.execute(
+            "SELECT path, outputs FROM raw_files")}
+
+    def plan(self, raw_files: List[str]) -> Tuple[List[str], List[str], int]:
+        new, changed, unchanged = [], [], 0
+        for path in raw_files:
+            st = os.stat(path)
+            known = self._known.get(os.path.abspath(path))
+            if known is None:
+                new.append(path)
+            elif known[0] == st.st_size and known[1] == st.st_mtime_ns:
+                unchanged += 1
+            elif self.use_hash and known[2] and known[0] == st.st_size and known[2] == file_digest(path):
+                # Touched but identical content: refresh the stat key only.
+                self.conn.execute("UPDATE raw_files SET mtime_ns = ? WHERE path = ?",
+                                  (st.st_mtime_ns, os.path.abspath(path)))
+                unchanged += 1
+            else:
+                changed.append(path)
+        self.conn.commit()
+        return new, changed, unchanged
+
+    def outputs(self, raw_files: Iterable[str]) -> Set[str]:
+        """SDS day files the given raw files produced when they were last converted."""
+        return {rel for path in raw_files for rel in self._outputs.get(os.path.abspath(path), [])}
+
+    def contributors(self, rel_paths: Iterable[str], exclude: Iterable[str] = ()) -> Dict[str, Set[str]]:
+        """Raw files recorded as producing each of the given SDS day files, minus `exclude`."""
+        wanted = set(rel_paths)
+        skip = {os.path.abspath(p) for p in exclude}
+        found: Dict[str, Set[str]] = {}
+        for path, outputs in self._outputs.items():
+            if path in skip:
+                continue
+            for rel in wanted.intersection(outputs):
+                found.setdefault(rel, set()).add(path)
+        return found
+
+    def record(self, results: List[Dict[str, Any]]) -> None:
+        rows = []
+        now = datetime.now().isoformat(timespec="seconds")
+        for r in results:
+            if r["error"]:
+                continue
+            st = os.stat(r["path"])
+            sha1 = file_digest(r["path"]) if self.use_hash else None
+            rows.append((os.path.abspath(r["path"]), st.st_size, st.st_mtime_ns, sha1,
+                         json.dumps(r["outputs"]), now))
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO raw_files VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
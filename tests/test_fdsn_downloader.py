@@ -0,0 +1,117 @@
+import fnmatch
+import io
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pytest
+from obspy import Trace, UTCDateTime, read
+from obspy.clients.fdsn import Client
+
+import download_manifest
+from fdsn_downloader import WaveformDownloader
+
+START = UTCDateTime(2025, 1, 1)
+STATIONS = {("XX", "AAA"), ("XX", "BBB")}
+CHANNELS = "HH?,BH?"
+
+
+class StandInFDSN(BaseHTTPRequestHandler):
+    """fdsnws-dataselect answering with 1 Hz HHZ data for STATIONS, 204 for anything else."""
+
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def _answer(self, lines):
+        type(self).requests.append(lines)
+        buf = io.BytesIO()
+        for net, sta, _, cha, t1, t2 in lines:
+            if (net, sta) not in STATIONS or not fnmatch.fnmatch("HHZ", cha):
+                continue
+            t1, t2 = UTCDateTime(t1), UTCDateTime(t2)
+            # Like real servers: whole records, spilling past the requested end.
+            tr = Trace(np.arange(int(t2 - t1) + 60, dtype=np.int32),
+                       header={"network": net, "station": sta, "channel": "HHZ",
+                               "sampling_rate": 1.0, "starttime": t1})
+            tr.write(buf, format="MSEED")
+        body = buf.getvalue()
+        self.send_response(200 if body else 204)
+        self.send_header("Content-Type", "application/vnd.fdsn.mseed")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        text = self.rfile.read(int(self.headers["Content-Length"])).decode()
+        self._answer([tuple(line.split()) for line in text.splitlines() if line and "=" not in line])
+
+    def do_GET(self):
+        q = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        lines = [(q["network"], q["station"], q["location"], cha, q["starttime"], q["endtime"])
+                 for cha in q["channel"].split(",")]
+        self._answer(lines)
+
+
+@pytest.fixture
+def server():
+    StandInFDSN.requests = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StandInFDSN)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+
+
+def local_client(base_url, timeout):
+    return Client(base_url, timeout=timeout, _discover_services=False)
+
+
+def make_tasks(base_url, folder, stations, n_days):
+    return [{"net": net, "sta": sta, "client": base_url,
+             "t1": START + d * 86400, "t2": START + (d + 1) * 86400,
+             "filename": str(folder / f"{net}.{sta}.{(START + d * 86400).strftime('%Y-%m-%d')}.mseed")}
+            for net, sta in stations for d in range(n_days)]
+
+
+def test_bulk_download_and_manifest_rerun(server, tmp_path):
+    manifest = download_manifest.DownloadManifest(str(tmp_path / "manifest.sqlite"))
+    stations = sorted(STATIONS) + [("XX", "ZZZ")]
+    tasks = make_tasks(server, tmp_path, stations, 3)
+    downloader = WaveformDownloader({"bulk_size": 50, "max_workers": 2},
+                                    client_factory=local_client, manifest=manifest)
+    stats = downloader.download(tasks, CHANNELS)
+
+    # One bulk request; each station's three days collapse into one window per
+    # channel. The station missing from the answer is then asked for alone.
+    first = StandInFDSN.requests[0]
+    assert len(first) == len(stations) * len(CHANNELS.split(","))
+    assert {UTCDateTime(line[5]) - UTCDateTime(line[4]) for line in first} == {3 * 86400}
+    assert stats.downloaded == 6 and stats.failed == 0
+    for task in tasks[:6]:
+        tr = read(task["filename"])[0]
+        assert tr.stats.starttime == task["t1"] and tr.stats.endtime < task["t2"]
+    manifest.close()
+
+    # These days ended long ago, so fetched and empty ones alike are final and
+    # a rerun sends no request at all.
+    manifest = download_manifest.DownloadManifest(str(tmp_path / "manifest.sqlite"))
+    done = manifest.completed("2025-01-01", "2025-01-03")
+    assert len(done) == 9
+    remaining = [t for t in tasks if (t["net"], t["sta"], t["t1"].strftime("%Y-%m-%d")) not in done]
+    StandInFDSN.requests = []
+    WaveformDownloader({"bulk_size": 50}, client_factory=local_client,
+                       manifest=manifest).download(remaining, CHANNELS)
+    assert remaining == [] and StandInFDSN.requests == []
+    manifest.close()
+
+
+def test_batches_grow_after_accepted_requests(server, tmp_path):
+    tasks = make_tasks(server, tmp_path, [("XX", "AAA")], 10)
+    WaveformDownloader({"bulk_size": 2, "max_bulk_size": 8, "max_workers": 1},
+                       client_factory=local_client).download(tasks, CHANNELS)
+    days = [int((UTCDateTime(lines[0][5]) - UTCDateTime(lines[0][4])) // 86400)
+            for lines in StandInFDSN.requests]
+    assert days == [2, 4, 4]
@@ -0,0 +1,99 @@
+import numpy as np
+import obspy
+from obspy import Trace, UTCDateTime
+
+from sds_converter import split_by_day
+
+
+def midnight_trace(dtype=np.int32):
+    # 10 Hz from 00:05 on day 1 to 00:10 on day 2.
+    rng = np.random.default_rng(0)
+    data = np.cumsum(rng.integers(-50, 50, 867000)).astype(dtype)
+    return Trace(data=data, header={"network": "XX", "station": "AAA", "channel": "HHZ",
+                                    "sampling_rate": 10.0,
+                                    "starttime": UTCDateTime(2025, 1, 1, 0, 5)})
+
+
+def test_split_by_day_sets_npts_of_each_day():
+    tr = midnight_trace()
+    days = split_by_day(tr)
+    assert [d for d, _ in days] == [UTCDateTime(2025, 1, 1), UTCDateTime(2025, 1, 2)]
+    (_, first), (_, second) = days
+    assert first.stats.npts == len(first.data) == 861000
+    assert first.stats.endtime < UTCDateTime(2025, 1, 2)
+    assert second.stats.starttime == UTCDateTime(2025, 1, 2)
+    assert second.stats.npts == len(second.data) == 6000
+    np.testing.assert_array_equal(np.concatenate([first.data, second.data]), tr.data)
+
+
+def test_split_day_traces_write_as_steim2(tmp_path):
+    tr = midnight_trace()
+    for day, piece in split_by_day(tr):
+        path = tmp_path / f"{day.julday:03d}.mseed"
+        piece.write(str(path), format="MSEED", encoding="STEIM2")
+        back = obspy.read(str(path))[0]
+        assert back.stats.starttime >= day and back.stats.endtime < day + 86400
+        np.testing.assert_array_equal(back.data, piece.data)
+
+
+def write_raw_days(folder, tr, n_days, spill=3000):
+    # One raw file per day, each running `spill` samples past the next midnight.
+    paths = []
+    per_day = int(86400 * tr.stats.sampling_rate)
+    for d in range(n_days):
+        raw = tr.copy()
+        raw.data = tr.data[d * per_day:(d + 1) * per_day + spill]
+        raw.stats.starttime = tr.stats.starttime + d * 86400
+        path = folder / f"raw_{d}.mseed"
+        raw.write(str(path), format="MSEED", encoding="STEIM2")
+        paths.append(str(path))
+    return paths
+
+
+def test_build_day_merges_neighbouring_raw_files(tmp_path):
+    from sds_converter import build_day, list_outputs
+
+    tr = midnight_trace()
+    tr.stats.starttime = UTCDateTime(2025, 1, 1)
+    tr.data = np.tile(tr.data, 2)[:2 * 864000 + 3000]
+    raw = write_raw_days(tmp_path, tr, 2)
+    outputs = [list_outputs(p)["outputs"] for p in raw]
+    day2 = outputs[1][0]
+    assert day2 in outputs[0]
+
+    result = build_day(day2, raw, str(tmp_path / "SDS"))
+    assert result["error"] is None and result["written"] == 1
+    back = obspy.read(str(tmp_path / "SDS" / day2))
+    assert len(back) == 1 and back[0].stats.npts == 864000
+    np.testing.assert_array_equal(back[0].data, tr.data[864000:2 * 864000])
+
+
+def test_build_day_removes_temp_file_on_failure(tmp_path, monkeypatch):
+    from sds_converter import build_day, list_outputs
+
+    raw = write_raw_days(tmp_path, midnight_trace(), 1, spill=0)
+
+    def broken_write(self, filename, *args, **kwargs):
+        open(filename, "wb").close()
+        raise IOError("disk full")
+
+    monkeypatch.setattr(obspy.Stream, "write", broken_write)
+    rel = list_outputs(raw[0])["outputs"][0]
+    result = build_day(rel, raw, str(tmp_path / "SDS"))
+    assert result["error"] == "disk full" and result["written"] == 0
+    assert not any(p.name.endswith(".tmp") for p in (tmp_path / "SDS").rglob("*"))
+
+
+def test_state_finds_days_and_contributors_of_changed_files(tmp_path):
+    from sds_converter import ConversionState
+
+    raw = [tmp_path / f"raw_{d}.mseed" for d in range(2)]
+    for p in raw:
+        p.write_bytes(b"x")
+    state = ConversionState(str(tmp_path / "state.sqlite"))
+    state.record([{"path": str(raw[0]), "outputs": ["d1", "d2"], "error": None},
+                  {"path": str(raw[1]), "outputs": ["d2", "d3"], "error": None}])
+    state = ConversionState(str(tmp_path / "state.sqlite"))
+    assert state.outputs([str(raw[0])]) == {"d1", "d2"}
+    assert state.contributors(["d2", "d3"], exclude=[str(raw[0])]) == {
+        "d2": {str(raw[1])}, "d3": {str(raw[1])}}
@@ -0,0 +1,98 @@
+import time
+
+_T0 = time.perf_counter()
+
+import argparse
+import sys
+
+import instrumentation
+from config_loader import load_config
+from pipeline import load_script
+from plot_setup import RENDER_MODES
+
+COMMANDS = ("ccf", "dvv", "ccf-heatmap", "dvv-heatmap", "stretching", "heatmaps", "batch")
+HEAVY_MODULES = ("numpy", "pandas", "matplotlib", "seaborn", "obspy")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="All CCF and dv/v figures behind one entry point; libraries are imported only when a plot needs them")
+    parser.add_argument("commands", nargs="*", choices=COMMANDS, default=["heatmaps"], metavar="COMMAND",
+                        help="ccf, dvv (single CCF / dv/v series of 01_Visualization_CC.py); "
+                             "ccf-heatmap, dvv-heatmap, stretching, heatmaps (both heatmaps), "
+                             "batch (all pairs) from 02_Analysis.py. Default: heatmaps")
+    parser.add_argument("--config", default="config.json")
+    parser.add_argument("--pair", help="station pair folder name, e.g. XX_STA1_XX_STA2 (default: from config)")
+    parser.add_argument("--components", help="comma-separated components for batch, e.g. ZZ,NN")
+    parser.add_argument("--workers", type=int, help="worker processes for batch")
+    parser.add_argument("--render-mode", choices=RENDER_MODES,
+                        help="override visualization.render_mode (preview: reduced data at preview_dpi)")
+    parser.add_argument("--force", action="store_true", help="re-render figures whose inputs have not changed")
+    parser.add_argument("--quiet-startup", action="store_true", help="do not print the startup time report")
+    return parser.parse_args(argv)
+
+
+def startup_report(parsed_at, config_at):
+    loaded = [m for m in HEAVY_MODULES if m in sys.modules]
+    return (f"startup {1000 * (config_at - _T0):.0f} ms "
+            f"(imports+args {1000 * (parsed_at - _T0):.0f} ms, config {1000 * (config_at - parsed_at):.0f} ms); "
+            f"heavy modules loaded: {', '.join(loaded) or 'none'}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    parsed_at = time.perf_counter()
+    config = load_config(args.config)
+    if args.render_mode:
+        config = dict(config, visualization=dict(config.get("visualization", {}), render_mode=args.render_mode))
+    config_at = time.perf_counter()
+
+    report = instrumentation.setup(config, "visualize")
+    startup = report.stage("startup")
+    startup.elapsed_s = config_at - _T0
+    startup.calls = 1
+    if not args.quiet_startup:
+        print(startup_report(parsed_at, config_at))
+
+    commands = []
+    for command in args.commands:
+        commands.extend(["ccf-heatmap", "dvv-heatmap"] if command == "heatmaps" else [command])
+
+    status = 0
+    if {"ccf", "dvv"} & set(commands):
+        quicklook = load_script("01_Visualization_CC")
+        if "ccf" in commands:
+            quicklook.plot_single_ccf(config)
+        if "dvv" in commands and quicklook.plot_dvv(config) is None:
+            status = 1
+
+    heatmap_commands = [c for c in commands if c not in ("ccf", "dvv")]
+    if heatmap_commands:
+        viz = load_script("02_Analysis").MSNoiseVisualizer(args.config, args.render_mode)
+        if not args.force:
+            # Same fingerprints as --batch: an unchanged figure is not redrawn.
+            viz.load_figure_state()
+        for command in heatmap_commands:
+            if command == "batch":
+                components = args.components.split(",") if args.components else None
+                viz.run_batch(components, args.workers, args.force)
+            elif command == "ccf-heatmap":
+                viz.plot_ccf_heatmap(args.pair)
+            elif command == "dvv-heatmap":
+                viz.plot_dvv_heatmap(args.pair)
+            elif command == "stretching":
+                viz.plot_stretching_dvv(args.pair)
+        viz.save_figure_state()
+
+    if not args.quiet_startup:
+        print(f"total {time.perf_counter() - _T0:.2f} s; heavy modules loaded: "
+              f"{', '.join(m for m in HEAVY_MODULES if m in sys.modules) or 'none'}")
+        if "loader_cache" in sys.modules:
+            stats = sys.modules["loader_cache"].shared().stats()
+            print(f"loader cache: {stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions, "
+                  f"{stats['bytes'] / 1024 ** 2:.1f} of {stats['max_bytes'] / 1024 ** 2:.0f} MB")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())